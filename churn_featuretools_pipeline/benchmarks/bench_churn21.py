@@ -0,0 +1,208 @@
+"""Benchmarks for the churn21 pipeline on synthetic data (no jemas access
+needed). Every case runs against a local sqlite database generated with
+`synthetic.generate_tables`, one per number of accounts (re-used if it
+exists). Each run of a case is started in a fresh process, so that its
+peak RSS does not depend on the runs before. Results are written as JSON
+lines; with --baseline, cases that got slower than the baseline by more
+than --tolerance are reported and the script exits with status 1.
+
+    python benchmarks/bench_churn21.py --accounts 10000 100000 1000000
+    python benchmarks/bench_churn21.py --accounts 10000 \
+        --baseline results_main.jsonl
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.dirname(__file__))
+
+from churn21.data import dates as utils_dt  # noqa: E402
+from churn21.data import fact_features as utils_ff  # noqa: E402
+from churn21.data import instrumentation as utils_instr  # noqa: E402
+from churn21.data import load as utils_ld  # noqa: E402
+import synthetic  # noqa: E402
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+CUT_OFF_DATE = date(2020, 12, 31)
+LOOKBACK_PERIOD_MONTHS = 13
+LABEL_PERIOD_MONTHS = 3
+RESULT_KEYS = ["wall_s", "cpu_s", "peak_rss_mb", "delta_rss_mb"]
+
+
+def setup_data(n_accounts: int, work_dir: str):
+    """engine on the synthetic database for n_accounts (generated if it
+    does not exist yet)
+    """
+    path = os.path.join(work_dir, f"churn21_synthetic_{n_accounts}.sqlite")
+    if os.path.isfile(path):
+        engine = synthetic.create_sqlite_engine(path)
+    else:
+        tables = synthetic.generate_tables(n_accounts)
+        engine = synthetic.create_sqlite_engine(path, tables)
+
+    return engine
+
+
+def bench_load_fact_feature_set(engine, dict_dates: dict) -> dict:
+    pop = utils_ld.filter_population(
+        utils_ld.load_population(engine), dict_dates["dt_cut_off"]
+    )
+    with utils_instr.stage("bench") as record:
+        utils_ff.load_fact_feature_set(
+            pop,
+            dict_dates["dt_cut_off"],
+            dict_dates["dt_obs_first_considered"],
+            engine,
+            n_jobs=1,
+        )
+    return record
+
+
+def bench_process_cut_off_date(engine, dict_dates: dict) -> dict:
+    dict_dfs = dict(
+        {
+            "pop": utils_ld.load_population(engine),
+            "label": utils_ld.load_label(engine),
+            "af_history": utils_ld.load_annual_fee_history(engine),
+            "af_date": utils_ld.load_annual_fee_date(engine),
+            "l_jamo_based":
+                [
+                    utils_ld.load_jamo_based_info(engine, tbl_name)
+                    for tbl_name in utils_ld.JAMO_BASED_TABLES
+                ],
+        }
+    )
+    dict_dfs.update(utils_ff.load_fact_cache([dict_dates], engine))
+    with utils_instr.stage("bench") as record:
+        utils_ld.process_cut_off_date(
+            dict_dfs, dict_dates, engine, is_test=False
+        )
+    return record
+
+
+def bench_downcast_dtypes(engine, dict_dates: dict) -> dict:
+    df = pd.read_sql(
+        "select * from jemas_base.dbo.Sales_Fact", engine,
+        parse_dates=["kauf_datum", "erfassung_datum"]
+    )
+    with utils_instr.stage("bench") as record:
+        utils_ld._downcast_dtypes(df)
+    return record
+
+
+CASES = dict(
+    {
+        "load_fact_feature_set": bench_load_fact_feature_set,
+        "process_cut_off_date": bench_process_cut_off_date,
+        "downcast_dtypes": bench_downcast_dtypes,
+    }
+)
+
+
+def run_case(
+    case: str, n_accounts: int, work_dir: str, dict_dates: dict
+) -> dict:
+    """run a case on the synthetic database for n_accounts, in a fresh
+    process (see `main`)
+    """
+    engine = setup_data(n_accounts, work_dir)
+    record = CASES[case](engine, dict_dates)
+
+    return dict({key: record[key] for key in RESULT_KEYS})
+
+
+def compare_to_baseline(
+    df_results: pd.DataFrame, path_baseline: str, tolerance: float
+) -> pd.DataFrame:
+    """median wall time per case and number of accounts vs. baseline"""
+    df_baseline = pd.read_json(path_baseline, lines=True)
+    keys = ["case", "n_accounts"]
+    df_cmp = pd.concat(
+        [
+            df_results.groupby(keys)["wall_s"].median().rename("wall_s"),
+            df_baseline.groupby(keys)["wall_s"].median().rename(
+                "wall_s_baseline"
+            ),
+        ],
+        axis=1,
+        join="inner",
+    )
+    df_cmp["ratio"] = df_cmp["wall_s"] / df_cmp["wall_s_baseline"]
+    df_cmp["is_regression"] = df_cmp["ratio"] > 1 + tolerance
+
+    return df_cmp
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--accounts", type=int, nargs="+",
+        default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument(
+        "--cases", nargs="+", choices=list(CASES), default=list(CASES)
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--work-dir", default=".benchmarks")
+    parser.add_argument("--output", default="benchmark_results.jsonl")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    dict_dates = utils_dt.handle_dates(
+        CUT_OFF_DATE, LOOKBACK_PERIOD_MONTHS, LABEL_PERIOD_MONTHS
+    )
+
+    l_results = []
+    mp_context = multiprocessing.get_context("spawn")
+    for n_accounts in args.accounts:
+        setup_data(n_accounts, args.work_dir)
+        for case in args.cases:
+            for i in range(args.repeat):
+                with ProcessPoolExecutor(1, mp_context=mp_context) as pool:
+                    record = pool.submit(
+                        run_case, case, n_accounts, args.work_dir, dict_dates
+                    ).result()
+                result = dict(
+                    {"case": case, "n_accounts": n_accounts, "repeat": i}
+                )
+                result.update(record)
+                logger.info(f"""{json.dumps(result)}""")
+                l_results.append(result)
+
+    df_results = pd.DataFrame(l_results)
+    df_results.to_json(args.output, orient="records", lines=True)
+    print(
+        df_results.groupby(["case", "n_accounts"])[
+            RESULT_KEYS].median().to_string()
+    )
+
+    if args.baseline is not None:
+        df_cmp = compare_to_baseline(
+            df_results, args.baseline, args.tolerance
+        )
+        print(df_cmp.to_string())
+        if df_cmp["is_regression"].any():
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+from datetime import date
+import logging
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.base import Engine
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+# three-part jemas names, e.g. jemas_base.dbo.Sales_Fact, are mapped to
+# single sqlite tables, e.g. jemas_base__dbo__Sales_Fact
+RE_TABLE = re.compile(r"\bjemas_\w+\.\w+\.\w+", flags=re.IGNORECASE)
+# indexed on konto_lauf_id in sqlite, the facts are semi-joined to it
+INDEXED_TABLES = ["jemas_temp.thm.churn21_population"]
+
+
+def generate_tables(
+    n_accounts: int,
+    first_month: date = date(2019, 1, 1),
+    n_months: int = 30,
+    trx_per_account_month: float = 4.0,
+    seed: int = 0
+) -> dict:
+    """generate synthetic versions of all jemas tables read by churn21,
+    with the columns the loaders select. Activity is skewed: the number of
+    transactions per account is lognormally distributed (a few heavy
+    users, many inactive accounts), merchant groups follow a Zipf law.
+
+    Parameters
+    ----------
+    n_accounts : int
+        number of konto_lauf_ids
+    first_month : date
+        first month of data (defaults to 2019-01-01)
+    n_months : int
+        number of months of data (defaults to 30)
+    trx_per_account_month : float
+        mean number of sales transactions per account and month
+        (defaults to 4.0)
+    seed : int
+        random seed (defaults to 0)
+
+    Returns
+    -------
+    dict
+        fully qualified table name -> pd.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    months = pd.date_range(first_month, periods=n_months, freq="MS")
+    t_end = months[-1] + pd.offsets.MonthEnd(0)
+    ids = np.arange(1, n_accounts + 1)
+
+    # lifetime: open at a random month (most before the first month),
+    # about a fifth of the accounts cancel within the period
+    i_open = np.clip(rng.integers(-24, n_months, n_accounts), 0, None)
+    is_churn = rng.random(n_accounts) < 0.2
+    i_close = np.where(
+        is_churn,
+        np.minimum(i_open + rng.integers(1, n_months, n_accounts), n_months),
+        n_months
+    )
+
+    tables = dict()
+    pop = _jamo_rows(rng, ids, i_open, i_close, months, n_changes=1.0)
+    pop["konto_id"] = np.where(
+        rng.random(len(pop)) < 0.02, np.nan, pop["konto_lauf_id"] * 7.0
+    )
+    tables["jemas_temp.thm.churn21_population"] = pop[
+        ["konto_lauf_id", "konto_id", "jamo"]]
+
+    for tbl_name, n_changes, d_cols in [
+        (
+            "churn21_general_information", 2.0,
+            dict(
+                {
+                    "kartenart":
+                        (["classic", "gold", "platinum"], [.7, .25, .05]),
+                    "alter": (np.arange(18, 90), None),
+                }
+            )
+        ),
+        (
+            "churn21_fakturadaten", 3.0,
+            dict(
+                {
+                    "zahlungsart": ([1, 2, 3], [.6, .3, .1]),
+                }
+            )
+        ),
+        (
+            "churn21_segments", 1.0,
+            dict(
+                {
+                    "segment": (list("ABCDEFGH"), None),
+                    "affinity_cluster": (np.arange(12), None),
+                }
+            )
+        ),
+    ]:
+        df = _jamo_rows(rng, ids, i_open, i_close, months, n_changes)
+        df["letzter_tag"] = (
+            pd.to_datetime(df["jamo"].astype(str), format="%Y%m")
+            + pd.offsets.MonthEnd(0)
+        )
+        for col, (values, p) in d_cols.items():
+            df[col] = rng.choice(values, len(df), p=p)
+        df["saldo"] = np.round(rng.lognormal(6, 1.5, len(df)), 2)
+        tables[f"jemas_temp.thm.{tbl_name}"] = df
+
+    n_label = int(is_churn.sum())
+    tables["jemas_temp.thm.churn21_label"] = pd.DataFrame(
+        {
+            "konto_lauf_id": ids[is_churn],
+            "kuendigung_an_datum":
+                months[np.minimum(i_close[is_churn], n_months - 1)]
+                + pd.to_timedelta(rng.integers(0, 28, n_label), unit="D"),
+            "cancellation_type":
+                rng.choice(["aktiv", "passiv"], n_label, p=[.8, .2]),
+        }
+    )
+
+    # annual fees on the anniversary of the opening month
+    anniversary = months[0] + pd.to_timedelta(
+        rng.integers(0, 365, n_accounts), unit="D"
+    )
+    l_fee_history = []
+    l_fee_date = []
+    for year in range(-1, n_months // 12 + 2):
+        dt_fee = anniversary + pd.DateOffset(years=year)
+        l_fee_date.append(
+            pd.DataFrame(
+                {
+                    "konto_lauf_id": ids,
+                    "jahresgebuehr_datum": dt_fee,
+                    "load_lauf_end_datum": dt_fee - pd.Timedelta(days=30),
+                }
+            )
+        )
+        is_paid = (dt_fee <= t_end) & (rng.random(n_accounts) < 0.9)
+        l_fee_history.append(
+            pd.DataFrame(
+                {
+                    "konto_lauf_id": ids[is_paid],
+                    "kauf_datum": dt_fee[is_paid],
+                    "betrag":
+                        rng.choice([50.0, 100.0, 250.0], int(is_paid.sum())),
+                }
+            )
+        )
+    tables["jemas_temp.thm.churn21_annual_fee_history"] = pd.concat(
+        l_fee_history, ignore_index=True
+    )
+    tables["jemas_temp.thm.churn21_annual_fee_date"] = pd.concat(
+        l_fee_date, ignore_index=True
+    )
+
+    activity = rng.lognormal(-0.5, 1.0, n_accounts)
+    activity = activity / activity.mean()
+    n_active_months = np.maximum(i_close - i_open, 0)
+
+    n_mcc = 400
+    tables["jemas_base.dbo.v_mcc"] = pd.DataFrame(
+        {
+            "mcc_id": np.arange(n_mcc),
+            "mcg": rng.integers(1, 31, n_mcc),
+        }
+    )
+    sales = _fact_rows(
+        rng, ids, activity * trx_per_account_month, i_open, n_active_months,
+        months
+    )
+    n = len(sales)
+    p_mcc = 1 / np.arange(1, n_mcc + 1)
+    sales = sales.assign(
+        betrag=np.round(rng.lognormal(3.5, 1.1, n), 2),
+        transaction_type_id=rng.choice([1, 2, 3, 5], n, p=[.8, .1, .07, .03]),
+        mcc_id=rng.choice(n_mcc, n, p=p_mcc / p_mcc.sum()),
+        transaktionsart_id_korr=rng.choice([0, 1, 2], n, p=[.9, .07, .03]),
+        ist_umsatz=(rng.random(n) < 0.97).astype("int8"),
+        ist_trx=(rng.random(n) < 0.98).astype("int8"),
+    )
+    tables["jemas_base.dbo.Sales_Fact"] = sales
+
+    fees = _fact_rows(
+        rng, ids, activity * 0.4, i_open, n_active_months, months
+    )
+    n = len(fees)
+    fees = fees.assign(
+        betrag=np.round(rng.lognormal(1.5, 1.0, n), 2),
+        bewegungstyp_id=rng.choice(
+            [11, 20, 31, 41, 42, 43, 44], n,
+            p=[.05, .55, .15, .1, .07, .05, .03]
+        ),
+        bewegungsgrund_id=rng.choice(
+            ["FRW", "WSZ", "ETA", "ZIN", "JGT", "JGE", "JGR", "DIV"], n,
+            p=[.15, .05, .05, .15, .03, .01, .01, .55]
+        ),
+    )
+    tables["jemas_base.dbo.Fees_Fact"] = fees
+
+    logger.info(
+        f"""generated {n_accounts} accounts, """
+        f"""{len(sales)} sales and {len(fees)} fees facts"""
+    )
+    return tables
+
+
+def create_sqlite_engine(path: str, tables: dict = None) -> Engine:
+    """sqlite engine standing in for jemas: the three-part table names in
+    the queries are rewritten on the fly. If tables are given, they are
+    written to the database first (replacing existing ones).
+
+    Parameters
+    ----------
+    path : str
+        path of the sqlite file
+    tables : dict
+        fully qualified table name -> pd.DataFrame (defaults to None)
+
+    Returns
+    -------
+    Engine
+        engine on the sqlite file
+    """
+    engine = create_engine(f"sqlite:///{os.path.abspath(path)}")
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def _rewrite_table_names(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        return RE_TABLE.sub(_sqlite_name, statement), parameters
+
+    for name, df in (tables or dict()).items():
+        logger.info(f"""writing {name} ({len(df)} rows) to sqlite""")
+        _dates_as_text(df).to_sql(
+            _sqlite_name(name),
+            engine,
+            if_exists="replace",
+            index=False,
+            chunksize=100_000
+        )
+        if name in INDEXED_TABLES:
+            with engine.begin() as conn:
+                conn.exec_driver_sql(
+                    f"CREATE INDEX ix_{_sqlite_name(name)} "
+                    f"ON {_sqlite_name(name)} (konto_lauf_id)"
+                )
+
+    return engine
+
+
+def _dates_as_text(df: pd.DataFrame) -> pd.DataFrame:
+    """datetime columns without time of day as 'YYYY-MM-DD' text, so that
+    sqlite compares them to date literals (e.g. erfassung_datum <=
+    '2020-06-03') like SQL Server does
+    """
+    cols = [
+        col for col in df.select_dtypes("datetime").columns
+        if (df[col].dropna() == df[col].dropna().dt.normalize()).all()
+    ]
+    return df.assign(**{col: df[col].dt.strftime("%Y-%m-%d") for col in cols})
+
+
+def _sqlite_name(name) -> str:
+    if not isinstance(name, str):
+        name = name.group(0)
+    return name.replace(".", "__")
+
+
+def _jamo_rows(
+    rng: np.random.Generator,
+    ids: np.ndarray,
+    i_open: np.ndarray,
+    i_close: np.ndarray,
+    months: pd.DatetimeIndex,
+    n_changes: float
+) -> pd.DataFrame:
+    """rows per konto_lauf_id and jamo: the opening month plus a Poisson
+    number of months with changes during the lifetime of the account
+    """
+    n_rows = 1 + rng.poisson(n_changes, len(ids))
+    idx = np.repeat(np.arange(len(ids)), n_rows)
+    lifetime = np.maximum(i_close - i_open, 1)[idx]
+    i_month = i_open[idx] + (rng.random(len(idx)) * lifetime).astype(int)
+    is_first = np.r_[True, idx[1:] != idx[:-1]]
+    i_month = np.where(is_first, i_open[idx], i_month)
+    i_month = np.minimum(i_month, len(months) - 1)
+
+    df = pd.DataFrame(
+        {
+            "konto_lauf_id": ids[idx],
+            "jamo": (months.year * 100 + months.month).to_numpy()[i_month],
+        }
+    )
+
+    return df.drop_duplicates().reset_index(drop=True)
+
+
+def _fact_rows(
+    rng: np.random.Generator,
+    ids: np.ndarray,
+    rate: np.ndarray,
+    i_open: np.ndarray,
+    n_active_months: np.ndarray,
+    months: pd.DatetimeIndex
+) -> pd.DataFrame:
+    """fact rows with konto_lauf_id, kauf_datum and erfassung_datum,
+    Poisson distributed with the given monthly rate per account
+    """
+    n_rows = rng.poisson(rate * n_active_months)
+    idx = np.repeat(np.arange(len(ids)), n_rows)
+    start = months[0] + pd.to_timedelta(i_open[idx] * 30.44, unit="D")
+    days = rng.random(len(idx)) * n_active_months[idx] * 30.44
+    kauf_datum = (start + pd.to_timedelta(days, unit="D")).normalize()
+    kauf_datum = kauf_datum.where(
+        kauf_datum <= months[-1] + pd.offsets.MonthEnd(0),
+        months[-1] + pd.offsets.MonthEnd(0)
+    )
+    erfassung_datum = kauf_datum + pd.to_timedelta(
+        rng.geometric(0.5, len(idx)) - 1, unit="D"
+    )
+
+    return pd.DataFrame(
+        {
+            "konto_lauf_id": ids[idx],
+            "kauf_datum": kauf_datum,
+            "erfassung_datum": erfassung_datum,
+        }
+    )
@@ -0,0 +1,197 @@
+from datetime import datetime
+from fnmatch import fnmatch
+from typing import Iterable, List
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import uuid
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+# tables referenced in a query, e.g. jemas_temp.thm.churn21_label
+RE_TABLE = re.compile(r"\bjemas_\w+\.\w+\.\w+", flags=re.IGNORECASE)
+FILE_META = "_meta.json"
+# suffix of the directories of extracts being written
+TMP_SUFFIX = ".tmp"
+
+
+def make_cache_key(
+    query: str, params: dict = None, schema: dict = None
+) -> str:
+    """content-addressed key for an extract: hash of the sql text
+    (whitespace normalized), its date parameters and the target schema
+
+    Parameters
+    ----------
+    query : str
+        sql query
+    params : dict
+        date parameters of the query (defaults to None)
+    schema : dict
+        declared target dtypes of the extract (defaults to None)
+
+    Returns
+    -------
+    str
+        hex digest identifying the extract
+    """
+    content = json.dumps(
+        {
+            "query": " ".join(query.split()),
+            "params": params or dict(),
+            "schema": schema or dict(),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def has_entry(cache_dir: str, key: str) -> bool:
+    """is the extract with the given key cached (and complete)?"""
+    return os.path.isfile(os.path.join(cache_dir, key, FILE_META))
+
+
+def read_entry(cache_dir: str, key: str) -> List[pd.DataFrame]:
+    """read the cached extract, one data frame per stored chunk
+
+    Parameters
+    ----------
+    cache_dir : str
+        root directory of the cache
+    key : str
+        key of the extract, see `make_cache_key`
+
+    Returns
+    -------
+    List[pd.DataFrame]
+        chunks of the extract, in the order they were written
+    """
+    path = os.path.join(cache_dir, key)
+    logger.info(f"""reading extract {key[:12]} from cache""")
+    l_files = sorted(f for f in os.listdir(path) if f.endswith(".parquet"))
+    return [pd.read_parquet(os.path.join(path, f)) for f in l_files]
+
+
+def write_entry(
+    cache_dir: str,
+    key: str,
+    chunks: Iterable[pd.DataFrame],
+    query: str,
+    params: dict = None
+) -> List[pd.DataFrame]:
+    """write the chunks of an extract as parquet dataset (one file per
+    chunk) while passing them through. The entry only becomes visible
+    once all chunks are written, an interrupted read leaves no entry.
+    Every writer uses its own temporary directory, concurrent writers of
+    the same key do not interfere (the entry of the last one is kept).
+
+    Parameters
+    ----------
+    cache_dir : str
+        root directory of the cache
+    key : str
+        key of the extract, see `make_cache_key`
+    chunks : Iterable[pd.DataFrame]
+        chunks of the extract
+    query : str
+        sql query, stored with the metadata (used for invalidation)
+    params : dict
+        date parameters of the query (defaults to None)
+
+    Returns
+    -------
+    List[pd.DataFrame]
+        the chunks that have been written
+    """
+    path = os.path.join(cache_dir, key)
+    path_tmp = f"{path}.{os.getpid()}.{uuid.uuid4().hex}{TMP_SUFFIX}"
+    os.makedirs(path_tmp)
+
+    l_chunks = []
+    for i, chunk in enumerate(chunks):
+        chunk.to_parquet(
+            os.path.join(path_tmp, f"part-{i:05d}.parquet"), index=False
+        )
+        l_chunks.append(chunk)
+
+    meta = dict(
+        {
+            "query": query,
+            "params": params or dict(),
+            "tables": sorted({t.lower() for t in RE_TABLE.findall(query)}),
+            "n_rows": sum(len(chunk) for chunk in l_chunks),
+            "created": datetime.now().isoformat(),
+        }
+    )
+    with open(os.path.join(path_tmp, FILE_META), "w") as f:
+        json.dump(meta, f, indent=2, default=str)
+
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.rename(path_tmp, path)
+    except OSError:
+        # another writer has completed the same entry in the meantime
+        if not has_entry(cache_dir, key):
+            raise
+        shutil.rmtree(path_tmp, ignore_errors=True)
+    logger.info(f"""cached extract {key[:12]} ({meta["n_rows"]} rows)""")
+
+    return l_chunks
+
+
+def invalidate_cache(cache_dir: str, tables: List[str] = None) -> int:
+    """delete cached extracts. If tables is given, only extracts reading
+    from at least one of these tables are deleted. Table names can be
+    shell-style patterns, e.g. 'jemas_temp.thm.churn21_*'. Extracts that
+    are being written are never deleted.
+
+    Parameters
+    ----------
+    cache_dir : str
+        root directory of the cache
+    tables : List[str]
+        (patterns of) fully qualified table names (defaults to None,
+        deleting all extracts)
+
+    Returns
+    -------
+    int
+        number of deleted extracts
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    n_deleted = 0
+    for key in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, key)
+        if not os.path.isdir(path) or key.endswith(TMP_SUFFIX):
+            continue
+        if tables is not None and has_entry(cache_dir, key):
+            with open(os.path.join(path, FILE_META), "r") as f:
+                tables_entry = json.load(f)["tables"]
+            is_affected = any(
+                fnmatch(t, pattern.lower())
+                for t in tables_entry
+                for pattern in tables
+            )
+            if not is_affected:
+                continue
+        shutil.rmtree(path)
+        n_deleted += 1
+
+    logger.info(f"""invalidated {n_deleted} cached extracts""")
+    return n_deleted
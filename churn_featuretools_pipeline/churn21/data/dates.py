@@ -1,5 +1,4 @@
-from datetime import date, datetime, timedelta
-import calendar
+from datetime import date
 import logging
 
 import numpy as np
@@ -15,6 +14,14 @@ ch.setFormatter(formatter)
 logger.addHandler(ch)
 logger.setLevel(logging.DEBUG)
 
+# Cut-off frequencies: month-ends, week-ends (Sundays) and days. Any other
+# pandas frequency alias (e.g. "W-FRI") is passed on to `pd.date_range`.
+FREQ_ALIASES = dict({"M": None, "W": "W-SUN", "D": "D"})
+DATE_COLS = [
+    "dt_cut_off", "dt_obs_first_considered", "dt_label_last_considered"
+]
+
+
 def handle_dates(
     cut_off_date: date, lookback_period_months: int, label_period_months: int
 ) -> dict:
@@ -32,26 +39,16 @@ def handle_dates(
     Returns
     -------
     dict
-        [description]
+        cut-off date, first date of the observation period (the period
+        spans lookback_period_months months up to the cut-off date, for
+        a month-end the cut-off month included) and last date of the
+        label period (label_period_months months after the cut-off date,
+        for a month-end the end of a month)
     """
-    # first date considered for observation period
-    yrs = int(np.floor(lookback_period_months / 12))
-    mths = int(np.mod(lookback_period_months, 12))
-    dt_tmp = (cut_off_date - timedelta(days=(365 * yrs + mths * 30)))
-    dt_obs_first_considered = date(dt_tmp.year, dt_tmp.month, 1)
-    # last date considered for label
-    yrs = int(np.floor(label_period_months / 12))
-    mths = int(np.mod(label_period_months, 12))
-    dt_tmp = (cut_off_date + timedelta(days=(365 * yrs + mths * 28)))
-    last_of_month = calendar.monthrange(dt_tmp.year, dt_tmp.month)[1]
-    dt_label_last_considered = date(dt_tmp.year, dt_tmp.month, last_of_month)
-    dict_dates = dict(
-        {
-            "dt_cut_off": cut_off_date,
-            "dt_obs_first_considered": dt_obs_first_considered,
-            "dt_label_last_considered": dt_label_last_considered
-        }
+    df_dates = calculate_windows(
+        [cut_off_date], lookback_period_months, label_period_months
     )
+    dict_dates = to_list_of_dicts(df_dates)[0]
     return dict_dates
 
 
@@ -84,7 +81,7 @@ def create_dateinfo(dt_params: dict) -> tuple:
     return l_dates_train, [l_dates_test]
 
 
-def create_dates_training(dt_params: dict) -> pd.DataFrame:
+def create_dates_training(dt_params: dict) -> list:
     """creates the necessary dates for the training set considering several cut-off dates.
     the last_cut_off_date is handed over to the function, 
     the first cut-off date is n_months_considered behind the last_cut_off_date
@@ -92,30 +89,33 @@ def create_dates_training(dt_params: dict) -> pd.DataFrame:
     Parameters
     ----------
     dt_params : dict
-        dictionary containing all relevant info about training datset
+        dictionary containing all relevant info about training datset,
+        optionally cut_off_freq (see `several_cut_off_dates`)
 
     Returns
     -------
-    pd.DataFrame
-        training df
+    list
+        date parameters, one dict per cut-off date
     """
-    l_cut_off_dates = several_cut_off_dates(
+    df_dates = cut_off_table(
         dt_params["first_cut_off_date_train"],
-        dt_params["last_cut_off_date_train"]
+        dt_params["last_cut_off_date_train"],
+        dt_params["lookback_period_months"],
+        dt_params["label_period_months"],
+        dt_params.get("cut_off_freq", "M"),
     )
-    l_dates_train = list()
-    for dt_cut in l_cut_off_dates:
-        l_dates_train.append(
-            handle_dates(
-                dt_cut, dt_params["lookback_period_months"],
-                dt_params["label_period_months"]
-            )
-        )
-    return l_dates_train
+    return to_list_of_dicts(df_dates)
 
 
-def several_cut_off_dates(dt_start_incl: date, dt_end_incl: date) -> list:
-    """return all (month-end) cut-off dates between dt_start_incl and dt_end_incl
+def cut_off_table(
+    dt_start_incl: date,
+    dt_end_incl: date,
+    lookback_period_months: int,
+    label_period_months: int,
+    freq: str = "M"
+) -> pd.DataFrame:
+    """all cut-off dates between dt_start_incl and dt_end_incl with their
+    observation and label windows, in one vectorized call
 
     Parameters
     ----------
@@ -123,26 +123,118 @@ def several_cut_off_dates(dt_start_incl: date, dt_end_incl: date) -> list:
         first cut-off date
     dt_end_incl : date
         last cut-off date
+    lookback_period_months : int
+        how many months back from the cut-off date are considered for feature creation?
+    label_period_months : int
+        cancellations within this time period after the cut-off date are used as labels
+    freq : str
+        frequency of the cut-off dates: "M" (month-ends), "W" (Sundays),
+        "D" (days) or any pandas frequency alias (defaults to "M")
 
     Returns
     -------
-    list
-        list containing all cut-off dates
+    pd.DataFrame
+        one row per cut-off date, columns DATE_COLS
+    """
+    return calculate_windows(
+        several_cut_off_dates(dt_start_incl, dt_end_incl, freq),
+        lookback_period_months,
+        label_period_months,
+    )
+
+
+def calculate_windows(
+    cut_off_dates: list,
+    lookback_period_months: int,
+    label_period_months: int
+) -> pd.DataFrame:
+    """observation and label window of every cut-off date, using exact
+    month arithmetic (`pd.DateOffset`) from the day after the cut-off
+    date: the observation period spans the lookback_period_months months
+    before that day, the label period the label_period_months months
+    from that day. For month-ends these are calendar months (the cut-off
+    month included in the observation period), for weekly or daily
+    cut-offs they are day-exact: the first month plus the 12m window of
+    `fact_features.get_window_bounds` for a lookback of 13 months.
+
+    Parameters
+    ----------
+    cut_off_dates : list
+        cut-off dates
+    lookback_period_months : int
+        how many months back from the cut-off date are considered for feature creation?
+    label_period_months : int
+        cancellations within this time period after the cut-off date are used as labels
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per cut-off date, columns DATE_COLS
     """
-    dt_diff = (dt_end_incl - dt_start_incl)
-    df_dt_range = pd.DataFrame(
+    dt_cut_off = pd.to_datetime(
+        pd.Series(cut_off_dates, dtype=object)
+    ).astype("datetime64[ns]")
+    dt_label_first = dt_cut_off + pd.Timedelta(days=1)
+
+    return pd.DataFrame(
         {
-            "dt": [
-                dt_start_incl + timedelta(days=n)
-                for n in range(0, dt_diff.days + 1)
-            ]
+            "dt_cut_off": dt_cut_off,
+            "dt_obs_first_considered":
+                dt_label_first - pd.DateOffset(months=lookback_period_months),
+            "dt_label_last_considered":
+                dt_label_first + pd.DateOffset(months=label_period_months)
+                - pd.Timedelta(days=1),
         }
     )
-    df_dt_range["dt"] = pd.to_datetime(df_dt_range["dt"])
-    df_dt_range["yr"] = df_dt_range["dt"].dt.year
-    df_dt_range["mth"] = df_dt_range["dt"].dt.month
-    l_cut_off_dates = (
-        df_dt_range.groupby(["yr", "mth"])["dt"].max().reset_index(drop=True)
-    )
-    l_out = [dt for dt in l_cut_off_dates.dt.date]
-    return l_out
+
+
+def to_list_of_dicts(df_dates: pd.DataFrame) -> list:
+    """the rows of a table of windows (see `cut_off_table`) as list of
+    dicts of dates, the format expected by `load.create_dataset`
+    """
+    return [
+        dict({col: pd.Timestamp(row[col]).date() for col in DATE_COLS})
+        for row in df_dates[DATE_COLS].to_dict("records")
+    ]
+
+
+def several_cut_off_dates(
+    dt_start_incl: date, dt_end_incl: date, freq: str = "M"
+) -> list:
+    """return all cut-off dates between dt_start_incl and dt_end_incl.
+    For freq "M" these are the month-ends, the last one is dt_end_incl
+    if it is not a month-end.
+
+    Parameters
+    ----------
+    dt_start_incl : date
+        first cut-off date
+    dt_end_incl : date
+        last cut-off date
+    freq : str
+        frequency of the cut-off dates: "M" (month-ends), "W" (Sundays),
+        "D" (days) or any pandas frequency alias (defaults to "M")
+
+    Returns
+    -------
+    list
+        list containing all cut-off dates
+    """
+    dt_start = np.datetime64(dt_start_incl, "D")
+    dt_end = np.datetime64(dt_end_incl, "D")
+    if dt_end < dt_start:
+        return []
+
+    if FREQ_ALIASES.get(freq, freq) is None:
+        months = np.arange(
+            dt_start.astype("datetime64[M]"),
+            dt_end.astype("datetime64[M]") + 1,
+        )
+        month_ends = (months + 1).astype("datetime64[D]") - 1
+        dt_range = np.minimum(month_ends, dt_end)
+    else:
+        dt_range = pd.date_range(
+            dt_start, dt_end, freq=FREQ_ALIASES.get(freq, freq)
+        ).to_numpy(dtype="datetime64[D]")
+
+    return [dt.item() for dt in dt_range]
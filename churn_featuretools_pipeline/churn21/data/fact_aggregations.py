@@ -0,0 +1,426 @@
+from datetime import date
+from typing import Dict, List, Tuple
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+ENTITY_INDEX = "konto_lauf_id"
+TIME_INDEX = "kauf_datum"
+
+# Mirrors the entities, variable types and interesting values defined in
+# fact_features.create_entity_set_ft
+CHILD_ENTITIES = {
+    "sales_fact":
+        {
+            "numeric": ["betrag"],
+            "categorical":
+                ["transaction_type_id", "mcg_id", "transaktionsart_id_korr"],
+            "interesting_values": {
+                "transaktionsart_id_korr": [0]
+            },
+        },
+    "fees_fact":
+        {
+            "numeric": ["betrag"],
+            "categorical": ["bewegungstyp"],
+            "interesting_values":
+                {
+                    "bewegungstyp": ["mahnung", "fremdw", "zins"]
+                },
+        },
+}
+
+# primitives with a default value for instances without observations,
+# all others are NaN (as in featuretools)
+PRIMITIVES_DEFAULT_0 = ["COUNT(", "SUM("]
+
+
+def calculate_feature_matrix(
+    pop: pd.DataFrame,
+    sales: pd.DataFrame,
+    fees: pd.DataFrame,
+    cut_off_date: date,
+    agg_primitives: List[str],
+    where_primitives: List[str],
+    trans_primitives: List[str],
+    drop_exact: List[str] = None,
+    window_col: str = None,
+) -> pd.DataFrame:
+    """pandas / numpy replacement for `ft.dfs` on the entity set created
+    by `fact_features.create_entity_set_ft`. The feature matrix has the
+    same columns (names and values) as the featuretools output, but all
+    aggregations are grouped operations on the fact tables, there is no
+    entity set and no per-instance calculation. With window_col, the
+    features of all periods (see `fact_features.assign_fact_windows`)
+    are calculated at once, grouped by konto_lauf_id and period.
+
+    Parameters
+    ----------
+    pop : pd.DataFrame
+        population used at the given cut-off date
+    sales : pd.DataFrame
+        slice of loaded sales_fact table, for given population and period
+    fees : pd.DataFrame
+        slice of loaded fees_fact table, for given population and period
+    cut_off_date : date
+        cut-off date separating observation period from label period
+    agg_primitives : List[str]
+        aggregation primitives, as for `ft.dfs`
+    where_primitives : List[str]
+        primitives calculated for the interesting values, as for `ft.dfs`
+    trans_primitives : List[str]
+        transform primitives (only "month" is supported), as for `ft.dfs`
+    drop_exact : List[str]
+        names of features to drop (defaults to None)
+    window_col : str
+        categorical column of sales and fees assigning the observations
+        to periods (defaults to None, a single period)
+
+    Returns
+    -------
+    pd.DataFrame
+        feature matrix, indexed by konto_lauf_id in the order of pop
+        (and by period, if window_col is given)
+    """
+    keys = [ENTITY_INDEX]
+    index = pd.Index(pop[ENTITY_INDEX], name=ENTITY_INDEX)
+    if window_col is not None:
+        keys.append(window_col)
+        index = pd.MultiIndex.from_product(
+            [index, sales[window_col].cat.categories],
+            names=keys,
+        )
+
+    l_fm = [
+        aggregate_child(
+            df,
+            child_id,
+            keys,
+            cut_off_date,
+            agg_primitives,
+            where_primitives,
+            trans_primitives,
+        ) for child_id, df in [("sales_fact", sales), ("fees_fact", fees)]
+    ]
+    fm = pd.concat(l_fm, axis=1).reindex(index)
+    fm = _fill_default_values(fm)
+    to_drop = [col for col in (drop_exact or []) if col in fm.columns]
+
+    return fm.drop(columns=to_drop)
+
+
+def feature_names(
+    agg_primitives: List[str],
+    where_primitives: List[str],
+    trans_primitives: List[str],
+    drop_exact: List[str] = None,
+) -> List[str]:
+    """names of the features `calculate_feature_matrix` creates for the
+    given primitives, in the order of its output
+
+    Parameters
+    ----------
+    agg_primitives : List[str]
+        aggregation primitives
+    where_primitives : List[str]
+        primitives calculated for the interesting values
+    trans_primitives : List[str]
+        transform primitives (only "month" is supported)
+    drop_exact : List[str]
+        names of features to drop (defaults to None)
+
+    Returns
+    -------
+    List[str]
+        feature names
+    """
+    names = [
+        name for child_id in ["sales_fact", "fees_fact"]
+        for _, specs in _child_feature_specs(
+            child_id, agg_primitives, where_primitives, trans_primitives
+        ) for name, _, _ in specs
+    ]
+
+    return [name for name in names if name not in (drop_exact or [])]
+
+
+def aggregate_child(
+    df: pd.DataFrame,
+    child_id: str,
+    keys: List[str],
+    cut_off_date: date,
+    agg_primitives: List[str],
+    where_primitives: List[str],
+    trans_primitives: List[str],
+) -> pd.DataFrame:
+    """calculate all aggregation features of one child entity (fact
+    table), including the transform features and the WHERE variants
+    for the interesting values, grouped by keys
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        fact table of the child entity
+    child_id : str
+        name of the child entity, see CHILD_ENTITIES
+    keys : List[str]
+        columns to group by
+    cut_off_date : date
+        cut-off date, later observations are ignored
+    agg_primitives : List[str]
+        aggregation primitives
+    where_primitives : List[str]
+        primitives calculated for the interesting values
+    trans_primitives : List[str]
+        transform primitives (only "month" is supported)
+
+    Returns
+    -------
+    pd.DataFrame
+        features, indexed by keys (groups without observations missing)
+    """
+    l_specs = _child_feature_specs(
+        child_id, agg_primitives, where_primitives, trans_primitives
+    )
+    df = df.loc[df[TIME_INDEX] <= pd.to_datetime(cut_off_date)]
+    if "month" in trans_primitives:
+        df = df.assign(**{f"MONTH({TIME_INDEX})": df[TIME_INDEX].dt.month})
+
+    l_features = []
+    for where, specs in l_specs:
+        df_where = df
+        if where is not None:
+            df_where = df.loc[df[where[0]] == where[1]]
+        l_features.append(
+            _aggregate(df_where, keys, cut_off_date, specs)
+        )
+
+    return pd.concat(l_features, axis=1)
+
+
+def _child_feature_specs(
+    child_id: str,
+    agg_primitives: List[str],
+    where_primitives: List[str],
+    trans_primitives: List[str],
+) -> List[Tuple[Tuple, List[Tuple[str, str, str]]]]:
+    """list the features of one child entity, grouped by their WHERE
+    clause: [(where, [(name, primitive, column), ...]), ...], where is
+    None or a tuple (column, interesting value). Feature names are built
+    the way featuretools does.
+    """
+    entity = CHILD_ENTITIES[child_id]
+    discrete = list(entity["categorical"])
+    for primitive in trans_primitives:
+        if primitive != "month":
+            raise ValueError(f"transform primitive {primitive} not supported")
+        discrete.append(f"MONTH({TIME_INDEX})")
+
+    l_specs = [
+        (
+            None,
+            _feature_specs(
+                child_id, agg_primitives, entity["numeric"], discrete, ""
+            )
+        )
+    ]
+    for col, values in entity["interesting_values"].items():
+        for value in values:
+            l_specs.append(
+                (
+                    (col, value),
+                    _feature_specs(
+                        child_id,
+                        where_primitives,
+                        entity["numeric"],
+                        [],
+                        f" WHERE {col} = {value}",
+                    )
+                )
+            )
+
+    return l_specs
+
+
+def _feature_specs(
+    child_id: str,
+    primitives: List[str],
+    numeric: List[str],
+    discrete: List[str],
+    where: str,
+) -> List[Tuple[str, str, str]]:
+    """(name, primitive, column) of all features of the given primitives
+    for the applicable columns
+    """
+    l_specs = []
+    for primitive in primitives:
+        name = primitive.upper()
+        if primitive == "count":
+            l_specs.append((f"COUNT({child_id}{where})", primitive, None))
+        elif primitive in ["sum", "std", "max", "min", "mean", "skew"]:
+            l_specs += [
+                (f"{name}({child_id}.{col}{where})", primitive, col)
+                for col in numeric
+            ]
+        elif primitive == "trend":
+            l_specs += [
+                (
+                    f"{name}({child_id}.{col}, {TIME_INDEX}{where})",
+                    primitive,
+                    col
+                ) for col in numeric
+            ]
+        elif primitive in ["num_unique", "mode"]:
+            l_specs += [
+                (f"{name}({child_id}.{col}{where})", primitive, col)
+                for col in discrete
+            ]
+        elif primitive in ["avg_time_between", "time_since_last"]:
+            l_specs.append(
+                (f"{name}({child_id}.{TIME_INDEX}{where})", primitive, None)
+            )
+        else:
+            raise ValueError(
+                f"aggregation primitive {primitive} not supported"
+            )
+
+    return l_specs
+
+
+def _aggregate(
+    df: pd.DataFrame,
+    keys: List[str],
+    cut_off_date: date,
+    specs: List[Tuple[str, str, str]],
+) -> pd.DataFrame:
+    """calculate the features given by specs (see `_feature_specs`)"""
+    grouped = df.groupby(keys, sort=False, observed=True)
+    d_features: Dict[str, pd.Series] = dict()
+
+    for name, primitive, col in specs:
+        if primitive == "count":
+            d_features[name] = grouped.size()
+        elif primitive in ["sum", "std", "max", "min", "mean"]:
+            d_features[name] = grouped[col].agg(primitive)
+        elif primitive == "skew":
+            d_features[name] = _group_skew(df, keys, col)
+        elif primitive == "trend":
+            d_features[name] = _group_trend(df, keys, col)
+        elif primitive == "num_unique":
+            d_features[name] = grouped[col].nunique()
+        elif primitive == "mode":
+            d_features[name] = _group_mode(df, keys, col)
+        elif primitive == "avg_time_between":
+            d_features[name] = _group_avg_time_between(df, keys)
+        elif primitive == "time_since_last":
+            time_since_last = (
+                pd.to_datetime(cut_off_date) - grouped[TIME_INDEX].max()
+            )
+            d_features[name] = time_since_last.dt.total_seconds()
+
+    return pd.DataFrame(d_features, index=grouped.size().index)
+
+
+def _group_skew(df: pd.DataFrame, keys: List[str], col: str) -> pd.Series:
+    """bias-corrected sample skewness per group (as `pd.Series.skew`),
+    computed from grouped central moments
+    """
+    y = df[col].astype("float64")
+    dev = y - y.groupby([df[k] for k in keys], observed=True).transform("mean")
+    moments = df[keys].assign(
+        n=y.notna().astype("int64"), m2=dev**2, m3=dev**3
+    ).groupby(keys, sort=False, observed=True).sum()
+
+    n, m2, m3 = moments["n"], moments["m2"], moments["m3"]
+    m2 = m2.where(m2.abs() >= 1e-14, 0)
+    m3 = m3.where(m3.abs() >= 1e-14, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        skew = (n * (n - 1)**0.5 / (n - 2)) * (m3 / m2**1.5)
+    skew = skew.where(m2 != 0, 0)
+
+    return skew.where(n >= 3)
+
+
+def _group_trend(df: pd.DataFrame, keys: List[str], col: str) -> pd.Series:
+    """slope of the linear regression of col on the time index per group
+    (as featuretools' TREND). Time is measured in days, hours, minutes or
+    seconds, depending on the first timestamp of the group.
+    """
+    df = df.loc[df[col].notna() & df[TIME_INDEX].notna()]
+    by = [df[k] for k in keys]
+    t_ns = df[TIME_INDEX].to_numpy().astype("datetime64[ns]").astype("int64")
+    t_ns = pd.Series(t_ns, index=df.index)
+    t_first = t_ns.groupby(by, observed=True).transform("min")
+
+    secs_first = (t_first * 1e-9).astype("int64")
+    dividend = np.select(
+        [secs_first % d == 0 for d in [86400, 3600, 60]],
+        [86400, 3600, 60],
+        default=1
+    )
+    x = (t_ns - t_first) * 1e-9 / dividend
+    y = df[col].astype("float64")
+    x_dev = x - x.groupby(by, observed=True).transform("mean")
+    y_dev = y - y.groupby(by, observed=True).transform("mean")
+    moments = df[keys].assign(
+        n=1, sxx=x_dev**2, sxy=x_dev * y_dev
+    ).groupby(keys, sort=False, observed=True).sum()
+
+    n, sxx, sxy = moments["n"], moments["sxx"], moments["sxy"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        trend = sxy / sxx
+    trend = trend.where(sxx != 0, 0)
+
+    return trend.where(n > 2)
+
+
+def _group_mode(df: pd.DataFrame, keys: List[str], col: str) -> pd.Series:
+    """most frequent value per group, the smallest one in case of ties
+    (as `pd.Series.mode().iloc[0]`)
+    """
+    counts = df.groupby(keys + [col], sort=False, observed=True).size()
+    counts = counts.reset_index(name="n")
+    if isinstance(df[col].dtype, pd.CategoricalDtype):
+        # groupby(sort=False) orders the categories by appearance
+        counts[col] = counts[col].cat.set_categories(df[col].cat.categories)
+    counts = counts.sort_values(["n", col], ascending=[False, True])
+    mode = counts.drop_duplicates(subset=keys).set_index(keys)[col]
+
+    return mode
+
+
+def _group_avg_time_between(df: pd.DataFrame, keys: List[str]) -> pd.Series:
+    """average time in seconds between consecutive observations per group
+    (as featuretools' AVG_TIME_BETWEEN)
+    """
+    grouped = df.groupby(keys, sort=False, observed=True)[TIME_INDEX]
+    n = grouped.count()
+    span = (grouped.max() - grouped.min()).dt.total_seconds()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg = span / (n - 1)
+
+    return avg.where(n >= 2)
+
+
+def _fill_default_values(fm: pd.DataFrame) -> pd.DataFrame:
+    """fill the features of instances without observations with the
+    default value of the primitive (0 for COUNT and SUM)
+    """
+    cols_fill_0 = [
+        col for col in fm.columns
+        if any(col.startswith(prefix) for prefix in PRIMITIVES_DEFAULT_0)
+    ]
+    fm[cols_fill_0] = fm[cols_fill_0].fillna(0)
+
+    return fm
@@ -1,13 +1,19 @@
-from datetime import date, timedelta, datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
 from typing import List, Tuple
 import logging
+import os
 
 import featuretools as ft
 import numpy as np
 import pandas as pd
 from sqlalchemy.engine.base import Engine
 
+from . import fact_aggregations as utils_agg
+from . import fact_state as utils_state
+from . import instrumentation as utils_instr
 from . import load as utils_ld
+from . import shards as utils_shards
 
 logger = logging.getLogger(__name__)
 ch = logging.StreamHandler()
@@ -19,9 +25,88 @@ ch.setFormatter(formatter)
 logger.addHandler(ch)
 logger.setLevel(logging.DEBUG)
 
-
+# Primitives of the feature sets, used for featuretools and for the
+# native aggregations alike. The full set is calculated for the 12-month
+# period, the reduced set for the first and last month.
+FEATURES_FULL = {
+    "agg_primitives":
+        [
+            "sum",
+            "std",
+            "max",
+            "skew",
+            "min",
+            "mean",
+            "count",
+            "num_unique",
+            "mode",
+            "avg_time_between",
+            "trend",
+            "time_since_last",
+        ],
+    "trans_primitives": [
+        "month",
+    ],
+    "where_primitives": ["sum", "count", "mean", "trend"],
+    "drop_exact":
+        [
+            "MODE(sales_fact.MONTH(kauf_datum))",
+            "MODE(fees_fact.MONTH(kauf_datum))",
+            "MODE(sales_fact.mcg_id)",
+        ],
+}
+FEATURES_REDUCED = {
+    "agg_primitives": [
+        "sum",
+        "count",
+        "num_unique",
+        "avg_time_between",
+    ],
+    "trans_primitives": [],
+    "where_primitives": ["sum", "count"],
+    "drop_exact":
+        [
+            "NUM_UNIQUE(sales_fact.transaktionsart_id_korr)",
+            "AVG_TIME_BETWEEN(fees_fact.kauf_datum)",
+            "NUM_UNIQUE(sales_fact.MONTH(kauf_datum))",
+            "NUM_UNIQUE(fees_fact.MONTH(kauf_datum))",
+            "SUM(sales_fact.betrag WHERE transaktionsart_id_korr = 0)",
+            "COUNT(fees_fact WHERE bewegungstyp = mahnung)",
+            "COUNT(fees_fact WHERE bewegungstyp = fremdw)",
+            "COUNT(fees_fact WHERE bewegungstyp = zins)",
+            "NUM_UNIQUE(fees_fact.MONTH(kauf_datum))",
+        ],
+}
+
+# Declared target dtypes for the fact extracts (see `load._read_sql_downcast`)
+SCHEMA_SALES_FACT = {
+    "konto_lauf_id": "integer",
+    "betrag": "float",
+    "kauf_datum": "datetime",
+    "erfassung_datum": "datetime",
+    "transaction_type_id": "integer",
+    "mcg_id": "integer",
+    "transaktionsart_id_korr": "integer",
+}
+SCHEMA_FEES_FACT = {
+    "konto_lauf_id": "integer",
+    "betrag": "float",
+    "kauf_datum": "datetime",
+    "erfassung_datum": "datetime",
+    "bewegungstyp": "category",
+}
+
+# Feature periods, see `get_window_bounds`
+WINDOWS = ["first", "12m", "last"]
+
+
+@utils_instr.instrument
 def load_sales_fact(
-    cut_off_date: date, first_date: date, engine: Engine
+    cut_off_date: date,
+    first_date: date,
+    engine: Engine,
+    cache_dir: str = None,
+    pushdown_population: bool = True
 ) -> pd.DataFrame:
     """load observations from the db table 'jemas_base.dbo.Sales_Fact'
     given between given start and end date. We load the entire population
@@ -34,6 +119,11 @@ def load_sales_fact(
         first date of observation period
     engine : Engine
         jemas connection
+    cache_dir : str
+        directory of the local parquet cache (defaults to None)
+    pushdown_population : bool
+        only load facts of accounts that can be in the population at the
+        cut-off date, see `_population_filter_sql` (defaults to True)
 
     Returns
     -------
@@ -51,6 +141,7 @@ def load_sales_fact(
               sf.konto_lauf_id
             , sf.betrag
             , sf.kauf_datum
+            , sf.erfassung_datum
             , sf.transaction_type_id
             , mcc.mcg AS mcg_id
             , sf.transaktionsart_id_korr
@@ -62,20 +153,33 @@ def load_sales_fact(
          AND sf.ist_umsatz = 1
          AND sf.ist_trx = 1
          AND sf.betrag > 0
+         {_population_filter_sql("sf", cut_off_date, pushdown_population)}
          ORDER BY sf.konto_lauf_id;
        """
 
-    df_sales_fact = pd.read_sql(query, engine)
-    df_sales_fact["rwn"] = np.arange(
-        len(df_sales_fact)
+    df_sales_fact = utils_ld._read_sql_downcast(
+        query,
+        engine,
+        SCHEMA_SALES_FACT,
+        cache_dir=cache_dir,
+        params=dict(
+            {"cut_off_date": cut_off_date, "first_date": first_date}
+        )
+    )
+    df_sales_fact["rwn"] = pd.to_numeric(
+        np.arange(len(df_sales_fact)), downcast="integer"
     )     # "add primary key" for ft
-    df_sales_fact = utils_ld._downcast_dtypes(df_sales_fact)
 
     return df_sales_fact
 
 
+@utils_instr.instrument
 def load_fees_fact(
-    cut_off_date: date, first_date: date, engine: Engine
+    cut_off_date: date,
+    first_date: date,
+    engine: Engine,
+    cache_dir: str = None,
+    pushdown_population: bool = True
 ) -> pd.DataFrame:
     """load observations from the db table 'jemas_base.dbo.Fees_Fact'
     given between given start and end date. We load the entire population
@@ -88,6 +192,11 @@ def load_fees_fact(
         first date of observation period
     engine : Engine
         jemas connection
+    cache_dir : str
+        directory of the local parquet cache (defaults to None)
+    pushdown_population : bool
+        only load facts of accounts that can be in the population at the
+        cut-off date, see `_population_filter_sql` (defaults to True)
 
     Returns
     -------
@@ -105,6 +214,7 @@ def load_fees_fact(
           ff.konto_lauf_id
         , ff.betrag
         , ff.kauf_datum
+        , ff.erfassung_datum
        , CASE WHEN ff.bewegungstyp_id IN (41, 42, 43, 44) THEN 'mahnung'
               WHEN ff.bewegungsgrund_id IN ('FRW', 'WSZ', 'ETA') THEN 'fremdw'
               WHEN (ff.bewegungsgrund_id = 'ZIN' OR ff.bewegungstyp_id = 31) THEN 'zins'
@@ -115,18 +225,99 @@ def load_fees_fact(
           AND bewegungstyp_id != 11
           AND NOT ff.bewegungsgrund_id IN ('JGT', 'JGE', 'JGR')
           AND ff.betrag > 0
+          {_population_filter_sql("ff", cut_off_date, pushdown_population)}
         ORDER BY ff.konto_lauf_id;
        """
 
-    df_fees_fact = pd.read_sql(query, engine)
-    df_fees_fact["rwn"] = np.arange(
-        len(df_fees_fact)
+    df_fees_fact = utils_ld._read_sql_downcast(
+        query,
+        engine,
+        SCHEMA_FEES_FACT,
+        cache_dir=cache_dir,
+        params=dict(
+            {"cut_off_date": cut_off_date, "first_date": first_date}
+        )
+    )
+    df_fees_fact["rwn"] = pd.to_numeric(
+        np.arange(len(df_fees_fact)), downcast="integer"
     )     # add "primary key" for ft
-    df_fees_fact = utils_ld._downcast_dtypes(df_fees_fact)
 
     return df_fees_fact
 
 
+@utils_instr.instrument
+def load_fact_cache(
+    l_dates: list, engine: Engine, cache_dir: str = None
+) -> dict:
+    """load sales and fees facts once for the union of the observation
+    periods of all cut-off dates in l_dates. The single snapshots are
+    then sliced out of this cache with `slice_fact_df_to_window`,
+    instead of querying the fact tables again for every cut-off date.
+
+    Parameters
+    ----------
+    l_dates : list
+        date parameters, one dict per cut-off date
+    engine : Engine
+        jemas connection
+    cache_dir : str
+        directory of the local parquet cache (defaults to None)
+
+    Returns
+    -------
+    dict
+        with keys "sales" and "fees"
+    """
+    first_date = min(d["dt_obs_first_considered"] for d in l_dates)
+    cut_off_date = max(d["dt_cut_off"] for d in l_dates)
+    logger.info(
+        f"""loading fact cache for {len(l_dates)} cut-off dates"""
+    )
+    dict_facts = dict(
+        {
+            "sales": load_sales_fact(
+                cut_off_date, first_date, engine, cache_dir
+            ),
+            "fees": load_fees_fact(
+                cut_off_date, first_date, engine, cache_dir
+            ),
+        }
+    )
+    return dict_facts
+
+
+@utils_instr.instrument
+def slice_fact_df_to_window(
+    fact: pd.DataFrame, cut_off_date: date, first_date: date
+) -> pd.DataFrame:
+    """restrict fact observations to those that would have been loaded
+    for the given cut-off date (same erfassung_datum filter as in
+    `load_sales_fact` and `load_fees_fact`). The column erfassung_datum
+    is dropped, it must not show up in the feature set.
+
+    Parameters
+    ----------
+    fact : pd.DataFrame
+        loaded fact table (single cut-off date or fact cache)
+    cut_off_date : date
+        cut-off date separating observation period from label period
+    first_date : date
+        first date of observation period
+
+    Returns
+    -------
+    pd.DataFrame
+        fact observations for the given cut-off date
+    """
+    cut_off_date_plus = cut_off_date + timedelta(days=3)
+    filt = (
+        (fact["erfassung_datum"] >= pd.to_datetime(first_date))
+        & (fact["erfassung_datum"] <= pd.to_datetime(cut_off_date_plus))
+    )
+    return fact.loc[filt].drop(columns="erfassung_datum")
+
+
+@utils_instr.instrument
 def fit_fact_df_to_population(
     fact: pd.DataFrame, pop: pd.DataFrame
 ) -> pd.DataFrame:
@@ -145,11 +336,56 @@ def fit_fact_df_to_population(
     Returns
     -------
     pd.DataFrame
-        reduced copy of fact
+        reduced fact (fact itself if no observation is dropped)
     """
-    population = set(pop["konto_lauf_id"])
-    fact = fact[fact["konto_lauf_id"].isin(population)].copy()
-    return fact
+    is_member = _is_member(
+        fact["konto_lauf_id"].to_numpy(), pop["konto_lauf_id"].to_numpy()
+    )
+    if is_member.all():
+        return fact
+    return fact.loc[is_member]
+
+
+def _is_member(values: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """boolean mask of the values contained in ids (integers): a bitmap
+    over the range of ids if it is small compared to the number of
+    values, a binary search in the sorted ids otherwise
+    """
+    ids = np.unique(ids)
+    if len(ids) == 0 or len(values) == 0:
+        return np.zeros(len(values), dtype=bool)
+
+    id_min, id_max = int(ids[0]), int(ids[-1])
+    is_in_range = (values >= id_min) & (values <= id_max)
+    if id_max - id_min <= max(4 * len(values), 2**24):
+        bitmap = np.zeros(id_max - id_min + 1, dtype=bool)
+        bitmap[ids.astype("int64") - id_min] = True
+        offsets = np.where(is_in_range, values.astype("int64") - id_min, 0)
+        return is_in_range & bitmap[offsets]
+
+    idx = np.minimum(np.searchsorted(ids, values), len(ids) - 1)
+    return is_in_range & (ids[idx] == values)
+
+
+def _population_filter_sql(
+    alias: str, cut_off_date: date, pushdown_population: bool
+) -> str:
+    """sql condition restricting the facts (table alias) to accounts in
+    jemas_temp.thm.churn21_population with a konto_id at or before the
+    cut-off month. This is a superset of the population of the cut-off
+    date (see `load.filter_population`) and of all earlier cut-off
+    dates, facts of other accounts never leave the database.
+    """
+    if not pushdown_population:
+        return ""
+    jamo = cut_off_date.year * 100 + cut_off_date.month
+    return f"""AND EXISTS (
+               SELECT 1
+                 FROM jemas_temp.thm.churn21_population AS pop
+                WHERE pop.konto_lauf_id = {alias}.konto_lauf_id
+                  AND pop.jamo <= {jamo}
+                  AND pop.konto_id IS NOT NULL
+             )"""
 
 
 def split_fact_df_into_3_periods(
@@ -173,31 +409,108 @@ def split_fact_df_into_3_periods(
     pd.DataFrame, pd.DataFrame, pd.DataFrame
         df_first_month, df_12_months, df_last_month
     """
-    start_first_month = first_date
-    next_month = start_first_month.replace(day=28) + timedelta(
-        days=4
-    )     # never fails
-    end_first_month = next_month - timedelta(days=next_month.day)
-    start_12_months = end_first_month + timedelta(days=1)
-    end_12_months = cut_off_date
-    start_last_month = end_12_months.replace(day=1)
-    end_last_month = end_12_months
-
-    df_first_month = fact[
-        (fact["kauf_datum"] >= pd.to_datetime(start_first_month))
-        & (fact["kauf_datum"] <= pd.to_datetime(end_first_month))].copy()
-
-    df_12_months = fact[
-        (fact["kauf_datum"] >= pd.to_datetime(start_12_months))
-        & (fact["kauf_datum"] <= pd.to_datetime(end_12_months))].copy()
-
-    df_last_month = fact[
-        (fact["kauf_datum"] >= pd.to_datetime(start_last_month))
-        & (fact["kauf_datum"] <= pd.to_datetime(end_last_month))].copy()
+    d_bounds = get_window_bounds(cut_off_date, first_date)
+    l_periods = []
+    for window in WINDOWS:
+        start, end = d_bounds[window]
+        l_periods.append(
+            fact[(fact["kauf_datum"] >= pd.to_datetime(start))
+                 & (fact["kauf_datum"] <= pd.to_datetime(end))].copy()
+        )
+    df_first_month, df_12_months, df_last_month = l_periods
 
     return df_first_month, df_12_months, df_last_month
 
 
+def get_window_bounds(cut_off_date: date, first_date: date) -> dict:
+    """first and last day of the 3 feature periods: 1st month of
+    observation period, 12 months back from cut_off_date and 1 month
+    back from cut_off_date (calendar months for a month-end cut-off
+    date, day-exact otherwise, see `dates.calculate_windows`)
+
+    Parameters
+    ----------
+    cut_off_date : date
+        cut-off date separating observation period from label period
+    first_date : date
+        first date of observation period
+
+    Returns
+    -------
+    dict
+        (start, end) for each of WINDOWS
+    """
+    # whole months back from the day after cut_off_date, as first_date
+    dt_label_first = pd.Timestamp(cut_off_date + timedelta(days=1))
+    n_months = (
+        12 * (dt_label_first.year - first_date.year)
+        + dt_label_first.month - first_date.month
+    )
+    start_12m = (dt_label_first - pd.DateOffset(months=n_months - 1)).date()
+    start_last = (dt_label_first - pd.DateOffset(months=1)).date()
+
+    return dict(
+        {
+            "first": (first_date, start_12m - timedelta(days=1)),
+            "12m": (start_12m, cut_off_date),
+            "last": (start_last, cut_off_date),
+        }
+    )
+
+
+def assign_fact_windows(
+    fact: pd.DataFrame, cut_off_date: date, first_date: date
+) -> pd.DataFrame:
+    """label each fact observation with its feature period (column
+    window, categorical with categories WINDOWS) in a single pass. The
+    first month and the 12 months are disjoint, observations of the last
+    month belong to the 12 months as well and are therefore the only
+    ones to show up twice. Observations outside all periods are dropped.
+    Replaces `split_fact_df_into_3_periods` for the native aggregations,
+    which then calculate the features of all periods in one go.
+
+    Parameters
+    ----------
+    fact : pd.DataFrame
+        loaded fact table
+    cut_off_date : date
+        cut-off date separating observation period from label period
+    first_date : date
+        first date of observation period
+
+    Returns
+    -------
+    pd.DataFrame
+        fact observations with additional column window
+    """
+    d_bounds = get_window_bounds(cut_off_date, first_date)
+    kauf_datum = fact["kauf_datum"]
+
+    def in_window(window: str) -> np.ndarray:
+        start, end = d_bounds[window]
+        return (
+            (kauf_datum >= pd.to_datetime(start))
+            & (kauf_datum <= pd.to_datetime(end))
+        ).to_numpy()
+
+    codes = np.full(len(fact), -1, dtype="int8")
+    codes[in_window("first")] = WINDOWS.index("first")
+    codes[in_window("12m")] = WINDOWS.index("12m")
+    rows_last = np.flatnonzero(in_window("last"))
+
+    rows = np.concatenate([np.flatnonzero(codes >= 0), rows_last])
+    codes = np.concatenate(
+        [
+            codes[codes >= 0],
+            np.full(len(rows_last), WINDOWS.index("last"), dtype="int8"),
+        ]
+    )
+    fact = fact.iloc[rows].reset_index(drop=True)
+    fact["window"] = pd.Categorical.from_codes(codes, categories=WINDOWS)
+
+    return fact
+
+
 # FEATURE-TOOLS-RELATED
 
 
@@ -297,38 +610,13 @@ def create_ft_matrix_and_defs_full(
     pd.DataFrame, List[ft.FeatureBase]
         featuretools feature matrix and feature list
     """
-
-    ft_to_drop = [
-        "MODE(sales_fact.MONTH(kauf_datum))",
-        "MODE(fees_fact.MONTH(kauf_datum))",
-        "MODE(sales_fact.mcg_id)",
-    ]
-
     feature_matrix, feature_defs = ft.dfs(
         entityset=es,
         target_entity="population",
         verbose=True,
-        drop_exact=ft_to_drop,
         cutoff_time=pd.to_datetime(cut_off_date),
-        agg_primitives=[
-            "sum",
-            "std",
-            "max",
-            "skew",
-            "min",
-            "mean",
-            "count",
-            "num_unique",
-            "mode",
-            "avg_time_between",
-            "trend",
-            "time_since_last",
-        ],
-        trans_primitives=[
-            "month",
-        ],
-        where_primitives=["sum", "count", "mean", "trend"],
         n_jobs=n_jobs,
+        **FEATURES_FULL,
     )
 
     return feature_matrix, feature_defs
@@ -355,39 +643,254 @@ def create_ft_matrix_and_defs_reduced(
     pd.DataFrame, List[ft.FeatureBase]
         featuretools feature matrix and feature list
     """
-
-    ft_to_drop = [
-        "NUM_UNIQUE(sales_fact.transaktionsart_id_korr)",
-        "AVG_TIME_BETWEEN(fees_fact.kauf_datum)",
-        "NUM_UNIQUE(sales_fact.MONTH(kauf_datum))",
-        "NUM_UNIQUE(fees_fact.MONTH(kauf_datum))",
-        "SUM(sales_fact.betrag WHERE transaktionsart_id_korr = 0)",
-        "COUNT(fees_fact WHERE bewegungstyp = mahnung)",
-        "COUNT(fees_fact WHERE bewegungstyp = fremdw)",
-        "COUNT(fees_fact WHERE bewegungstyp = zins)",
-        "NUM_UNIQUE(fees_fact.MONTH(kauf_datum))",
-    ]
-
     feature_matrix, feature_defs = ft.dfs(
         entityset=es,
         target_entity="population",
         verbose=True,
-        drop_exact=ft_to_drop,
         cutoff_time=pd.to_datetime(cut_off_date),
-        agg_primitives=[
-            "sum",
-            "count",
-            "num_unique",
-            "avg_time_between",
-        ],
-        trans_primitives=[],
-        where_primitives=["sum", "count"],
-        n_jobs=n_jobs
+        n_jobs=n_jobs,
+        **FEATURES_REDUCED,
     )
 
     return feature_matrix, feature_defs
 
 
+def create_feature_matrix(
+    pop: pd.DataFrame,
+    sales: pd.DataFrame,
+    fees: pd.DataFrame,
+    cut_off_date: date,
+    full: bool,
+    n_jobs: int,
+    use_featuretools: bool = False
+) -> pd.DataFrame:
+    """Calculate the full (12-month period) or reduced (first and last
+    month) feature matrix, either natively with grouped pandas operations
+    (see module `fact_aggregations`) or with featuretools' dfs. Both
+    return the same feature names.
+
+    Parameters
+    ----------
+    pop : pd.DataFrame
+        population used at the given cut-off date
+    sales : pd.DataFrame
+        slice of loaded sales_fact table, for given population and period
+    fees : pd.DataFrame
+        slice of loaded fees_fact table, for given population and period
+    cut_off_date : date
+        cut-off date separating observation period from label period
+    full : bool
+        calculate the full set (FEATURES_FULL), else FEATURES_REDUCED
+    n_jobs: int
+        number of workers to use (featuretools only)
+    use_featuretools : bool
+        use featuretools instead of the native aggregations
+        (defaults to False)
+
+    Returns
+    -------
+    pd.DataFrame
+        feature matrix indexed by konto_lauf_id
+    """
+    if use_featuretools:
+        es = create_entity_set_ft(pop, sales, fees)
+        if full:
+            fm, _ = create_ft_matrix_and_defs_full(es, cut_off_date, n_jobs)
+        else:
+            fm, _ = create_ft_matrix_and_defs_reduced(
+                es, cut_off_date, n_jobs
+            )
+        return fm
+
+    features = FEATURES_FULL if full else FEATURES_REDUCED
+    return utils_agg.calculate_feature_matrix(
+        pop, sales, fees, cut_off_date, **features
+    )
+
+
+@utils_instr.instrument
+def create_window_feature_matrices(
+    pop: pd.DataFrame,
+    sales: pd.DataFrame,
+    fees: pd.DataFrame,
+    cut_off_date: date,
+    first_date: date,
+    n_jobs: int,
+    use_featuretools: bool = False
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Calculate the reduced feature matrices for the first and the last
+    month and the full feature matrix for the 12-month period. Natively,
+    the facts are labelled with their periods (`assign_fact_windows`)
+    and the features of all periods are calculated in one grouped
+    operation, keyed by konto_lauf_id and period. FEATURES_FULL covers
+    all primitives of FEATURES_REDUCED, so the reduced matrices are a
+    selection of its columns. With featuretools, the facts are split
+    into 3 periods with one entity set each.
+
+    Parameters
+    ----------
+    pop : pd.DataFrame
+        population used at the given cut-off date
+    sales : pd.DataFrame
+        sales_fact observations for the given population and cut-off date
+    fees : pd.DataFrame
+        fees_fact observations for the given population and cut-off date
+    cut_off_date : date
+        cut-off date separating observation period from label period
+    first_date :  date
+        first date of observation period
+    n_jobs: int
+        number of workers to use (featuretools only)
+    use_featuretools : bool
+        use featuretools instead of the native aggregations
+        (defaults to False)
+
+    Returns
+    -------
+    pd.DataFrame, pd.DataFrame, pd.DataFrame
+        fm_first, fm_last, fm_12m, indexed by konto_lauf_id
+    """
+    if use_featuretools:
+        sales_first, sales_12m, sales_last = split_fact_df_into_3_periods(
+            sales, cut_off_date, first_date
+        )
+        fees_first, fees_12m, fees_last = split_fact_df_into_3_periods(
+            fees, cut_off_date, first_date
+        )
+        fm_first = create_feature_matrix(
+            pop, sales_first, fees_first, cut_off_date, False, n_jobs, True
+        )
+        fm_last = create_feature_matrix(
+            pop, sales_last, fees_last, cut_off_date, False, n_jobs, True
+        )
+        fm_12m = create_feature_matrix(
+            pop, sales_12m, fees_12m, cut_off_date, True, n_jobs, True
+        )
+        return fm_first, fm_last, fm_12m
+
+    sales = assign_fact_windows(sales, cut_off_date, first_date)
+    fees = assign_fact_windows(fees, cut_off_date, first_date)
+    fm = utils_agg.calculate_feature_matrix(
+        pop,
+        sales,
+        fees,
+        cut_off_date,
+        FEATURES_FULL["agg_primitives"],
+        FEATURES_FULL["where_primitives"],
+        FEATURES_FULL["trans_primitives"],
+        window_col="window",
+    )
+
+    cols_reduced = utils_agg.feature_names(**FEATURES_REDUCED)
+    cols_full = utils_agg.feature_names(**FEATURES_FULL)
+    fm_first = fm.xs("first", level="window")[cols_reduced]
+    fm_last = fm.xs("last", level="window")[cols_reduced]
+    fm_12m = fm.xs("12m", level="window")[cols_full]
+
+    return fm_first, fm_last, fm_12m
+
+
+@utils_instr.instrument
+def create_window_feature_matrices_sharded(
+    pop: pd.DataFrame,
+    sales: pd.DataFrame,
+    fees: pd.DataFrame,
+    cut_off_date: date,
+    first_date: date,
+    n_jobs: int,
+    n_shards: int = None
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """`create_window_feature_matrices` (native) in a process pool: the
+    population is hash-partitioned by konto_lauf_id into n_shards, every
+    shard fits the facts to its accounts (`fit_fact_df_to_population`)
+    and calculates its feature matrices. The facts are shared with the
+    workers as memory-mapped Arrow files sorted by shard (see module
+    `shards`), not pickled. The results are reassembled in the order of
+    pop, identical to a single process run.
+
+    Parameters
+    ----------
+    pop : pd.DataFrame
+        population used at the given cut-off date
+    sales : pd.DataFrame
+        sales_fact observations for the given cut-off date
+    fees : pd.DataFrame
+        fees_fact observations for the given cut-off date
+    cut_off_date : date
+        cut-off date separating observation period from label period
+    first_date :  date
+        first date of observation period
+    n_jobs: int
+        number of worker processes
+    n_shards : int
+        number of shards (defaults to None, one per worker: every shard
+        has a fixed overhead of about a quarter second)
+
+    Returns
+    -------
+    pd.DataFrame, pd.DataFrame, pd.DataFrame
+        fm_first, fm_last, fm_12m, indexed by konto_lauf_id
+    """
+    n_shards = n_shards or n_jobs
+    with utils_shards.make_shared_dir() as shared_dir:
+        dict_paths = dict()
+        for name, fact in [("sales", sales), ("fees", fees)]:
+            path = os.path.join(shared_dir, f"{name}.arrow")
+            dict_paths[name] = (
+                path, utils_shards.write_sharded(fact, path, n_shards)
+            )
+
+        l_shards = list(utils_shards.split_population(pop, n_shards))
+        logger.info(
+            f"""calculating features for {len(l_shards)} shards """
+            f"""with {n_jobs} workers"""
+        )
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            l_futures = [
+                executor.submit(
+                    _window_feature_matrices_for_shard,
+                    dict_paths,
+                    i_shard,
+                    pop_shard,
+                    cut_off_date,
+                    first_date,
+                ) for i_shard, pop_shard in l_shards
+            ]
+            l_results = [future.result() for future in l_futures]
+
+    index = pd.Index(pop["konto_lauf_id"], name="konto_lauf_id")
+    return tuple(
+        pd.concat([result[i] for result in l_results]).reindex(index)
+        for i in range(3)
+    )
+
+
+def _window_feature_matrices_for_shard(
+    dict_paths: dict,
+    i_shard: int,
+    pop_shard: pd.DataFrame,
+    cut_off_date: date,
+    first_date: date
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """worker of `create_window_feature_matrices_sharded`"""
+    dict_facts = dict(
+        {
+            name: fit_fact_df_to_population(
+                utils_shards.read_shard(path, offsets, i_shard), pop_shard
+            )
+            for name, (path, offsets) in dict_paths.items()
+        }
+    )
+    return create_window_feature_matrices(
+        pop_shard,
+        dict_facts["sales"],
+        dict_facts["fees"],
+        cut_off_date,
+        first_date,
+        n_jobs=1,
+    )
+
+
 def impute_missing_values_full(
     feature_matrix_reduced: pd.DataFrame
 ) -> pd.DataFrame:
@@ -514,17 +1017,30 @@ def concat_fm_12m_and_trend_features(
 
 
 # TODO add asserts
+@utils_instr.instrument
 def load_fact_feature_set(
     pop: pd.DataFrame,
     cut_off_date: date,
     first_date: date,
     engine: Engine,
     n_jobs: int,
-    do_check: bool = False
+    do_check: bool = False,
+    sales: pd.DataFrame = None,
+    fees: pd.DataFrame = None,
+    cache_dir: str = None,
+    use_featuretools: bool = False,
+    state_dir: str = None
 ) -> pd.DataFrame:
     """main function for loading the complete fact feature set,
-    applying featuretools during the process. This brings together
-    all the other function in the module `fact_features`.
+    calculating the features natively or with featuretools (see
+    `create_feature_matrix`). This brings together
+    all the other function in the module `fact_features`. If sales and
+    fees are passed (see `load_fact_cache`) they are sliced to the
+    given cut-off date instead of being loaded from jemas. If state_dir
+    is passed, the features are derived from the incrementally refreshed
+    state of monthly partial aggregates instead (see module
+    `fact_state`), loading only the facts recorded since the last
+    refresh.
 
     Parameters
     ----------
@@ -537,51 +1053,89 @@ def load_fact_feature_set(
     engine : Engine
         jemas connection
     n_jobs: int
-        number of workers to use for feature_set calculation (featuretools)
+        number of workers to use for feature_set calculation (featuretools
+        or, natively, processes for the shards of the population, see
+        `create_window_feature_matrices_sharded`)
+    do_check : bool
+        run sanity checks on the feature matrices (defaults to False)
+    sales : pd.DataFrame
+        pre-loaded sales facts covering the observation period
+        (defaults to None, loading them from jemas)
+    fees : pd.DataFrame
+        pre-loaded fees facts covering the observation period
+        (defaults to None, loading them from jemas)
+    cache_dir : str
+        directory of the local parquet cache (defaults to None)
+    use_featuretools : bool
+        calculate the features with featuretools' dfs instead of the
+        native aggregations (defaults to False)
+    state_dir : str
+        directory of the persisted fact state (defaults to None, not
+        using the state)
 
     Returns
     -------
     pd.DataFrame
         reduced copy of fact
     """
-    # Load, fit and split fact data
-    sales = load_sales_fact(cut_off_date, first_date, engine)
-    sales_red = fit_fact_df_to_population(sales, pop)
-    sales_first, sales_12m, sales_last = split_fact_df_into_3_periods(
-        sales_red, cut_off_date, first_date
-    )
-
-    fees = load_fees_fact(cut_off_date, first_date, engine)
-    fees_red = fit_fact_df_to_population(fees, pop)
-    fees_first, fees_12m, fees_last = split_fact_df_into_3_periods(
-        fees_red, cut_off_date, first_date
-    )
+    if state_dir is not None:
+        fm_first, fm_last, fm_12m = utils_state.load_fact_feature_matrices(
+            pop, cut_off_date, first_date, engine, state_dir, cache_dir
+        )
+        return assemble_fact_feature_set(fm_first, fm_last, fm_12m, do_check)
+
+    # Load (or slice) fact data
+    if sales is None:
+        sales = load_sales_fact(cut_off_date, first_date, engine, cache_dir)
+    sales = slice_fact_df_to_window(sales, cut_off_date, first_date)
+
+    if fees is None:
+        fees = load_fees_fact(cut_off_date, first_date, engine, cache_dir)
+    fees = slice_fact_df_to_window(fees, cut_off_date, first_date)
+
+    # Create feature matrices for all 3 periods (natively per shard of the
+    # population if there are several workers)
+    if n_jobs > 1 and not use_featuretools:
+        fm_first, fm_last, fm_12m = create_window_feature_matrices_sharded(
+            pop, sales, fees, cut_off_date, first_date, n_jobs
+        )
+    else:
+        sales_red = fit_fact_df_to_population(sales, pop)
+        fees_red = fit_fact_df_to_population(fees, pop)
+        fm_first, fm_last, fm_12m = create_window_feature_matrices(
+            pop, sales_red, fees_red, cut_off_date, first_date, n_jobs,
+            use_featuretools
+        )
+
+    return assemble_fact_feature_set(fm_first, fm_last, fm_12m, do_check)
+
+
+@utils_instr.instrument
+def assemble_fact_feature_set(
+    fm_first: pd.DataFrame,
+    fm_last: pd.DataFrame,
+    fm_12m: pd.DataFrame,
+    do_check: bool = False
+) -> pd.DataFrame:
+    """impute the feature matrices of the 3 periods and append the trend
+    features (last month vs. first month) to the 12-month features
 
-    # Create entity sets and featuretools matrices
-    es_first = create_entity_set_ft(pop, sales_first, fees_first)
-    es_last = create_entity_set_ft(pop, sales_last, fees_last)
-    es_12m = create_entity_set_ft(pop, sales_12m, fees_12m)
+    Parameters
+    ----------
+    fm_first : pd.DataFrame
+        reduced feature matrix for the first month
+    fm_last : pd.DataFrame
+        reduced feature matrix for the last month
+    fm_12m : pd.DataFrame
+        full feature matrix for the 12-month period
+    do_check : bool
+        run sanity checks on the feature matrices (defaults to False)
 
-    t_start = datetime.now()
-    fm_first, _ = create_ft_matrix_and_defs_reduced(
-        es_first, cut_off_date, n_jobs
-    )
-    t_diff = (datetime.now() - t_start).seconds
-    logger.info(
-        f"""creating features -13 months took {round(t_diff/60, 1)} minutes"""
-    )
-    t_start = datetime.now()
-    fm_last, _ = create_ft_matrix_and_defs_reduced(
-        es_last, cut_off_date, n_jobs
-    )
-    logger.info(
-        f"""creating features -1 months took {round(t_diff/60, 1)} minutes"""
-    )
-    t_start = datetime.now()
-    fm_12m, _ = create_ft_matrix_and_defs_full(es_12m, cut_off_date, n_jobs)
-    logger.info(
-        f"""creating features for 12 months months took {round(t_diff/60, 1)} minutes"""
-    )
+    Returns
+    -------
+    pd.DataFrame
+        complete fact feature set
+    """
     logger.info(
         f"""imputing (logically) missing values for featuretools data"""
     )
@@ -0,0 +1,795 @@
+from datetime import date, timedelta
+from typing import List, Tuple
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.engine.base import Engine
+
+from . import fact_aggregations as utils_agg
+from . import fact_features as utils_ff
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+# The state holds mergeable partial aggregates of the fact tables per
+# konto_lauf_id and month of kauf_datum, one directory per child entity,
+# month and version (the cut-off date of the refresh that wrote it):
+#   <state_dir>/<child_id>/<YYYY-MM>/<YYYY-MM-DD>/moments.parquet
+#   <state_dir>/<child_id>/<YYYY-MM>/<YYYY-MM-DD>/counts_<column>.parquet
+# Readers see the newest version of each month not later than the
+# cut-off date in FILE_META, so the months written by a refresh only
+# become visible (for all child entities at once) when FILE_META is
+# replaced at its end.
+# moments: count, sum, mean, centred moments (sums of d^2 and d^3 and of
+# d_t * d for the deviations d from the mean), min / max of the numeric
+# columns, mean and centred moment of t and first / last timestamp, for
+# all observations (segment "") and for each interesting value (e.g.
+# segment "bewegungstyp = mahnung"). counts: number of observations per
+# value of the categorical columns. t is measured in days since
+# T_ANCHOR.
+MONTH = "kauf_monat"
+SEGMENT = "segment"
+KEYS = [utils_agg.ENTITY_INDEX, MONTH]
+T_ANCHOR = pd.Timestamp("2000-01-01")
+FILE_META = "_state.json"
+
+
+def load_fact_feature_matrices(
+    pop: pd.DataFrame,
+    cut_off_date: date,
+    first_date: date,
+    engine: Engine,
+    state_dir: str,
+    cache_dir: str = None
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """incremental replacement for
+    `fact_features.create_window_feature_matrices`: refresh the state
+    with the facts recorded since the last refresh (one month for the
+    monthly production batch) and derive the feature matrices of the 3
+    periods from the state of the months they cover.
+
+    Parameters
+    ----------
+    pop : pd.DataFrame
+        population used at the given cut-off date
+    cut_off_date : date
+        cut-off date separating observation period from label period,
+        must be the last day of a month
+    first_date :  date
+        first date of observation period, must be the first of a month
+    engine : Engine
+        jemas connection
+    state_dir : str
+        directory of the persisted state
+    cache_dir : str
+        directory of the local parquet cache (defaults to None)
+
+    Returns
+    -------
+    pd.DataFrame, pd.DataFrame, pd.DataFrame
+        fm_first, fm_last, fm_12m, indexed by konto_lauf_id
+    """
+    refresh_fact_state(state_dir, cut_off_date, first_date, engine, cache_dir)
+
+    d_state = dict(
+        {
+            child_id: read_state(state_dir, child_id, first_date, cut_off_date)
+            for child_id in utils_agg.CHILD_ENTITIES
+        }
+    )
+    d_months = get_window_months(cut_off_date, first_date)
+    fm_first = calculate_feature_matrix_from_state(
+        pop, d_state, cut_off_date, d_months["first"],
+        **utils_ff.FEATURES_REDUCED
+    )
+    fm_last = calculate_feature_matrix_from_state(
+        pop, d_state, cut_off_date, d_months["last"],
+        **utils_ff.FEATURES_REDUCED
+    )
+    fm_12m = calculate_feature_matrix_from_state(
+        pop, d_state, cut_off_date, d_months["12m"], **utils_ff.FEATURES_FULL
+    )
+
+    return fm_first, fm_last, fm_12m
+
+
+def refresh_fact_state(
+    state_dir: str,
+    cut_off_date: date,
+    first_date: date,
+    engine: Engine,
+    cache_dir: str = None
+) -> None:
+    """bring the state up to the given cut-off date. Only the facts
+    recorded (erfassung_datum) after the previous refresh are loaded and
+    merged into the months they belong to, months before the first month
+    of the observation period are dropped. Without a state, all facts of
+    the observation period are loaded (backfill). Refreshing for the
+    cut-off date of the state again does nothing. The refreshed months
+    are written as new versions and published together with the meta
+    data, so an interrupted refresh leaves the state unchanged and is
+    simply repeated by the next call. The facts of all accounts are kept
+    (no population pushdown): an account entering the population later
+    needs the facts it had before.
+
+    Parameters
+    ----------
+    state_dir : str
+        directory of the persisted state
+    cut_off_date : date
+        cut-off date separating observation period from label period
+    first_date :  date
+        first date of observation period
+    engine : Engine
+        jemas connection
+    cache_dir : str
+        directory of the local parquet cache (defaults to None)
+    """
+    meta = _read_meta(state_dir)
+    if meta is None:
+        logger.info(f"""no fact state found, building from {first_date}""")
+        first_date_load = first_date
+    else:
+        dt_state = date.fromisoformat(meta["dt_cut_off"])
+        if cut_off_date < dt_state:
+            raise ValueError(
+                f"state is at {dt_state}, cannot refresh to {cut_off_date}"
+            )
+        if cut_off_date == dt_state:
+            logger.info(f"""fact state is up to date ({dt_state})""")
+            return
+        # continues the erfassung_datum filter of the previous refresh,
+        # see `fact_features.load_sales_fact`
+        first_date_load = dt_state + timedelta(days=4)
+    _discard_unpublished(state_dir)
+
+    d_facts = dict(
+        {
+            "sales_fact": utils_ff.load_sales_fact(
+                cut_off_date, first_date_load, engine, cache_dir,
+                pushdown_population=False
+            ),
+            "fees_fact": utils_ff.load_fees_fact(
+                cut_off_date, first_date_load, engine, cache_dir,
+                pushdown_population=False
+            ),
+        }
+    )
+    for child_id, fact in d_facts.items():
+        state_new = build_state(fact, child_id)
+        l_months = list(state_new["moments"][MONTH].unique())
+        state_old = read_state(state_dir, child_id, months=l_months)
+        write_state(
+            state_dir,
+            child_id,
+            merge_states([state_old, state_new]),
+            cut_off_date,
+        )
+
+    _write_meta(state_dir, cut_off_date)
+    for child_id in d_facts:
+        prune_state(state_dir, child_id, first_date)
+    logger.info(f"""refreshed fact state to {cut_off_date}""")
+
+
+def build_state(fact: pd.DataFrame, child_id: str) -> dict:
+    """aggregate fact observations to the state of the months (of
+    kauf_datum) they belong to
+
+    Parameters
+    ----------
+    fact : pd.DataFrame
+        loaded fact table
+    child_id : str
+        name of the child entity, see `fact_aggregations.CHILD_ENTITIES`
+
+    Returns
+    -------
+    dict
+        with keys "moments" (pd.DataFrame) and "counts" (dict of
+        pd.DataFrame, one per categorical column)
+    """
+    entity = utils_agg.CHILD_ENTITIES[child_id]
+    time = fact[utils_agg.TIME_INDEX]
+    fact = fact.assign(**{MONTH: time.dt.to_period("M").dt.start_time})
+
+    l_moments = [_segment_moments(fact, entity["numeric"], "")]
+    for col, values in entity["interesting_values"].items():
+        for value in values:
+            l_moments.append(
+                _segment_moments(
+                    fact.loc[fact[col] == value],
+                    entity["numeric"],
+                    _segment_name(col, value),
+                )
+            )
+    d_counts = dict(
+        {
+            col: fact.groupby(KEYS + [col], observed=True).size().rename(
+                "n"
+            ).reset_index()
+            for col in entity["categorical"]
+        }
+    )
+
+    return dict(
+        {
+            "moments": pd.concat(l_moments, ignore_index=True),
+            "counts": d_counts,
+        }
+    )
+
+
+def merge_states(l_states: List[dict]) -> dict:
+    """merge states (of the same child entity), partial aggregates of
+    the same konto_lauf_id, month and segment are combined
+
+    Parameters
+    ----------
+    l_states : List[dict]
+        states, see `build_state`
+
+    Returns
+    -------
+    dict
+        merged state
+    """
+    l_states = [s for s in l_states if len(s["moments"]) > 0] or l_states
+    moments = pd.concat([s["moments"] for s in l_states], ignore_index=True)
+    moments = _combine_moments(moments, KEYS + [SEGMENT]).reset_index()
+
+    d_counts = dict()
+    for col in l_states[0]["counts"]:
+        counts = pd.concat(
+            [s["counts"][col] for s in l_states], ignore_index=True
+        )
+        d_counts[col] = counts.groupby(
+            KEYS + [col], observed=True
+        )["n"].sum().reset_index()
+
+    return dict({"moments": moments, "counts": d_counts})
+
+
+def write_state(
+    state_dir: str, child_id: str, state: dict, version: date
+) -> None:
+    """persist the state as the given version, one directory per month.
+    The months are not visible to `read_state` before the meta data is
+    at the cut-off date of the version, see `refresh_fact_state`.
+
+    Parameters
+    ----------
+    state_dir : str
+        directory of the persisted state
+    child_id : str
+        name of the child entity
+    state : dict
+        state, see `build_state`
+    version : date
+        cut-off date of the refresh writing the state
+    """
+    for month, moments in state["moments"].groupby(MONTH):
+        path = os.path.join(
+            state_dir, child_id, f"{month:%Y-%m}", f"{version:%Y-%m-%d}"
+        )
+        path_tmp = f"{path}.tmp"
+        shutil.rmtree(path_tmp, ignore_errors=True)
+        os.makedirs(path_tmp)
+
+        moments.to_parquet(
+            os.path.join(path_tmp, "moments.parquet"), index=False
+        )
+        for col, counts in state["counts"].items():
+            counts.loc[counts[MONTH] == month].to_parquet(
+                os.path.join(path_tmp, f"counts_{col}.parquet"), index=False
+            )
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(path_tmp, path)
+
+
+def read_state(
+    state_dir: str,
+    child_id: str,
+    first_date: date = None,
+    cut_off_date: date = None,
+    months: list = None
+) -> dict:
+    """read the published state of the months between first_date and
+    cut_off_date (or of the given months)
+
+    Parameters
+    ----------
+    state_dir : str
+        directory of the persisted state
+    child_id : str
+        name of the child entity
+    first_date : date
+        read months from the month of this date (defaults to None)
+    cut_off_date : date
+        read months up to the month of this date (defaults to None)
+    months : list
+        read these months only (defaults to None)
+
+    Returns
+    -------
+    dict
+        state, see `build_state` (empty if nothing is persisted)
+    """
+    entity = utils_agg.CHILD_ENTITIES[child_id]
+    d_paths = _published_months(state_dir, child_id)
+    l_months = sorted(d_paths)
+    if first_date is not None:
+        l_months = [m for m in l_months if m >= _month_start(first_date)]
+    if cut_off_date is not None:
+        l_months = [m for m in l_months if m <= _month_start(cut_off_date)]
+    if months is not None:
+        # as Timestamps, Series.unique() gives datetime64 in pandas < 2
+        set_months = set(pd.DatetimeIndex(months))
+        l_months = [m for m in l_months if m in set_months]
+
+    l_moments = []
+    d_counts = dict({col: [] for col in entity["categorical"]})
+    for month in l_months:
+        path = d_paths[month]
+        l_moments.append(
+            pd.read_parquet(os.path.join(path, "moments.parquet"))
+        )
+        for col in d_counts:
+            d_counts[col].append(
+                pd.read_parquet(os.path.join(path, f"counts_{col}.parquet"))
+            )
+
+    if len(l_moments) == 0:
+        return dict(
+            {
+                "moments": pd.DataFrame(columns=KEYS + [SEGMENT]),
+                "counts":
+                    {
+                        col: pd.DataFrame(columns=KEYS + [col, "n"])
+                        for col in d_counts
+                    },
+            }
+        )
+
+    return dict(
+        {
+            "moments": pd.concat(l_moments, ignore_index=True),
+            "counts":
+                {
+                    col: pd.concat(l_counts, ignore_index=True)
+                    for col, l_counts in d_counts.items()
+                },
+        }
+    )
+
+
+def prune_state(state_dir: str, child_id: str, first_date: date) -> int:
+    """drop the persisted months before the month of first_date and the
+    versions of the other months replaced by their published version
+
+    Returns
+    -------
+    int
+        number of dropped months
+    """
+    d_paths = _published_months(state_dir, child_id)
+    l_months = [m for m in d_paths if m < _month_start(first_date)]
+    for month in l_months:
+        shutil.rmtree(os.path.dirname(d_paths[month]))
+
+    for month, path in d_paths.items():
+        if month in l_months:
+            continue
+        path_month, name = os.path.split(path)
+        for version in os.listdir(path_month):
+            if version < name:
+                shutil.rmtree(os.path.join(path_month, version))
+
+    return len(l_months)
+
+
+def get_window_months(cut_off_date: date, first_date: date) -> dict:
+    """first and last month of the 3 feature periods (see
+    `fact_features.get_window_bounds`), which cover whole months as long
+    as cut_off_date is the last day of a month
+
+    Parameters
+    ----------
+    cut_off_date : date
+        cut-off date separating observation period from label period
+    first_date : date
+        first date of observation period
+
+    Returns
+    -------
+    dict
+        (first month, last month) for each of `fact_features.WINDOWS`
+    """
+    if (cut_off_date + timedelta(days=1)).day != 1:
+        raise ValueError(f"cut-off date {cut_off_date} is not a month end")
+    if first_date.day != 1:
+        raise ValueError(f"first date {first_date} is not a month start")
+
+    d_bounds = utils_ff.get_window_bounds(cut_off_date, first_date)
+    return dict(
+        {
+            window: (_month_start(start), _month_start(end))
+            for window, (start, end) in d_bounds.items()
+        }
+    )
+
+
+def calculate_feature_matrix_from_state(
+    pop: pd.DataFrame,
+    d_state: dict,
+    cut_off_date: date,
+    months: Tuple[pd.Timestamp, pd.Timestamp],
+    agg_primitives: List[str],
+    where_primitives: List[str],
+    trans_primitives: List[str],
+    drop_exact: List[str] = None,
+) -> pd.DataFrame:
+    """derive the feature matrix of a period from the state of the months
+    it covers. Gives the same features as
+    `fact_aggregations.calculate_feature_matrix` on the raw facts.
+
+    Parameters
+    ----------
+    pop : pd.DataFrame
+        population used at the given cut-off date
+    d_state : dict
+        state per child entity, see `read_state`
+    cut_off_date : date
+        cut-off date (reference for TIME_SINCE_LAST)
+    months : Tuple[pd.Timestamp, pd.Timestamp]
+        first and last month of the period
+    agg_primitives : List[str]
+        aggregation primitives
+    where_primitives : List[str]
+        primitives calculated for the interesting values
+    trans_primitives : List[str]
+        transform primitives (only "month" is supported)
+    drop_exact : List[str]
+        names of features to drop (defaults to None)
+
+    Returns
+    -------
+    pd.DataFrame
+        feature matrix, indexed by konto_lauf_id in the order of pop
+    """
+    l_fm = []
+    for child_id, state in d_state.items():
+        state = _select_months(state, months)
+        l_fm.append(
+            _child_features_from_state(
+                state,
+                child_id,
+                cut_off_date,
+                agg_primitives,
+                where_primitives,
+                trans_primitives,
+            )
+        )
+
+    index = pd.Index(pop[utils_agg.ENTITY_INDEX], name=utils_agg.ENTITY_INDEX)
+    fm = pd.concat(l_fm, axis=1).reindex(index)
+    fm = utils_agg._fill_default_values(fm)
+    cols = utils_agg.feature_names(
+        agg_primitives, where_primitives, trans_primitives, drop_exact
+    )
+
+    return fm[cols]
+
+
+def _child_features_from_state(
+    state: dict,
+    child_id: str,
+    cut_off_date: date,
+    agg_primitives: List[str],
+    where_primitives: List[str],
+    trans_primitives: List[str],
+) -> pd.DataFrame:
+    """all features of one child entity (see
+    `fact_aggregations.aggregate_child`) from its state
+    """
+    moments = state["moments"]
+    d_features = dict()
+
+    for where, specs in utils_agg._child_feature_specs(
+        child_id, agg_primitives, where_primitives, trans_primitives
+    ):
+        segment = "" if where is None else _segment_name(*where)
+        moments_seg = moments.loc[moments[SEGMENT] == segment]
+        m = _combine_moments(moments_seg, [utils_agg.ENTITY_INDEX])
+
+        for name, primitive, col in specs:
+            if col == f"MONTH({utils_agg.TIME_INDEX})":
+                counts = moments_seg.assign(
+                    month=moments_seg[MONTH].dt.month
+                ).groupby([utils_agg.ENTITY_INDEX, "month"])["n"].sum()
+                counts = counts.loc[counts > 0].reset_index()
+                if primitive == "num_unique":
+                    d_features[name] = counts.groupby(
+                        utils_agg.ENTITY_INDEX
+                    ).size()
+                elif primitive == "mode":
+                    d_features[name] = counts.sort_values(
+                        ["n", "month"], ascending=[False, True]
+                    ).drop_duplicates(subset=utils_agg.ENTITY_INDEX
+                                      ).set_index(utils_agg.ENTITY_INDEX
+                                                  )["month"]
+                else:
+                    raise ValueError(
+                        f"aggregation primitive {primitive} not supported"
+                        f" for {col}"
+                    )
+            elif primitive in ["num_unique", "mode"]:
+                counts = state["counts"][col].groupby(
+                    [utils_agg.ENTITY_INDEX, col], observed=True
+                )["n"].sum()
+                counts = counts.loc[counts > 0].reset_index()
+                if primitive == "num_unique":
+                    d_features[name] = counts.groupby(
+                        utils_agg.ENTITY_INDEX
+                    ).size()
+                else:
+                    d_features[name] = counts.sort_values(
+                        ["n", col], ascending=[False, True]
+                    ).drop_duplicates(subset=utils_agg.ENTITY_INDEX
+                                      ).set_index(utils_agg.ENTITY_INDEX)[col]
+            else:
+                d_features[name] = _feature_from_moments(
+                    m, primitive, col, cut_off_date
+                )
+
+    return pd.DataFrame(d_features)
+
+
+def _feature_from_moments(
+    m: pd.DataFrame, primitive: str, col: str, cut_off_date: date
+) -> pd.Series:
+    """calculate a feature from the merged moments of a period, same
+    conventions as in module `fact_aggregations`
+    """
+    n = m["n"]
+    if primitive == "count":
+        return n
+    if primitive == "time_since_last":
+        return (pd.to_datetime(cut_off_date) - m["ts_max"]).dt.total_seconds()
+    if primitive == "avg_time_between":
+        span = (m["ts_max"] - m["ts_min"]).dt.total_seconds()
+        return (span / (n - 1)).where(n >= 2)
+    if primitive == "sum":
+        return m[f"sum_{col}"]
+    if primitive == "max":
+        return m[f"max_{col}"]
+    if primitive == "min":
+        return m[f"min_{col}"]
+
+    is_const = m[f"max_{col}"] == m[f"min_{col}"]
+    m2 = m[f"m2_{col}"].where(~is_const, 0)
+    if primitive == "mean":
+        return m[f"mean_{col}"]
+    if primitive == "std":
+        return np.sqrt(m2 / (n - 1)).where(n >= 2)
+    if primitive == "skew":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            skew = (n * (n - 1)**0.5 / (n - 2)) * (m[f"m3_{col}"] / m2**1.5)
+        return skew.where(~is_const, 0).where(n >= 3)
+    if primitive == "trend":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slope_per_day = m[f"c_t_{col}"] / m["m2_t"]
+        # time unit of featuretools' TREND depends on the first timestamp
+        secs_first = (
+            m["ts_min"].to_numpy().astype("datetime64[s]").astype("int64")
+        )
+        dividend = np.select(
+            [secs_first % d == 0 for d in [86400, 3600, 60]],
+            [86400, 3600, 60],
+            default=1
+        )
+        trend = slope_per_day * dividend / 86400
+        return trend.where(m["ts_max"] != m["ts_min"], 0).where(n > 2)
+
+    raise ValueError(f"aggregation primitive {primitive} not supported")
+
+
+def _segment_moments(
+    df: pd.DataFrame, numeric: List[str], segment: str
+) -> pd.DataFrame:
+    """partial aggregates per konto_lauf_id and month of one segment"""
+    time = df[utils_agg.TIME_INDEX]
+    t = (time - T_ANCHOR).dt.total_seconds() / 86400
+    # each observation is a partial aggregate of its own
+    d_cols = dict(
+        {
+            "n": 1,
+            "ts_min": time,
+            "ts_max": time,
+            "mean_t": t,
+            "m2_t": 0.0,
+        }
+    )
+    for col in numeric:
+        y = df[col].astype("float64")
+        d_cols.update(
+            {
+                f"sum_{col}": y,
+                f"mean_{col}": y,
+                f"m2_{col}": 0.0,
+                f"m3_{col}": 0.0,
+                f"c_t_{col}": 0.0,
+                f"min_{col}": y,
+                f"max_{col}": y,
+            }
+        )
+    moments = _combine_moments(df[KEYS].assign(**d_cols), KEYS).reset_index()
+    moments[SEGMENT] = segment
+
+    return moments
+
+
+def _combine_moments(moments: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """combine the partial aggregates of the same keys. The centred
+    moments of the parts are shifted to the mean of the group before they
+    are added up (Chan et al.), so no power sums of the raw values cancel.
+
+    Returns
+    -------
+    pd.DataFrame
+        combined moments, indexed by keys
+    """
+    funcs = _moment_agg_funcs(moments.columns)
+    if len(moments) == 0:
+        return moments.groupby(keys, observed=True).agg(funcs)
+
+    l_vars = [col[len("mean_"):] for col in funcs if col.startswith("mean_")]
+    n_part = moments["n"]
+    weighted = moments[keys].assign(
+        n=n_part,
+        **{var: n_part * moments[f"mean_{var}"] for var in l_vars}
+    ).groupby(keys, observed=True).transform("sum")
+
+    d_delta = dict(
+        {
+            var: moments[f"mean_{var}"] - weighted[var] / weighted["n"]
+            for var in l_vars
+        }
+    )
+    d_terms = dict()
+    for var, delta in d_delta.items():
+        m2 = moments[f"m2_{var}"]
+        d_terms[f"mean_{var}"] = n_part * moments[f"mean_{var}"]
+        d_terms[f"m2_{var}"] = m2 + n_part * delta**2
+        if f"m3_{var}" in funcs:
+            d_terms[f"m3_{var}"] = (
+                moments[f"m3_{var}"] + 3 * delta * m2 + n_part * delta**3
+            )
+        if f"c_t_{var}" in funcs:
+            d_terms[f"c_t_{var}"] = (
+                moments[f"c_t_{var}"] + n_part * d_delta["t"] * delta
+            )
+
+    combined = moments.assign(**d_terms).groupby(keys, observed=True).agg(
+        funcs
+    )
+    for var in l_vars:
+        combined[f"mean_{var}"] = combined[f"mean_{var}"] / combined["n"]
+
+    return combined
+
+
+def _moment_agg_funcs(columns: list) -> dict:
+    """how to combine the partial aggregates of the moments columns"""
+    funcs = dict()
+    for col in columns:
+        if col in KEYS + [SEGMENT]:
+            continue
+        if col.startswith("min_") or col == "ts_min":
+            funcs[col] = "min"
+        elif col.startswith("max_") or col == "ts_max":
+            funcs[col] = "max"
+        else:
+            funcs[col] = "sum"
+
+    return funcs
+
+
+def _select_months(
+    state: dict, months: Tuple[pd.Timestamp, pd.Timestamp]
+) -> dict:
+    """restrict a state to the months between months[0] and months[1]"""
+
+    def in_months(df: pd.DataFrame) -> pd.DataFrame:
+        return df.loc[(df[MONTH] >= months[0]) & (df[MONTH] <= months[1])]
+
+    return dict(
+        {
+            "moments": in_months(state["moments"]),
+            "counts":
+                {
+                    col: in_months(counts)
+                    for col, counts in state["counts"].items()
+                },
+        }
+    )
+
+
+def _segment_name(col: str, value) -> str:
+    return f"{col} = {value}"
+
+
+def _month_start(dt: date) -> pd.Timestamp:
+    return pd.Timestamp(dt.year, dt.month, 1)
+
+
+def _published_months(state_dir: str, child_id: str) -> dict:
+    """path of the published version of each persisted month, i.e. of
+    its newest version not later than the cut-off date of the meta data
+    """
+    meta = _read_meta(state_dir)
+    path = os.path.join(state_dir, child_id)
+    if meta is None or not os.path.isdir(path):
+        return dict()
+
+    d_paths = dict()
+    for name in os.listdir(path):
+        l_versions = [
+            version for version in os.listdir(os.path.join(path, name))
+            if not version.endswith(".tmp")
+            and version <= meta["dt_cut_off"]
+        ]
+        if len(l_versions) > 0:
+            d_paths[pd.Timestamp(f"{name}-01")] = os.path.join(
+                path, name, max(l_versions)
+            )
+
+    return d_paths
+
+
+def _discard_unpublished(state_dir: str) -> None:
+    """remove the versions written by an interrupted refresh, i.e. the
+    ones later than the cut-off date of the meta data
+    """
+    meta = _read_meta(state_dir)
+    for child_id in utils_agg.CHILD_ENTITIES:
+        path = os.path.join(state_dir, child_id)
+        if not os.path.isdir(path):
+            continue
+        for name in os.listdir(path):
+            for version in os.listdir(os.path.join(path, name)):
+                if meta is None or version > meta["dt_cut_off"]:
+                    shutil.rmtree(os.path.join(path, name, version))
+
+
+def _read_meta(state_dir: str) -> dict:
+    path = os.path.join(state_dir, FILE_META)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_meta(state_dir: str, cut_off_date: date) -> None:
+    """replace the meta data atomically, publishing the versions written
+    for cut_off_date
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    path = os.path.join(state_dir, FILE_META)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"dt_cut_off": cut_off_date.isoformat()}, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
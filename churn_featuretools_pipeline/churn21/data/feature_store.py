@@ -0,0 +1,366 @@
+from datetime import date
+from typing import List
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+from sqlalchemy.engine.base import Engine
+
+from . import load as utils_ld
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+# Feature store keyed by (konto_lauf_id, dt_cut_off): one uncompressed
+# Arrow IPC (feather v2) file per block and cut-off date, sorted by
+# konto_lauf_id, e.g. <store_dir>/ft/dt_cut_off=2020-12-31.arrow. The
+# files are memory-mapped on lookup, only the requested rows are copied.
+# The population block comes first, its columns are never suffixed (same
+# column names as `load.assemble_snapshot`, without label).
+BLOCKS = ["pop", "af_date", "af_history"] + [
+    tbl.replace("churn21_", "") for tbl in utils_ld.JAMO_BASED_TABLES
+] + ["ft"]
+KEY = "konto_lauf_id"
+
+
+def write_partition(
+    store_dir: str, cut_off_date: date, dict_blocks: dict
+) -> None:
+    """persist the feature blocks of one cut-off date (replacing blocks
+    stored before). Every file only becomes visible once it is complete.
+
+    Parameters
+    ----------
+    store_dir : str
+        root directory of the feature store
+    cut_off_date : date
+        cut-off date of the blocks
+    dict_blocks : dict
+        block name -> pd.DataFrame, with konto_lauf_id as column or
+        index, see `load.build_feature_blocks`
+    """
+    for name, block in dict_blocks.items():
+        if KEY not in block.columns:
+            block = block.reset_index()
+        block = block.sort_values(KEY, kind="stable").reset_index(drop=True)
+        if block[KEY].duplicated().any():
+            raise ValueError(f"block {name} has duplicate {KEY}")
+
+        path = _partition_path(store_dir, name, cut_off_date)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        feather.write_feather(
+            block, f"{path}.tmp", compression="uncompressed"
+        )
+        os.replace(f"{path}.tmp", path)
+
+    logger.info(
+        f"""stored {len(dict_blocks)} blocks for cut-off date """
+        f"""{cut_off_date:%Y-%m-%d}"""
+    )
+
+
+def list_cut_off_dates(store_dir: str, blocks: list = None) -> List[date]:
+    """cut-off dates for which all blocks are stored, ascending
+
+    Parameters
+    ----------
+    store_dir : str
+        root directory of the feature store
+    blocks : list
+        block names (defaults to None, all BLOCKS)
+
+    Returns
+    -------
+    List[date]
+        complete cut-off dates
+    """
+    l_sets = []
+    for name in blocks or BLOCKS:
+        path = os.path.join(store_dir, name)
+        if not os.path.isdir(path):
+            return []
+        l_sets.append(
+            {
+                f[len("dt_cut_off="):-len(".arrow")]
+                for f in os.listdir(path)
+                if f.startswith("dt_cut_off=") and f.endswith(".arrow")
+            }
+        )
+
+    return sorted(pd.Timestamp(d).date() for d in set.intersection(*l_sets))
+
+
+def backfill(
+    store_dir: str,
+    dict_dfs: dict,
+    l_dates: list,
+    engine: Engine,
+    cache_dir: str = None,
+    state_dir: str = None
+) -> List[date]:
+    """compute and store the feature blocks of the cut-off dates in
+    l_dates that are not (completely) stored yet, in ascending order
+    (the most recent info of the jamo-based tables is then updated
+    incrementally, see `load.iter_most_recent_information`)
+
+    Parameters
+    ----------
+    store_dir : str
+        root directory of the feature store
+    dict_dfs : dict
+        pre-loaded data frames, see `load.create_dataset`
+    l_dates : list
+        date parameters, one dict per cut-off date
+    engine : Engine
+        jemas connection
+    cache_dir : str
+        directory of the local parquet cache for the sql extracts
+        (defaults to None, not using a cache)
+    state_dir : str
+        directory of the persisted fact state, see module `fact_state`
+        (defaults to None)
+
+    Returns
+    -------
+    List[date]
+        cut-off dates that have been computed
+    """
+    stored = set(list_cut_off_dates(store_dir))
+    l_missing = sorted(
+        [d for d in l_dates if d["dt_cut_off"] not in stored],
+        key=lambda d: d["dt_cut_off"],
+    )
+    logger.info(
+        f"""{len(l_dates) - len(l_missing)} of {len(l_dates)} cut-off """
+        f"""dates stored, computing {len(l_missing)}"""
+    )
+    if len(l_missing) == 0:
+        return []
+
+    l_cut_off_dates = [d["dt_cut_off"] for d in l_missing]
+    iter_most_recent = zip(
+        *[
+            utils_ld.iter_most_recent_information(df, l_cut_off_dates)
+            for df in dict_dfs["l_jamo_based"]
+        ]
+    )
+    for dict_dates, l_most_recent in zip(l_missing, iter_most_recent):
+        dict_blocks = utils_ld.build_feature_blocks(
+            dict_dfs,
+            dict_dates,
+            engine,
+            is_test=False,
+            cache_dir=cache_dir,
+            state_dir=state_dir,
+            l_most_recent=l_most_recent
+        )
+        write_partition(store_dir, dict_dates["dt_cut_off"], dict_blocks)
+
+    return l_cut_off_dates
+
+
+def get_features(
+    store_dir: str,
+    konto_lauf_ids,
+    cut_off_dates,
+    blocks: list = None,
+    columns: list = None
+) -> pd.DataFrame:
+    """point-in-time lookup: the features of every (konto_lauf_id,
+    cut-off date) pair as of the latest stored cut-off date on or before
+    the requested one, never from a later one. Accounts that are not in
+    the population of that cut-off date get missing values, as do
+    features not stored for that cut-off date (the schema is read per
+    cut-off date, see `_column_renames`).
+
+    Parameters
+    ----------
+    store_dir : str
+        root directory of the feature store
+    konto_lauf_ids : array-like
+        accounts to look up
+    cut_off_dates : array-like or date
+        requested cut-off date per account, or one for all accounts
+    blocks : list
+        blocks to read (defaults to None, all BLOCKS)
+    columns : list
+        feature columns to read, as named in the result (defaults to
+        None, all columns)
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per requested pair, in the order of the request, with
+        konto_lauf_id, dt_cut_off (requested), dt_cut_off_store (stored
+        cut-off date used, NaT if there is none) and the features of all
+        stored cut-off dates used
+    """
+    blocks = blocks or BLOCKS
+    ids = np.asarray(konto_lauf_ids)
+    requested = pd.to_datetime(
+        pd.Series(np.broadcast_to(np.asarray(cut_off_dates), ids.shape))
+    ).to_numpy(dtype="datetime64[D]")
+
+    stored = np.array(
+        list_cut_off_dates(store_dir, blocks), dtype="datetime64[D]"
+    )
+    i_stored = np.searchsorted(stored, requested, side="right") - 1
+    dt_store = np.full(len(ids), np.datetime64("NaT"), "datetime64[D]")
+    dt_store[i_stored >= 0] = stored[i_stored[i_stored >= 0]]
+
+    # newest first, for the order of the result columns
+    l_used = list(np.unique(i_stored[i_stored >= 0])[::-1])
+    dict_stored = dict(
+        {i: _stored_columns(store_dir, stored[i]) for i in l_used}
+    )
+    dict_renames = _column_renames(list(dict_stored.values()))
+    l_parts = [
+        pd.DataFrame(
+            {
+                KEY: ids,
+                "dt_cut_off": requested.astype("datetime64[ns]"),
+                "dt_cut_off_store": dt_store.astype("datetime64[ns]"),
+            }
+        )
+    ]
+    for name in blocks:
+        dict_rename = dict_renames.get(name, dict())
+        l_cols = _block_columns(dict_rename, columns)
+        l_rows, l_pos = [], []
+        for i in l_used:
+            pos = np.flatnonzero(i_stored == i)
+            table = _read_block(
+                store_dir,
+                name,
+                stored[i],
+                [c for c in l_cols if c in dict_stored[i][name]],
+            )
+            l_rows.append(
+                _take_rows(table, ids[pos]).rename(columns=dict_rename)
+            )
+            l_pos.append(pos)
+        l_parts.append(
+            _scatter(
+                l_rows, l_pos, len(ids), [dict_rename[c] for c in l_cols]
+            )
+        )
+
+    return pd.concat(l_parts, axis=1)
+
+
+# HELPER FUNCTION(S)
+
+
+def _partition_path(store_dir: str, name: str, cut_off_date) -> str:
+    file_name = f"dt_cut_off={pd.Timestamp(cut_off_date):%Y-%m-%d}.arrow"
+    return os.path.join(store_dir, name, file_name)
+
+
+def _read_block(
+    store_dir: str, name: str, cut_off_date, columns: list
+) -> pa.Table:
+    """memory-mapped block of one cut-off date (no data is read yet)"""
+    return feather.read_table(
+        _partition_path(store_dir, name, cut_off_date),
+        columns=[KEY] + columns,
+        memory_map=True,
+    )
+
+
+def _take_rows(table: pa.Table, ids: np.ndarray) -> pd.DataFrame:
+    """rows of table (sorted by konto_lauf_id) for ids, by binary search;
+    ids that are not in the table get missing values
+    """
+    keys = table.column(KEY).to_numpy()
+    idx = np.minimum(np.searchsorted(keys, ids), max(len(keys) - 1, 0))
+    is_found = (
+        (keys[idx] == ids) if len(keys) > 0
+        else np.zeros(len(ids), dtype=bool)
+    )
+    indices = pa.array(np.where(is_found, idx, 0), mask=~is_found)
+    table = table.drop_columns([KEY])
+    if table.num_columns == 0:
+        return pd.DataFrame(index=range(len(ids)))
+
+    return table.take(indices).to_pandas()
+
+
+def _stored_columns(store_dir: str, cut_off_date) -> dict:
+    """block name -> stored columns of the blocks stored for cut_off_date,
+    from their schema (no data is read)
+    """
+    dict_columns = dict()
+    for name in BLOCKS:
+        path = _partition_path(store_dir, name, cut_off_date)
+        if not os.path.isfile(path):
+            continue
+        with pa.memory_map(path) as source:
+            schema = pa.ipc.open_file(source).schema
+        dict_columns[name] = [c for c in schema.names if c != KEY]
+
+    return dict_columns
+
+
+def _column_renames(l_stored: list) -> dict:
+    """block name -> {stored column: result column} for the stored
+    columns of one or more cut-off dates (see `_stored_columns`). Columns
+    occurring in more than one block get the block name as suffix
+    (except for the population block), as in `load.assemble_snapshot`.
+    This is decided over all the cut-off dates, so that a result column
+    stands for the same block in every row.
+    """
+    dict_columns = dict()
+    for dict_stored in l_stored:
+        for name, cols in dict_stored.items():
+            known = dict_columns.setdefault(name, [])
+            known += [c for c in cols if c not in known]
+
+    n_occurrences = pd.Series(
+        [c for cols in dict_columns.values() for c in cols], dtype=object
+    ).value_counts()
+    return dict(
+        {
+            name: dict(
+                {
+                    c: c if name == "pop" or n_occurrences[c] == 1
+                    else f"{c}_{name}"
+                    for c in cols
+                }
+            )
+            for name, cols in dict_columns.items()
+        }
+    )
+
+
+def _block_columns(dict_rename: dict, columns: list) -> list:
+    """stored columns of a block needed for the requested columns"""
+    if columns is None:
+        return list(dict_rename)
+    return [c for c, c_out in dict_rename.items() if c_out in columns]
+
+
+def _scatter(
+    l_rows: list, l_pos: list, n: int, columns: list
+) -> pd.DataFrame:
+    """put the rows looked up per stored cut-off date back into the order
+    of the request, columns missing for a cut-off date are left empty
+    """
+    if len(l_rows) == 0:
+        return pd.DataFrame(index=range(n), columns=columns)
+    df = utils_ld._concat_chunks(
+        [rows.reindex(columns=columns) for rows in l_rows]
+    )
+    order = np.full(n, -1, dtype="int64")
+    order[np.concatenate(l_pos)] = np.arange(len(df))
+
+    return df.reindex(order).reset_index(drop=True)
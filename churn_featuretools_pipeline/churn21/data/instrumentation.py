@@ -0,0 +1,317 @@
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Iterator
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:     # optional, RSS from /proc/self/statm then
+    psutil = None
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+# Records of the stages run in this process. If the environment variable
+# is set (see `set_log_file`), every record is also appended as one JSON
+# line to that file, which collects the records of worker processes too.
+ENV_LOG_FILE = "CHURN21_STAGE_LOG"
+RUN_ID = uuid.uuid4().hex[:12]
+_records = []
+_local = threading.local()
+
+# While stages are open, a sampler thread polls the RSS and keeps the
+# peak of every open stage (keyed by the id of its record).
+SAMPLE_INTERVAL_S = 0.05
+_peaks = dict()
+_peaks_lock = threading.Lock()
+_sampler = None
+
+
+def set_log_file(path: str = None) -> None:
+    """write the stage records as JSON lines to path (appending), also
+    in worker processes started afterwards. None stops writing.
+    """
+    if path is None:
+        os.environ.pop(ENV_LOG_FILE, None)
+    else:
+        os.environ[ENV_LOG_FILE] = path
+
+
+@contextmanager
+def stage(name: str, rows_in: int = None) -> Iterator[dict]:
+    """measure a pipeline stage: wall time, CPU time (of the process),
+    RSS at the end, peak RSS during the stage and its increase over the
+    RSS at entry, rows in and rows out. The peak is sampled every
+    SAMPLE_INTERVAL_S, or exact if the stage raised the peak of the
+    process. The yielded record can be updated within the block, e.g.
+    `record["rows_out"] = len(df)`.
+
+    Parameters
+    ----------
+    name : str
+        name of the stage
+    rows_in : int
+        number of input rows (defaults to None)
+
+    Yields
+    ------
+    dict
+        the record of the stage, stored once the block is left
+    """
+    stack = _stack()
+    record = dict(
+        {
+            "run_id": RUN_ID,
+            "pid": os.getpid(),
+            "stage": name,
+            "parent": stack[-1] if stack else None,
+            "t_start": datetime.now().isoformat(),
+            "rows_in": rows_in,
+            "rows_out": None,
+        }
+    )
+    stack.append(name)
+    rss_start, max_rss_start = _rss(), _max_rss()
+    _track_peak(id(record), rss_start)
+    t_wall, t_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        stack.pop()
+        record["wall_s"] = round(time.perf_counter() - t_wall, 3)
+        record["cpu_s"] = round(time.process_time() - t_cpu, 3)
+        rss, max_rss = _rss(), _max_rss()
+        peak = _untrack_peak(id(record), rss)
+        if max_rss is not None and max_rss_start is not None \
+                and max_rss > max_rss_start:
+            # the peak of the process was reached within the stage
+            peak = max_rss if peak is None else max(peak, max_rss)
+        record["rss_mb"] = _to_mb(rss)
+        record["peak_rss_mb"] = _to_mb(peak)
+        record["delta_rss_mb"] = (
+            None if peak is None or rss_start is None
+            else _to_mb(peak - rss_start)
+        )
+        _store(record)
+
+
+def instrument(func: Callable = None, name: str = None) -> Callable:
+    """decorator running func as `stage`. Rows in are the rows of all data
+    frame arguments, rows out those of the returned data frame(s).
+
+    Parameters
+    ----------
+    func : Callable
+        function to instrument
+    name : str
+        name of the stage (defaults to None, the function name)
+
+    Returns
+    -------
+    Callable
+        instrumented function
+    """
+    if func is None:
+        return lambda f: instrument(f, name)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(
+            name or func.__name__,
+            rows_in=_count_rows(list(args) + list(kwargs.values())),
+        ) as record:
+            result = func(*args, **kwargs)
+            record["rows_out"] = _count_rows([result])
+        return result
+
+    return wrapper
+
+
+def get_records(path: str = None) -> pd.DataFrame:
+    """records of the stages, of this process or read from a JSON lines
+    file (see `set_log_file`)
+    """
+    if path is None:
+        return pd.DataFrame(_records)
+    return pd.read_json(path, lines=True)
+
+
+def summarize(records: pd.DataFrame = None) -> pd.DataFrame:
+    """summary table per stage: number of calls, total and max wall time,
+    total CPU time, max peak RSS and RSS increase and total rows in and
+    out
+
+    Parameters
+    ----------
+    records : pd.DataFrame
+        stage records (defaults to None, the records of this process)
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per stage, sorted by total wall time
+    """
+    if records is None:
+        records = get_records()
+    if len(records) == 0:
+        return pd.DataFrame()
+
+    df_summary = records.groupby("stage").agg(
+        n_calls=("wall_s", "size"),
+        wall_s=("wall_s", "sum"),
+        wall_s_max=("wall_s", "max"),
+        cpu_s=("cpu_s", "sum"),
+        peak_rss_mb=("peak_rss_mb", "max"),
+        delta_rss_mb=("delta_rss_mb", "max"),
+        rows_in=("rows_in", "sum"),
+        rows_out=("rows_out", "sum"),
+    )
+
+    return df_summary.sort_values("wall_s", ascending=False)
+
+
+def reset() -> None:
+    """drop the records of this process"""
+    _records.clear()
+
+
+def _store(record: dict) -> None:
+    _records.append(record)
+    logger.debug(
+        f"""{record["stage"]}: {record["wall_s"]} s wall, """
+        f"""{record["cpu_s"]} s cpu, {record["rows_out"]} rows out"""
+    )
+    path = os.environ.get(ENV_LOG_FILE)
+    if path is not None:
+        with open(path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+def _stack() -> list:
+    """names of the stages open in this thread"""
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def _rss() -> int:
+    """current resident set size of the process in bytes, None if it
+    cannot be determined (neither psutil nor /proc)
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _max_rss() -> int:
+    """peak resident set size over the lifetime of the process in bytes,
+    None if it cannot be determined
+    """
+    if psutil is not None:
+        peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+        if peak is not None:    # Windows only
+            return peak
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux and the BSDs
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _track_peak(key: int, rss: int) -> None:
+    """start keeping the peak RSS for key, with the sampler running"""
+    global _sampler
+    if rss is None:
+        return
+    with _peaks_lock:
+        _peaks[key] = rss
+        if _sampler is None:
+            _sampler = threading.Thread(
+                target=_sample_peaks, name="rss-sampler", daemon=True
+            )
+            _sampler.start()
+
+
+def _untrack_peak(key: int, rss: int) -> int:
+    """stop keeping the peak RSS for key and return it"""
+    with _peaks_lock:
+        peak = _peaks.pop(key, None)
+    if peak is None or rss is None:
+        return peak
+    return max(peak, rss)
+
+
+def _sample_peaks() -> None:
+    """update the peaks of the open stages until none is open"""
+    global _sampler
+    while True:
+        rss = _rss()
+        with _peaks_lock:
+            if len(_peaks) == 0:
+                _sampler = None
+                return
+            for key, peak in _peaks.items():
+                if rss > peak:
+                    _peaks[key] = rss
+        time.sleep(SAMPLE_INTERVAL_S)
+
+
+def _reset_after_fork() -> None:
+    """the sampler thread does not survive a fork, neither do the open
+    stages of the parent
+    """
+    global _peaks_lock, _sampler
+    _peaks.clear()
+    _peaks_lock = threading.Lock()
+    _sampler = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _to_mb(n_bytes: int) -> float:
+    return None if n_bytes is None else round(n_bytes / 2**20, 1)
+
+
+def _count_rows(objs: list) -> int:
+    """total rows of the data frames in objs (also inside lists, tuples
+    and dicts), None if there are none
+    """
+    n_rows, found = 0, False
+    for obj in objs:
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            n_rows, found = n_rows + len(obj), True
+        elif isinstance(obj, (list, tuple, dict)):
+            values = obj.values() if isinstance(obj, dict) else obj
+            n_sub = _count_rows(
+                [o for o in values if isinstance(o, (pd.DataFrame, pd.Series))]
+            )
+            if n_sub is not None:
+                n_rows, found = n_rows + n_sub, True
+
+    return n_rows if found else None
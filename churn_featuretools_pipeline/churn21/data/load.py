@@ -1,14 +1,24 @@
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import date
-from functools import partial, reduce
+from functools import partial
+from itertools import repeat
+from typing import Iterator
 import logging
 
+import numpy as np
 import pandas as pd
-from bcag.sql_utils import execute_sql_query
+from pandas.api.types import CategoricalDtype
+from sqlalchemy import create_engine
 from sqlalchemy.engine.base import Engine
+from sqlalchemy.engine.url import URL
 
+from . import cache as utils_cache
 from . import fact_features as utils_ff
+from . import instrumentation as utils_instr
+from . import sql_scripts as utils_sql
+from . import storage as utils_store
 
 sys.path.append("..")
 
@@ -22,13 +32,64 @@ ch.setFormatter(formatter)
 logger.addHandler(ch)
 logger.setLevel(logging.DEBUG)
 
-
+# Tables in jemas_temp.thm with one row per konto_lauf_id and jamo
+JAMO_BASED_TABLES = [
+    "churn21_general_information",
+    "churn21_fakturadaten",
+    "churn21_segments",
+]
+
+# Declared target dtypes for the extracts, applied chunk by chunk while
+# reading (see `_read_sql_downcast`). "integer" and "float" are downcast
+# to the smallest possible format, "datetime" is parsed, "category" stays
+# consistent across chunks. Undeclared columns use `_downcast_dtypes`.
+SCHEMA_LABEL = {
+    "konto_lauf_id": "integer",
+    "kuendigung_an_datum": "datetime",
+    "cancellation_type": "category",
+}
+SCHEMA_POPULATION = {
+    "konto_lauf_id": "integer",
+    "konto_id": "float",
+    "jamo": "integer",
+}
+SCHEMA_JAMO_BASED = {
+    "konto_lauf_id": "integer",
+    "jamo": "integer",
+    "letzter_tag": "datetime",
+}
+SCHEMA_ANNUAL_FEE_HISTORY = {
+    "konto_lauf_id": "integer",
+    "kauf_datum": "datetime",
+    "betrag": "float",
+}
+SCHEMA_ANNUAL_FEE_DATE = {
+    "konto_lauf_id": "integer",
+    "jahresgebuehr_datum": "datetime",
+    "load_lauf_end_datum": "datetime",
+}
+# rows per chunk when checking whether float64 columns fit into float32,
+# bounds the temporary arrays of `_float32_dtypes`
+ROWS_PER_FLOAT_CHECK = 2**20
+
+
+@utils_instr.instrument
 def create_dataset(
-    l_dates_train: list, l_dates_test: list, update_sql_scripts: bool,
-    engine: Engine
+    l_dates_train: list,
+    l_dates_test: list,
+    update_sql_scripts: bool,
+    engine: Engine,
+    n_workers: int = 1,
+    load_facts_once: bool = True,
+    cache_dir: str = None,
+    n_connections: int = 4,
+    max_density: float = None,
+    output_dir: str = None,
+    n_jobs_features: int = 1
 ) -> list:
     """create train and test set using l_dates_train and l_dates_test 
-    for train and test periods, respectively
+    for train and test periods, respectively. Every cut-off date results
+    in one snapshot, the snapshots are stacked (column dt_cut_off).
 
     Parameters
     ----------
@@ -40,63 +101,385 @@ def create_dataset(
         should the .sql scripts in $ROOT\sql\ be run?
     engine : Engine
         jemas connection. can be dev, test, or prod
+    n_workers : int
+        number of processes to use for the cut-off dates (defaults to 1,
+        processing all cut-off dates serially in the current process)
+    load_facts_once : bool
+        load sales and fees facts once for all cut-off dates instead of
+        once per cut-off date (defaults to True)
+    cache_dir : str
+        directory of the local parquet cache for the sql extracts, see
+        module `cache` (defaults to None, not using a cache)
+    n_connections : int
+        number of sql scripts and extracts running concurrently against
+        jemas (defaults to 4)
+    max_density : float
+        compact every snapshot before stacking, see
+        `storage.compact_feature_matrix` (defaults to None, keeping the
+        dense float64 snapshots)
+    output_dir : str
+        write train and test set out-of-core to the subdirectories
+        train / test, one snapshot at a time, see
+        `write_several_cut_off_dates` (defaults to None, stacking them
+        in memory)
+    n_jobs_features : int
+        number of processes for the fact features of a cut-off date, if
+        the cut-off dates are processed serially (defaults to 1)
 
     Returns
     -------
     list
-        containing df_train and df_test
+        containing df_train and df_test, with output_dir their
+        directories instead (see `storage.iter_training_set`)
     """
     if update_sql_scripts:
-        run_sql_scripts(engine)
-    pop = load_population(engine)
-    label = load_label(engine)
-    af_history = load_annual_fee_history(engine)
-    af_date = load_annual_fee_date(engine)
-    gi = load_jamo_based_info(engine, "churn21_general_information")
-    fd = load_jamo_based_info(engine, "churn21_fakturadaten")
-    segs = load_jamo_based_info(engine, "churn21_segments")
-    l_jamo_based = [gi, fd, segs]
-    dict_dfs = dict(
-        {
-            "pop": pop,
-            "label": label,
-            "af_history": af_history,
-            "af_date": af_date,
-            "l_jamo_based": l_jamo_based
-        }
+        run_sql_scripts(engine, cache_dir, n_connections)
+
+    # the extracts are independent, load them concurrently
+    with ThreadPoolExecutor(max_workers=n_connections) as executor:
+        dict_futures = dict(
+            {
+                "pop": executor.submit(load_population, engine, cache_dir),
+                "label": executor.submit(load_label, engine, cache_dir),
+                "af_history":
+                    executor.submit(
+                        load_annual_fee_history, engine, cache_dir
+                    ),
+                "af_date":
+                    executor.submit(load_annual_fee_date, engine, cache_dir),
+            }
+        )
+        l_futures_jamo_based = [
+            executor.submit(
+                load_jamo_based_info, engine, tbl_name, cache_dir
+            ) for tbl_name in JAMO_BASED_TABLES
+        ]
+        dict_dfs = dict(
+            {name: future.result() for name, future in dict_futures.items()}
+        )
+        dict_dfs["l_jamo_based"] = [
+            future.result() for future in l_futures_jamo_based
+        ]
+    if load_facts_once:
+        dict_dfs.update(
+            utils_ff.load_fact_cache(
+                l_dates_train + l_dates_test, engine, cache_dir
+            )
+        )
+
+    l_out = []
+    for name, l_dates in [("train", l_dates_train), ("test", l_dates_test)]:
+        kwargs = dict(
+            {
+                "is_test": False,
+                "n_workers": n_workers,
+                "cache_dir": cache_dir,
+                "max_density": max_density,
+                "n_jobs_features": n_jobs_features,
+            }
+        )
+        if output_dir is None:
+            l_out.append(
+                process_several_cut_off_dates(
+                    dict_dfs, l_dates, engine, **kwargs
+                )
+            )
+        else:
+            root_dir = os.path.join(output_dir, name)
+            write_several_cut_off_dates(
+                dict_dfs, l_dates, engine, root_dir, **kwargs
+            )
+            l_out.append(root_dir)
+    logger.info(
+        f"""stage summary (this process):\n"""
+        f"""{utils_instr.summarize().to_string()}"""
     )
 
-    # l_df_train = [None] * len(l_dates_train)
-    # for i, dict_dates in enumerate(l_dates_train):
-    #     l_df_train[i] = process_cut_off_date(dict_dfs, dict_dates)
-    # df_train = reduce(lambda x, y: pd.concat, l_df_train) # ignore index?
-    df_train = pd.DataFrame()
+    return l_out
+
+
+def process_several_cut_off_dates(
+    dict_dfs: dict,
+    l_dates: list,
+    engine: Engine,
+    is_test: bool,
+    n_workers: int = 1,
+    cache_dir: str = None,
+    max_density: float = None,
+    n_jobs_features: int = 1
+) -> pd.DataFrame:
+    """process every cut-off date in l_dates and stack the resulting
+    snapshots, adding the column dt_cut_off. With n_workers > 1 the
+    cut-off dates are fanned out to a process pool, every worker gets
+    its own copy of dict_dfs (once) and its own connection to jemas.
+    All snapshots are held in memory, see `write_several_cut_off_dates`
+    for many cut-off dates.
+
+    Parameters
+    ----------
+    dict_dfs : dict
+        pre-loaded data frames, see create_dataset
+    l_dates : list
+        date parameters, one dict per cut-off date
+    engine : Engine
+        jemas connection
+    is_test : bool
+        only use a sample of the population (for development)
+    n_workers : int
+        number of processes to use (defaults to 1)
+    cache_dir : str
+        directory of the local parquet cache for the sql extracts
+        (defaults to None, not using a cache)
+    max_density : float
+        compact every snapshot (float32, sparse columns) before stacking,
+        see `storage.compact_feature_matrix` (defaults to None)
+    n_jobs_features : int
+        number of processes for the fact features of a cut-off date,
+        only used if n_workers is 1 (defaults to 1)
 
-    for dict_dates in l_dates_test:
-        df_test = process_cut_off_date(
-            dict_dfs, dict_dates, engine, is_test=False
+    Returns
+    -------
+    pd.DataFrame
+        stacked snapshots for all cut-off dates
+    """
+    if len(l_dates) == 0:
+        return pd.DataFrame()
+
+    l_df = list(
+        _iter_snapshots(
+            dict_dfs,
+            l_dates,
+            engine,
+            is_test,
+            n_workers,
+            cache_dir,
+            max_density,
+            n_jobs_features
         )
+    )
 
-    return [df_train, df_test]
+    return pd.concat(l_df, ignore_index=True)
 
 
+def write_several_cut_off_dates(
+    dict_dfs: dict,
+    l_dates: list,
+    engine: Engine,
+    root_dir: str,
+    is_test: bool,
+    n_workers: int = 1,
+    cache_dir: str = None,
+    max_density: float = None,
+    n_jobs_features: int = 1
+) -> list:
+    """out-of-core version of `process_several_cut_off_dates`: every
+    snapshot is written to root_dir (partition dt_cut_off, see
+    `storage.write_training_set`) as soon as it is finished and then
+    dropped, the stacked set never exists in memory. Cut-off dates
+    already written to root_dir are skipped, an interrupted run can be
+    resumed. Read the result with `storage.iter_training_set` or
+    `storage.read_training_set`.
+
+    Parameters
+    ----------
+    dict_dfs : dict
+        pre-loaded data frames, see create_dataset
+    l_dates : list
+        date parameters, one dict per cut-off date
+    engine : Engine
+        jemas connection
+    root_dir : str
+        root directory of the stacked training set
+    is_test : bool
+        only use a sample of the population (for development)
+    n_workers : int
+        number of processes to use, they write their snapshots
+        themselves (defaults to 1)
+    cache_dir : str
+        directory of the local parquet cache for the sql extracts
+        (defaults to None, not using a cache)
+    max_density : float
+        compact every snapshot (float32, sparse columns) before writing,
+        see `storage.compact_feature_matrix` (defaults to None)
+    n_jobs_features : int
+        number of processes for the fact features of a cut-off date,
+        only used if n_workers is 1 (defaults to 1)
+
+    Returns
+    -------
+    list
+        cut-off dates that have been written
+    """
+    stored = set(utils_store.list_partitions(root_dir))
+    l_dates = [d for d in l_dates if d["dt_cut_off"] not in stored]
+    logger.info(
+        f"""{len(stored)} cut-off dates in {root_dir}, """
+        f"""writing {len(l_dates)}"""
+    )
+
+    for df in _iter_snapshots(
+        dict_dfs,
+        l_dates,
+        engine,
+        is_test,
+        n_workers,
+        cache_dir,
+        max_density,
+        n_jobs_features,
+        root_dir
+    ):
+        if df is not None:
+            utils_store.write_training_set(df, root_dir)
+
+    return [d["dt_cut_off"] for d in l_dates]
+
+
+def _iter_snapshots(
+    dict_dfs: dict,
+    l_dates: list,
+    engine: Engine,
+    is_test: bool,
+    n_workers: int,
+    cache_dir: str,
+    max_density: float,
+    n_jobs_features: int,
+    output_dir: str = None
+) -> Iterator[pd.DataFrame]:
+    """snapshots of the cut-off dates in l_dates, in this order and one
+    at a time. With n_workers > 1 the cut-off dates are fanned out to a
+    process pool, every worker gets its own copy of dict_dfs (once) and
+    its own connection to jemas. If output_dir is given, the workers
+    write their snapshots there and None is yielded instead.
+    """
+    if n_workers > 1:
+        logger.info(
+            f"""processing {len(l_dates)} cut-off dates """
+            f"""with {n_workers} workers"""
+        )
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_cut_off_worker,
+            initargs=(dict_dfs, engine.url),
+        ) as executor:
+            worker = partial(
+                _process_cut_off_date_worker,
+                is_test=is_test,
+                cache_dir=cache_dir,
+                max_density=max_density,
+                output_dir=output_dir
+            )
+            yield from executor.map(worker, l_dates)
+        return
+
+    l_cut_off_dates = [d["dt_cut_off"] for d in l_dates]
+    if l_cut_off_dates == sorted(l_cut_off_dates):
+        iter_most_recent = zip(
+            *[
+                iter_most_recent_information(df, l_cut_off_dates)
+                for df in dict_dfs["l_jamo_based"]
+            ]
+        )
+    else:
+        iter_most_recent = repeat(None)
+    for dict_dates, l_most_recent in zip(l_dates, iter_most_recent):
+        df = process_cut_off_date(
+            dict_dfs,
+            dict_dates,
+            engine,
+            is_test,
+            cache_dir,
+            l_most_recent=l_most_recent,
+            n_jobs=n_jobs_features
+        )
+        yield _finalize_snapshot(df, dict_dates, max_density)
+
+
+@utils_instr.instrument
 def process_cut_off_date(
-    dict_dfs: dict, dict_dates: dict, engine: Engine, is_test: bool
+    dict_dfs: dict,
+    dict_dates: dict,
+    engine: Engine,
+    is_test: bool,
+    cache_dir: str = None,
+    state_dir: str = None,
+    l_most_recent: list = None,
+    n_jobs: int = 1
 ) -> pd.DataFrame:
 
-    pop = filter_population(dict_dfs["pop"], dict_dates["dt_cut_off"])
-    if is_test:
-        pop = pop.sample(1000)
-    label = filter_label(
+    dict_blocks = build_feature_blocks(
+        dict_dfs,
+        dict_dates,
+        engine,
+        is_test,
+        cache_dir,
+        state_dir,
+        l_most_recent,
+        n_jobs
+    )
+    pop = dict_blocks.pop("pop")
+    dict_blocks["label"] = filter_label(
         dict_dfs["label"], dict_dates["dt_cut_off"],
         dict_dates["dt_label_last_considered"]
     )
-    # most recent info of jamo-based
-    most_recent_partial = partial(
-        _most_recent_information, cut_off_date=dict_dates["dt_cut_off"]
-    )
-    iterable = map(most_recent_partial, dict_dfs["l_jamo_based"])
-    l_out = list(iterable)
+    df_chunk = assemble_snapshot(pop, dict_blocks)
+
+    return df_chunk
+
+
+def build_feature_blocks(
+    dict_dfs: dict,
+    dict_dates: dict,
+    engine: Engine,
+    is_test: bool,
+    cache_dir: str = None,
+    state_dir: str = None,
+    l_most_recent: list = None,
+    n_jobs: int = 1
+) -> dict:
+    """population and feature blocks (everything but the label) for one
+    cut-off date, not yet aligned to the population
+
+    Parameters
+    ----------
+    dict_dfs : dict
+        pre-loaded data frames, see create_dataset
+    dict_dates : dict
+        date parameters of the cut-off date
+    engine : Engine
+        jemas connection
+    is_test : bool
+        only use a sample of the population (for development)
+    cache_dir : str
+        directory of the local parquet cache for the sql extracts
+        (defaults to None, not using a cache)
+    state_dir : str
+        directory of the persisted fact state, see module `fact_state`
+        (defaults to None)
+    l_most_recent : list
+        most recent info of the jamo-based tables, see
+        `iter_most_recent_information` (defaults to None, computed here)
+    n_jobs : int
+        number of processes for the fact features, see
+        `fact_features.create_window_feature_matrices_sharded`
+        (defaults to 1)
+
+    Returns
+    -------
+    dict
+        "pop", then block name -> pd.DataFrame: af_date, af_history,
+        one per jamo-based table and ft
+    """
+    pop = filter_population(dict_dfs["pop"], dict_dates["dt_cut_off"])
+    if is_test:
+        pop = pop.sample(1000)
+    # most recent info of jamo-based (unless passed incrementally, see
+    # `iter_most_recent_information`)
+    if l_most_recent is None:
+        most_recent_partial = partial(
+            _most_recent_information, cut_off_date=dict_dates["dt_cut_off"]
+        )
+        l_most_recent = map(most_recent_partial, dict_dfs["l_jamo_based"])
+    l_out = list(l_most_recent)
 
     # annual fee infos
     af_date = time_to_next_fee(dict_dfs["af_date"], dict_dates["dt_cut_off"])
@@ -110,36 +493,167 @@ def process_cut_off_date(
         dict_dates["dt_cut_off"],
         dict_dates["dt_obs_first_considered"],
         engine,
-        n_jobs=1,
-        do_check=True
+        n_jobs=n_jobs,
+        do_check=True,
+        sales=dict_dfs.get("sales"),
+        fees=dict_dfs.get("fees"),
+        cache_dir=cache_dir,
+        state_dir=state_dir
     )
 
-    # merge all data frames
-    l_chunk = [pop, af_date, af_history] + l_out + [df_ft, label]
-    df_chunk = reduce(
-        lambda x, y: pd.merge(x, y, how="left", on="konto_lauf_id"), l_chunk
+    dict_blocks = dict(
+        {"pop": pop, "af_date": af_date, "af_history": af_history}
     )
+    for tbl_name, df_jamo_based in zip(JAMO_BASED_TABLES, l_out):
+        dict_blocks[tbl_name.replace("churn21_", "")] = df_jamo_based
+    dict_blocks["ft"] = df_ft
 
-    return df_chunk
+    return dict_blocks
+
+
+@utils_instr.instrument
+def assemble_snapshot(pop: pd.DataFrame, dict_blocks: dict) -> pd.DataFrame:
+    """left-join all feature blocks to the population in one step: every
+    block is indexed by konto_lauf_id once, aligned to the population
+    with reindex and the aligned blocks are concatenated column-wise
+    (instead of a chain of merges, each copying the growing frame).
+    Columns occurring in more than one block get the block name as
+    suffix, e.g. jamo_segments.
+
+    Parameters
+    ----------
+    pop : pd.DataFrame
+        population, with column konto_lauf_id
+    dict_blocks : dict
+        block name -> pd.DataFrame, with konto_lauf_id as column or index
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per account of the population, in the order of pop
+
+    Raises
+    ------
+    ValueError
+        if konto_lauf_id is not unique in pop or in one of the blocks
+    """
+    index = pd.Index(pop["konto_lauf_id"], name="konto_lauf_id")
+    if index.has_duplicates:
+        raise ValueError("population has duplicate konto_lauf_id")
+
+    dict_blocks = dict(
+        {
+            name: block.set_index("konto_lauf_id")
+            if "konto_lauf_id" in block.columns else block
+            for name, block in dict_blocks.items()
+        }
+    )
+    n_occurrences = pd.Series(
+        [c for block in dict_blocks.values() for c in block.columns]
+        + list(pop.columns)
+    ).value_counts()
+    cols_overlapping = set(n_occurrences.index[n_occurrences > 1])
+
+    l_blocks = [pop.reset_index(drop=True)]
+    for name, block in dict_blocks.items():
+        if block.index.has_duplicates:
+            raise ValueError(f"block {name} has duplicate konto_lauf_id")
+        block = block.rename(
+            columns={c: f"{c}_{name}" for c in cols_overlapping}
+        )
+        l_blocks.append(block.reindex(index).reset_index(drop=True))
+
+    return pd.concat(l_blocks, axis=1)
+
+
+# state of the worker processes, see process_several_cut_off_dates
+_worker_state = dict()
+
+
+def _init_cut_off_worker(dict_dfs: dict, engine_url: URL) -> None:
+    """store the pre-loaded data frames and a fresh jemas connection
+    in the worker process (engines cannot be shared between processes)
+    """
+    _worker_state["dict_dfs"] = dict_dfs
+    _worker_state["engine"] = create_engine(engine_url)
+
+
+def _process_cut_off_date_worker(
+    dict_dates: dict,
+    is_test: bool,
+    cache_dir: str,
+    max_density: float,
+    output_dir: str = None
+) -> pd.DataFrame:
+    logger.info(f"""processing cut-off date {dict_dates["dt_cut_off"]}""")
+    df = process_cut_off_date(
+        _worker_state["dict_dfs"],
+        dict_dates,
+        _worker_state["engine"],
+        is_test,
+        cache_dir,
+    )
+    df = _finalize_snapshot(df, dict_dates, max_density)
+    if output_dir is not None:
+        utils_store.write_training_set(df, output_dir)
+        return None
+
+    return df
 
 
-def run_sql_scripts(engine: Engine) -> None:
-    """runs all .sql scripts stored under $ROOT\sql\
+def _finalize_snapshot(
+    df: pd.DataFrame, dict_dates: dict, max_density: float
+) -> pd.DataFrame:
+    """add the column dt_cut_off to a snapshot, compact it first if
+    max_density is given (as soon as it is created, before stacking)
+    """
+    if max_density is not None:
+        df = utils_store.compact_feature_matrix(
+            df, max_density, exclude=["konto_lauf_id"]
+        )
+    df["dt_cut_off"] = pd.to_datetime(dict_dates["dt_cut_off"])
+
+    return df
+
+
+@utils_instr.instrument
+def run_sql_scripts(
+    engine: Engine, cache_dir: str = None, n_connections: int = 4
+) -> pd.DataFrame:
+    """runs all .sql scripts stored under $ROOT\sql\ and invalidates
+    all cached extracts of the rebuilt churn21 tables. Independent
+    scripts run concurrently, the order is inferred from the tables the
+    scripts build and read (see module `sql_scripts`).
 
     Parameters
     ----------
     engine : Engine
         jemas connection
+    cache_dir : str
+        directory of the local parquet cache for the sql extracts
+        (defaults to None, not using a cache)
+    n_connections : int
+        maximum number of scripts running at the same time (defaults to 4)
+
+    Returns
+    -------
+    pd.DataFrame
+        wall time per script
     """
-    for file in os.listdir("..\sql"):
+    dict_queries = dict()
+    for file in sorted(os.listdir("..\sql")):
         if file.endswith(".sql"):
             with open(f"""..\sql\{file}""", "r") as f:
-                query = f.read()
-                logger.info(f"""executing .sql {file}""")
-                execute_sql_query(query, engine)
+                dict_queries[file] = f.read()
+    df_timing = utils_sql.run_scripts(dict_queries, engine, n_connections)
+    if cache_dir is not None:
+        utils_cache.invalidate_cache(cache_dir, ["jemas_temp.thm.churn21_*"])
 
+    return df_timing
 
-def load_label(engine: Engine) -> pd.DataFrame:
+
+@utils_instr.instrument
+def load_label(engine: Engine, cache_dir: str = None) -> pd.DataFrame:
     """load label for the whole population
 
     Parameters
@@ -148,6 +662,8 @@ def load_label(engine: Engine) -> pd.DataFrame:
         cut-off date separating observation period from label period
     engine : Engine
         jemas connection
+    cache_dir : str
+        directory of the local parquet cache (defaults to None)
 
     Returns
     -------
@@ -162,23 +678,24 @@ def load_label(engine: Engine) -> pd.DataFrame:
                      , cancellation_type \
             from     jemas_temp.thm.churn21_label"
     )
-    df_label = pd.read_sql(query, engine)
-    df_label["kuendigung_an_datum"] = pd.to_datetime(
-        df_label["kuendigung_an_datum"]
+    df_label = _read_sql_downcast(
+        query, engine, SCHEMA_LABEL, cache_dir=cache_dir
     )
-    df_label = _downcast_dtypes(df_label)
     # checks: konto_lauf_id unique, konto_lauf_id in population
 
     return df_label
 
 
-def load_population(engine: Engine) -> pd.DataFrame:
+@utils_instr.instrument
+def load_population(engine: Engine, cache_dir: str = None) -> pd.DataFrame:
     """load the population for a given cut-off date
 
     Parameters
     ----------
     engine : Engine
         jemas connection
+    cache_dir : str
+        directory of the local parquet cache (defaults to None)
 
     Returns
     -------
@@ -192,20 +709,30 @@ def load_population(engine: Engine) -> pd.DataFrame:
                    , jamo
            from    jemas_temp.thm.churn21_population"""
     )
-    df_pop = pd.read_sql(query, engine)
-    df_pop = _downcast_dtypes(df_pop)
+    df_pop = _read_sql_downcast(
+        query, engine, SCHEMA_POPULATION, cache_dir=cache_dir
+    )
     # checks: konto_lauf_id unique
 
     return df_pop
 
 
-def load_jamo_based_info(engine: Engine, tbl_name: str) -> pd.DataFrame:
-    """load whole table, which is jamo based
+@utils_instr.instrument
+def load_jamo_based_info(
+    engine: Engine, tbl_name: str, cache_dir: str = None
+) -> pd.DataFrame:
+    """load whole table, which is jamo based. The rows are sorted by
+    letzter_tag and jamo, so that the rows known at a cut-off date are a
+    prefix of the table (see `_most_recent_information`).
 
     Parameters
     ----------
     engine : Engine
         jemas connection
+    tbl_name : str
+        name of the table in jemas_temp.thm
+    cache_dir : str
+        directory of the local parquet cache (defaults to None)
 
     Returns
     -------
@@ -213,22 +740,33 @@ def load_jamo_based_info(engine: Engine, tbl_name: str) -> pd.DataFrame:
         fakturadaten
     """
     logger.info(f"""loading from {tbl_name}""")
-    query = (f"""select * from jemas_temp.thm.{tbl_name}""")
-    df = pd.read_sql(query, engine)
-    df["letzter_tag"] = pd.to_datetime(df["letzter_tag"])
-    df = _downcast_dtypes(df)
+    query = (
+        f"""select * from jemas_temp.thm.{tbl_name}
+            order by letzter_tag, jamo"""
+    )
+    df = _read_sql_downcast(
+        query, engine, SCHEMA_JAMO_BASED, cache_dir=cache_dir
+    )
+    if not df["letzter_tag"].is_monotonic_increasing:
+        df = df.sort_values(["letzter_tag", "jamo"], kind="stable")
+        df = df.reset_index(drop=True)
     # checks: konto_lauf_id and jamo unique
 
     return df
 
 
-def load_annual_fee_history(engine: Engine) -> pd.DataFrame:
+@utils_instr.instrument
+def load_annual_fee_history(
+    engine: Engine, cache_dir: str = None
+) -> pd.DataFrame:
     """load history of all paid annual fees
 
     Parameters
     ----------
     engine : Engine
         jemas connection. dev, test, or prod
+    cache_dir : str
+        directory of the local parquet cache (defaults to None)
 
     Returns
     -------
@@ -237,21 +775,26 @@ def load_annual_fee_history(engine: Engine) -> pd.DataFrame:
     """
     logger.info(f"""loading annual fee history""")
     query = (f"""select * from jemas_temp.thm.churn21_annual_fee_history""")
-    df = pd.read_sql(query, engine)
-    df["kauf_datum"] = pd.to_datetime(df["kauf_datum"])
-    df = _downcast_dtypes(df)
+    df = _read_sql_downcast(
+        query, engine, SCHEMA_ANNUAL_FEE_HISTORY, cache_dir=cache_dir
+    )
     # checks:
 
     return df
 
 
-def load_annual_fee_date(engine: Engine) -> pd.DataFrame:
+@utils_instr.instrument
+def load_annual_fee_date(
+    engine: Engine, cache_dir: str = None
+) -> pd.DataFrame:
     """load annual fee dates
 
     Parameters
     ----------
     engine : Engine
         jemas connection. dev, test, or prod
+    cache_dir : str
+        directory of the local parquet cache (defaults to None)
 
     Returns
     -------
@@ -260,21 +803,23 @@ def load_annual_fee_date(engine: Engine) -> pd.DataFrame:
     """
     logger.info(f"""loading next annual fee date""")
     query = (f"""select * from jemas_temp.thm.churn21_annual_fee_date""")
-    df = pd.read_sql(query, engine)
-    df["jahresgebuehr_datum"] = pd.to_datetime(df["jahresgebuehr_datum"])
-    df["load_lauf_end_datum"] = pd.to_datetime(df["load_lauf_end_datum"])
-    df = _downcast_dtypes(df)
+    df = _read_sql_downcast(
+        query, engine, SCHEMA_ANNUAL_FEE_DATE, cache_dir=cache_dir
+    )
     # checks:
 
     return df
 
 
+@utils_instr.instrument
 def _most_recent_information(
     df: pd.DataFrame, cut_off_date: date
 ) -> pd.DataFrame:
     """select most recent information from table having konto_lauf_id 
 
-    and jamo as columns
+    and jamo as columns. The rows up to the cut-off date are sliced by
+    binary search on letzter_tag, df is sorted by it first unless it
+    already is (as returned by `load_jamo_based_info`).
 
     Parameters
     ----------
@@ -288,15 +833,86 @@ def _most_recent_information(
     pd.DataFrame
         most recent row for every konto_lauf_id
     """
-    df = df.loc[df["letzter_tag"] <= pd.to_datetime(cut_off_date)]
-    df.sort_values(["konto_lauf_id", "jamo"], inplace=True)
-    df.reset_index(drop=True, inplace=True)
-    df["rwn"] = df.groupby(["konto_lauf_id"]).cumcount(ascending=False)
-    df = df.query("rwn == 0")
+    df = _sort_by_letzter_tag(df)
+    n_rows = _n_rows_until(df, cut_off_date)
+
+    return _latest_row_per_account(df.iloc[:n_rows])
 
-    return df
 
+def iter_most_recent_information(
+    df: pd.DataFrame, l_cut_off_dates: list
+) -> Iterator[pd.DataFrame]:
+    """most recent information for ascending cut-off dates (same result
+    as `_most_recent_information` for every date). The latest row per
+    konto_lauf_id is updated incrementally with the rows added since
+    the previous cut-off date, instead of scanning the table up to every
+    cut-off date again.
 
+    Parameters
+    ----------
+    df : pd.DataFrame
+        data frame with konto_lauf_id, jamo and letzter_tag in columns,
+        sorted by letzter_tag here unless it already is (see
+        `load_jamo_based_info`)
+    l_cut_off_dates : list
+        ascending cut-off dates
+
+    Yields
+    ------
+    pd.DataFrame
+        most recent row for every konto_lauf_id, one per cut-off date
+    """
+    df = _sort_by_letzter_tag(df)
+    latest = pd.DataFrame(
+        {
+            "konto_lauf_id": df["konto_lauf_id"].iloc[:0],
+            "jamo": df["jamo"].iloc[:0],
+            "pos": np.array([], dtype="int64"),
+        }
+    )
+    n_rows_prev = 0
+    for cut_off_date in l_cut_off_dates:
+        n_rows = _n_rows_until(df, cut_off_date)
+        if n_rows < n_rows_prev:
+            raise ValueError("cut-off dates must be in ascending order")
+
+        added = pd.DataFrame(
+            {
+                "konto_lauf_id": df["konto_lauf_id"].iloc[n_rows_prev:n_rows],
+                "jamo": df["jamo"].iloc[n_rows_prev:n_rows],
+                "pos": np.arange(n_rows_prev, n_rows),
+            }
+        )
+        latest = _latest_row_per_account(
+            pd.concat([latest, added], ignore_index=True)
+        )
+        n_rows_prev = n_rows
+
+        yield df.iloc[latest["pos"].to_numpy()].reset_index(drop=True)
+
+
+def _sort_by_letzter_tag(df: pd.DataFrame) -> pd.DataFrame:
+    """df sorted by letzter_tag (stable, the order of the rows with the
+    same letzter_tag is kept), without a copy if it already is
+    """
+    if df["letzter_tag"].is_monotonic_increasing:
+        return df
+    logger.debug(f"""sorting {len(df)} rows by letzter_tag""")
+    return df.sort_values("letzter_tag", kind="stable")
+
+
+def _n_rows_until(df: pd.DataFrame, cut_off_date: date) -> int:
+    """number of leading rows of df (sorted by letzter_tag) with
+    letzter_tag <= cut_off_date
+    """
+    return int(
+        df["letzter_tag"].searchsorted(
+            pd.to_datetime(cut_off_date), side="right"
+        )
+    )
+
+
+@utils_instr.instrument
 def filter_population(pop: pd.DataFrame, cut_off_date: date) -> pd.DataFrame:
     """filter the population for the given cut-off date
 
@@ -314,16 +930,32 @@ def filter_population(pop: pd.DataFrame, cut_off_date: date) -> pd.DataFrame:
     """
     logger.info(f"""filtering population""")
     jamo_required = cut_off_date.year * 100 + cut_off_date.month
-    pop.query(f"jamo <= {jamo_required}", inplace=True)
-    pop.sort_values(["konto_lauf_id", "jamo"], inplace=True)
-    pop.reset_index(drop=True, inplace=True)
-    pop["rwn"] = pop.groupby(["konto_lauf_id"]).cumcount(ascending=False)
-    pop = pop.query("rwn == 0 & ~konto_id.isna()")
-    pop = pop.filter(["konto_lauf_id"])
+    pop = _latest_row_per_account(pop.loc[pop["jamo"] <= jamo_required])
+    pop = pop.loc[pop["konto_id"].notna(), ["konto_lauf_id"]]
+
+    return pop.reset_index(drop=True)
+
 
-    return pop
+def _latest_row_per_account(df: pd.DataFrame) -> pd.DataFrame:
+    """select the row with the highest jamo for every konto_lauf_id
+    (a per-key argmax, no sort of the rows). The input is not modified.
 
+    Parameters
+    ----------
+    df : pd.DataFrame
+        data frame with konto_lauf_id and jamo in columns
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per konto_lauf_id, ordered by konto_lauf_id
+    """
+    idx_latest = df["jamo"].groupby(df["konto_lauf_id"], sort=True).idxmax()
 
+    return df.loc[idx_latest.to_numpy()].reset_index(drop=True)
+
+
+@utils_instr.instrument
 def filter_label(
     label: pd.DataFrame, dt_cut_off: date, dt_label_last: date
 ) -> pd.DataFrame:
@@ -352,6 +984,7 @@ def filter_label(
     return label.loc[filt]
 
 
+@utils_instr.instrument
 def time_to_next_fee(af_date: pd.DataFrame, dt_cut_off: date) -> pd.DataFrame:
     """calculate remaining days to next annual fee due date
 
@@ -380,6 +1013,7 @@ def time_to_next_fee(af_date: pd.DataFrame, dt_cut_off: date) -> pd.DataFrame:
     return df_next
 
 
+@utils_instr.instrument
 def aggregate_af_history(
     af_history: pd.DataFrame, dt_cut_off: date
 ) -> pd.DataFrame:
@@ -411,12 +1045,130 @@ def aggregate_af_history(
 # HELPER FUNCTION(S)
 
 
-def _downcast_dtypes(df: pd.DataFrame, verbose=False) -> pd.DataFrame:
-    """Return a copy of a input dataframe with reduced memory usage.
-    Numeric dtypes will be downcast to the smallest possible format,
-    object dtypes with less distinct values than rowcount will be
-    transformed to dtype 'category'. Limitations: Only 'object' cols
-     are considered for conversion to dtype 'category'.
+def _read_sql_downcast(
+    query: str,
+    engine: Engine,
+    schema: dict = None,
+    chunksize: int = 500_000,
+    cache_dir: str = None,
+    params: dict = None
+) -> pd.DataFrame:
+    """Read the result of query in chunks (server-side cursor where the
+    driver supports it) and downcast every chunk before the next one is
+    fetched, so the full frame never exists in its original dtypes.
+    The chunks are concatenated only at the end. If cache_dir is given,
+    the downcast chunks are read from / written to the local parquet
+    cache (see module `cache`) instead of querying jemas again.
+
+    Parameters
+    ----------
+    query : str
+        sql query to run
+    engine : Engine
+        jemas connection
+    schema : dict
+        declared target dtype per column, see SCHEMA_* (defaults to None,
+        downcasting all columns with `_downcast_dtypes`)
+    chunksize : int
+        number of rows per chunk (defaults to 500'000)
+    cache_dir : str
+        directory of the local parquet cache (defaults to None)
+    params : dict
+        date parameters of the query, part of the cache key
+        (defaults to None)
+
+    Returns
+    -------
+    pd.DataFrame
+        query result with downcast dtypes
+    """
+    schema = schema or dict()
+    if cache_dir is not None:
+        key = utils_cache.make_cache_key(query, params, schema)
+        if utils_cache.has_entry(cache_dir, key):
+            l_chunks = utils_cache.read_entry(cache_dir, key)
+            if len(l_chunks) > 0:
+                return _concat_chunks(l_chunks)
+
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        chunks = (
+            _downcast_chunk(chunk, schema)
+            for chunk in _iter_sql_chunks(conn, query, chunksize)
+        )
+        if cache_dir is not None:
+            l_chunks = utils_cache.write_entry(
+                cache_dir, key, chunks, query, params
+            )
+        else:
+            l_chunks = list(chunks)
+
+    return _concat_chunks(l_chunks)
+
+
+def _iter_sql_chunks(conn, query: str, chunksize: int) -> Iterator:
+    """result of query in data frames of at most chunksize rows. An empty
+    result gives one empty data frame, with the columns of the result
+    cursor (so the schema dtypes can still be applied to them).
+    """
+    result = conn.exec_driver_sql(query)
+    columns = list(result.keys())
+    is_empty = True
+    while True:
+        rows = result.fetchmany(chunksize)
+        if len(rows) == 0:
+            break
+        is_empty = False
+        yield pd.DataFrame.from_records(
+            rows, columns=columns, coerce_float=True
+        )
+
+    if is_empty:
+        yield pd.DataFrame(columns=columns)
+
+
+def _downcast_chunk(chunk: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """Downcast a chunk in place, see `_downcast_dtypes`."""
+    return _downcast_dtypes(chunk, schema=schema, inplace=True)
+
+
+def _concat_chunks(l_chunks: list) -> pd.DataFrame:
+    """Concatenate downcast chunks. Category columns get the union of
+    the categories of all chunks first, otherwise pandas would fall back
+    to dtype 'object' for chunks with differing categories.
+    """
+    cat_cols = {
+        col
+        for chunk in l_chunks
+        for col in chunk.select_dtypes("category").columns
+    }
+    for col in cat_cols:
+        categories = pd.Index([])
+        for chunk in l_chunks:
+            chunk[col] = chunk[col].astype("category")
+            categories = categories.union(chunk[col].cat.categories)
+        for chunk in l_chunks:
+            chunk[col] = chunk[col].astype(CategoricalDtype(categories))
+
+    return pd.concat(l_chunks, ignore_index=True)
+
+
+def _downcast_dtypes(
+    df: pd.DataFrame,
+    verbose=False,
+    schema: dict = None,
+    inplace: bool = False,
+    max_category_ratio: float = 0.5
+) -> pd.DataFrame:
+    """Reduce the memory usage of a dataframe. Declared columns (see
+    SCHEMA_*) are cast to their target dtype, all other numeric columns
+    are downcast to the smallest possible format and 'object' columns
+    with a ratio of distinct to non-null values of at most
+    max_category_ratio are transformed to dtype 'category'.
+    Integer columns are downcast in batch, based on the min / max of
+    all of them computed in one pass, float columns are checked for a
+    lossless cast to float32 in one pass as well. Only columns whose
+    dtype changes are replaced, the others are never copied.
 
     Parameters
     ----------
@@ -425,12 +1177,20 @@ def _downcast_dtypes(df: pd.DataFrame, verbose=False) -> pd.DataFrame:
     verbose : bool
         wether or not to print the size before and after the transformation
         (defaults to False)
+    schema : dict
+        declared target dtype per column: "integer", "float", "datetime"
+        or any dtype accepted by `astype` (defaults to None)
+    inplace : bool
+        wether to replace the columns of df itself instead of returning a
+        (shallow) copy (defaults to False)
+    max_category_ratio : float
+        maximum ratio of distinct values to non-null values for an
+        'object' column to become a 'category' (defaults to 0.5)
 
     Returns
     -------
     pd.DataFrame
-        copy of the original dataframe with downcast dtypes
-
+        dataframe with downcast dtypes (df itself if inplace)
     """
     if verbose:
         print(
@@ -438,19 +1198,39 @@ def _downcast_dtypes(df: pd.DataFrame, verbose=False) -> pd.DataFrame:
             f"{df.memory_usage(deep=True).sum() / (1024**2):,.2f} MB"
         )
 
-    df = df.copy()
+    if not inplace:
+        df = df.copy(deep=False)
+    schema = dict(
+        {col: dtype for col, dtype in (schema or dict()).items()
+         if col in df.columns}
+    )
 
+    l_int_cols, l_float_cols = [], []
     for col in df.columns:
-        col_type = str(df[col].dtype)
-        col_items = df[col].count()
-        col_unique_itmes = df[col].nunique()
-
-        if col_type == 'object' and col_unique_itmes < col_items:
-            df[col] = df[col].astype('category')
-        if col_type.startswith("int"):
-            df[col] = pd.to_numeric(df[col], downcast='integer')
-        if col_type.startswith("float"):
-            df[col] = pd.to_numeric(df[col], downcast='float')
+        dtype, col_type = schema.get(col), df[col].dtype
+        if col_type.kind == "i" and dtype in [None, "integer"]:
+            l_int_cols.append(col)
+        elif col_type.kind == "f" and dtype in [None, "float"]:
+            l_float_cols.append(col)
+        elif dtype in ["integer", "float"]:
+            df[col] = pd.to_numeric(df[col], downcast=dtype)
+        elif dtype == "datetime":
+            df[col] = pd.to_datetime(df[col])
+        elif dtype is not None:
+            df[col] = df[col].astype(dtype)
+        elif col_type == "object":
+            categorical = _to_categorical(df[col], max_category_ratio)
+            if categorical is not None:
+                df[col] = categorical
+
+    dict_dtypes = dict()
+    dict_dtypes.update(_smallest_int_dtypes(df, l_int_cols))
+    dict_dtypes.update(_float32_dtypes(df, l_float_cols))
+    for dtype in set(dict_dtypes.values()):
+        cols = [col for col, dt in dict_dtypes.items() if dt == dtype]
+        df_cast = df[cols].astype(dtype)
+        for col in cols:
+            df[col] = df_cast[col]
 
     if verbose:
         print(
@@ -459,3 +1239,73 @@ def _downcast_dtypes(df: pd.DataFrame, verbose=False) -> pd.DataFrame:
         )
 
     return df
+
+
+def _smallest_int_dtypes(df: pd.DataFrame, cols: list) -> dict:
+    """smallest signed integer dtype holding the values of each integer
+    column, only for columns where it differs from the current one
+    """
+    if len(cols) == 0 or len(df) == 0:
+        return dict()
+    mins, maxs = df[cols].min(), df[cols].max()
+
+    dict_dtypes = dict()
+    for col in cols:
+        for dtype in [np.int8, np.int16, np.int32, np.int64]:
+            info = np.iinfo(dtype)
+            if info.min <= mins[col] and maxs[col] <= info.max:
+                if np.dtype(dtype) != df[col].dtype:
+                    dict_dtypes[col] = np.dtype(dtype)
+                break
+
+    return dict_dtypes
+
+
+def _float32_dtypes(df: pd.DataFrame, cols: list) -> dict:
+    """float32 for the float64 columns whose values are unchanged by the
+    cast up to 5e-4 (absolute), like `pd.to_numeric(downcast="float")`.
+    Checked column by column on the column's own array, in chunks of
+    ROWS_PER_FLOAT_CHECK rows (stopping at the first chunk that fails).
+    """
+    dict_dtypes = dict()
+    for col in cols:
+        if df[col].dtype != np.float64 or len(df) == 0:
+            continue
+        values = df[col].to_numpy()
+        if all(
+            _is_float32_close(values[start:start + ROWS_PER_FLOAT_CHECK])
+            for start in range(0, len(values), ROWS_PER_FLOAT_CHECK)
+        ):
+            dict_dtypes[col] = np.dtype(np.float32)
+
+    return dict_dtypes
+
+
+def _is_float32_close(values: np.ndarray) -> bool:
+    with np.errstate(over="ignore"):
+        return bool(
+            np.isclose(
+                values.astype(np.float32), values,
+                rtol=0.0, atol=5e-4, equal_nan=True
+            ).all()
+        )
+
+
+def _to_categorical(s: pd.Series, max_category_ratio: float) -> pd.Series:
+    """s as 'category' if the ratio of distinct to non-null values is at
+    most max_category_ratio, else None. Factorizes only once, the codes
+    are re-used for the categorical.
+    """
+    try:
+        codes, uniques = pd.factorize(s, sort=True)
+    except TypeError:   # mixed types, not sortable
+        codes, uniques = pd.factorize(s)
+    n_items = np.count_nonzero(codes >= 0)
+    if n_items == 0 or len(uniques) > max_category_ratio * n_items:
+        return None
+
+    return pd.Series(
+        pd.Categorical.from_codes(codes, uniques),
+        index=s.index,
+        name=s.name,
+    )
@@ -0,0 +1,114 @@
+from typing import Iterator
+import logging
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from pyarrow import feather
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+# Data frames are shared with worker processes as uncompressed Arrow IPC
+# (feather v2) files, sorted by shard: a worker memory-maps the file and
+# converts only the rows of its shard (a zero-copy slice of the table)
+# instead of getting the full frame pickled. /dev/shm keeps the files in
+# memory where available.
+SHM_DIR = "/dev/shm"
+
+
+def shard_of(konto_lauf_ids, n_shards: int) -> np.ndarray:
+    """shard of every konto_lauf_id: a hash of the id modulo n_shards,
+    stable across processes and runs (unlike python's `hash`)
+
+    Parameters
+    ----------
+    konto_lauf_ids : array-like
+        account ids (any integer dtype)
+    n_shards : int
+        number of shards
+
+    Returns
+    -------
+    np.ndarray
+        shard number (0 ... n_shards - 1) per id
+    """
+    hashes = pd.util.hash_array(np.asarray(konto_lauf_ids, dtype="int64"))
+    return (hashes % np.uint64(n_shards)).astype("int64")
+
+
+def make_shared_dir() -> tempfile.TemporaryDirectory:
+    """temporary directory for shared files, in /dev/shm if it exists"""
+    shm_dir = SHM_DIR if os.path.isdir(SHM_DIR) else None
+    return tempfile.TemporaryDirectory(prefix="churn21_", dir=shm_dir)
+
+
+def write_sharded(df: pd.DataFrame, path: str, n_shards: int) -> np.ndarray:
+    """write df sorted by the shard of its konto_lauf_id (stable, the
+    order within a shard is kept) and return the row offsets of the
+    shards, see `read_shard`
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        data frame with column konto_lauf_id
+    path : str
+        path of the file to write
+    n_shards : int
+        number of shards
+
+    Returns
+    -------
+    np.ndarray
+        n_shards + 1 row offsets, shard i is rows offsets[i]:offsets[i+1]
+    """
+    shard = shard_of(df["konto_lauf_id"], n_shards)
+    order = np.argsort(shard, kind="stable")
+    offsets = np.searchsorted(shard[order], np.arange(n_shards + 1))
+    feather.write_feather(
+        df.iloc[order].reset_index(drop=True),
+        path,
+        compression="uncompressed",
+    )
+    return offsets
+
+
+def read_shard(path: str, offsets: np.ndarray, i_shard: int) -> pd.DataFrame:
+    """rows of one shard of a file written with `write_sharded`
+
+    Parameters
+    ----------
+    path : str
+        path of the file
+    offsets : np.ndarray
+        row offsets of the shards, see `write_sharded`
+    i_shard : int
+        shard to read
+
+    Returns
+    -------
+    pd.DataFrame
+        rows of the shard
+    """
+    table = feather.read_table(path, memory_map=True)
+    start, end = int(offsets[i_shard]), int(offsets[i_shard + 1])
+    return table.slice(start, end - start).to_pandas()
+
+
+def split_population(pop: pd.DataFrame, n_shards: int) -> Iterator[tuple]:
+    """non-empty shards of the population, as (shard number, rows of pop
+    in their original order)
+    """
+    shard = shard_of(pop["konto_lauf_id"], n_shards)
+    for i_shard in range(n_shards):
+        is_shard = shard == i_shard
+        if is_shard.any():
+            yield i_shard, pop.loc[is_shard]
@@ -0,0 +1,167 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+import logging
+import re
+
+import pandas as pd
+from bcag.sql_utils import execute_sql_query
+from sqlalchemy.engine.base import Engine
+
+from . import cache as utils_cache
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+# tables (re)built by a script, e.g. INTO jemas_temp.thm.churn21_label
+RE_INTO = re.compile(r"\binto\s+(jemas_\w+\.\w+\.\w+)", flags=re.IGNORECASE)
+
+
+def infer_dependencies(dict_queries: dict) -> dict:
+    """infer the dependency graph of sql scripts: a script depends on
+    every other script building (SELECT ... INTO) a table it references
+
+    Parameters
+    ----------
+    dict_queries : dict
+        script name -> sql text
+
+    Returns
+    -------
+    dict
+        script name -> set of names of the scripts it depends on
+    """
+    dict_builders = dict()
+    for name, query in dict_queries.items():
+        for table in RE_INTO.findall(query):
+            dict_builders[table.lower()] = name
+
+    dict_dependencies = dict()
+    for name, query in dict_queries.items():
+        tables = {t.lower() for t in utils_cache.RE_TABLE.findall(query)}
+        dict_dependencies[name] = {
+            dict_builders[t]
+            for t in tables if t in dict_builders and dict_builders[t] != name
+        }
+
+    return dict_dependencies
+
+
+def run_scripts(
+    dict_queries: dict,
+    engine: Engine,
+    n_workers: int = 4,
+    dict_dependencies: dict = None
+) -> pd.DataFrame:
+    """run sql scripts concurrently, at most n_workers at a time (each on
+    its own connection of the engine's pool). A script is started as
+    soon as all scripts it depends on have finished. If a script fails,
+    no further scripts are started and the error is raised once the
+    running ones have finished.
+
+    Parameters
+    ----------
+    dict_queries : dict
+        script name -> sql text
+    engine : Engine
+        jemas connection
+    n_workers : int
+        maximum number of scripts running at the same time (defaults to 4)
+    dict_dependencies : dict
+        script name -> names of the scripts it depends on (defaults to
+        None, inferring them with `infer_dependencies`)
+
+    Returns
+    -------
+    pd.DataFrame
+        start, end and wall time (seconds) per script
+
+    Raises
+    ------
+    ValueError
+        if the dependencies are cyclic or refer to unknown scripts
+    """
+    if dict_dependencies is None:
+        dict_dependencies = infer_dependencies(dict_queries)
+    _check_dependencies(dict_dependencies, dict_queries)
+
+    pending = dict(
+        {n: set(dict_dependencies.get(n, set())) for n in dict_queries}
+    )
+    dict_timing = dict()
+    error = None
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        running = dict()
+        while pending or running:
+            ready = [n for n, deps in pending.items() if len(deps) == 0]
+            if error is None:
+                for name in ready:
+                    del pending[name]
+                    logger.info(f"""executing .sql {name}""")
+                    future = executor.submit(
+                        _run_script, dict_queries[name], engine
+                    )
+                    running[future] = name
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    dict_timing[name] = future.result()
+                except Exception as e:
+                    logger.error(f"""executing .sql {name} failed: {e}""")
+                    error = error or e
+                    continue
+                logger.info(
+                    f"""executed .sql {name} in """
+                    f"""{dict_timing[name][2]:.0f} seconds"""
+                )
+                for deps in pending.values():
+                    deps.discard(name)
+
+    if error is not None:
+        raise error
+
+    return pd.DataFrame.from_dict(
+        dict_timing, orient="index", columns=["t_start", "t_end", "seconds"]
+    ).rename_axis("script").sort_values("t_start")
+
+
+def _run_script(query: str, engine: Engine) -> tuple:
+    t_start = datetime.now()
+    execute_sql_query(query, engine)
+    t_end = datetime.now()
+
+    return t_start, t_end, (t_end - t_start).total_seconds()
+
+
+def _check_dependencies(dict_dependencies: dict, dict_queries: dict) -> None:
+    """raise a ValueError if the dependency graph is not a DAG over the
+    given scripts
+    """
+    for name, deps in dict_dependencies.items():
+        unknown = set(deps) - set(dict_queries)
+        if unknown:
+            raise ValueError(f"{name} depends on unknown scripts {unknown}")
+
+    remaining = dict(
+        {n: set(dict_dependencies.get(n, set())) for n in dict_queries}
+    )
+    while remaining:
+        ready = [
+            n for n, deps in remaining.items() if not deps & remaining.keys()
+        ]
+        if not ready:
+            raise ValueError(
+                f"cyclic dependencies between {sorted(remaining)}"
+            )
+        for name in ready:
+            del remaining[name]
@@ -0,0 +1,335 @@
+from datetime import date
+from typing import Iterator, List
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from . import shards as utils_shards
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+# Stacked training sets are stored as parquet dataset partitioned by the
+# cut-off date (hive style, e.g. dt_cut_off=2020-12-31/part-0.parquet).
+# Parquet has no sparse type, sparse columns are written dense (zeros are
+# cheap after dictionary / run length encoding) and their names are kept
+# in the file metadata, to restore them on reading.
+PARTITION_COL = "dt_cut_off"
+META_KEY = b"churn21"
+SAMPLE_KEY = "konto_lauf_id"
+
+
+def compact_feature_matrix(
+    df: pd.DataFrame, max_density: float = 0.1, exclude: list = None
+) -> pd.DataFrame:
+    """Cast the float columns of df to float32 and store those with a
+    share of non-zero values of at most max_density as sparse columns
+    (fill value 0). The density of all columns is computed in one pass.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        feature matrix, e.g. the output of `load_fact_feature_set`
+    max_density : float
+        maximum share of non-zero values for a column to become sparse
+        (defaults to 0.1, None keeps all columns dense)
+    exclude : list
+        columns to keep as they are (defaults to None)
+
+    Returns
+    -------
+    pd.DataFrame
+        compacted feature matrix (same columns, same order)
+    """
+    exclude = set(exclude or [])
+    float_cols = [
+        col for col in df.select_dtypes("float").columns
+        if col not in exclude
+    ]
+    if len(float_cols) == 0:
+        return df
+
+    df = df.copy(deep=False)
+    values = df[float_cols].to_numpy(dtype=np.float32)
+    if max_density is None or len(df) == 0:
+        is_sparse = np.zeros(len(float_cols), dtype=bool)
+    else:
+        is_sparse = (values != 0).mean(axis=0) <= max_density
+
+    for i, col in enumerate(float_cols):
+        if is_sparse[i]:
+            df[col] = pd.arrays.SparseArray(values[:, i], fill_value=0.0)
+        else:
+            df[col] = values[:, i]
+
+    logger.info(
+        f"""compacted {len(float_cols)} float columns to float32, """
+        f"""{is_sparse.sum()} of them sparse"""
+    )
+    return df
+
+
+def write_training_set(
+    df: pd.DataFrame, root_dir: str, partition_col: str = PARTITION_COL
+) -> None:
+    """Write a (stacked) training set as parquet dataset partitioned by
+    partition_col, one file per partition. Existing partitions for the
+    same values are replaced, other partitions are kept. A partition only
+    becomes visible once it is completely written.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        training set, see `compact_feature_matrix`
+    root_dir : str
+        root directory of the dataset
+    partition_col : str
+        column to partition by (defaults to "dt_cut_off")
+    """
+    sparse_cols = [
+        col for col, dtype in df.dtypes.items()
+        if isinstance(dtype, pd.SparseDtype)
+    ]
+    dict_dense = dict({col: df[col].dtype.subtype for col in sparse_cols})
+
+    for value, df_part in df.groupby(partition_col, observed=True):
+        # densify partition by partition, never the full training set
+        df_part = df_part.drop(columns=partition_col).astype(dict_dense)
+        table = pa.Table.from_pandas(df_part, preserve_index=False)
+        table = table.replace_schema_metadata(
+            dict(
+                {
+                    **(table.schema.metadata or dict()),
+                    META_KEY: json.dumps({"sparse": sparse_cols}).encode(),
+                }
+            )
+        )
+
+        path = os.path.join(
+            root_dir, f"{partition_col}={_partition_value(value)}"
+        )
+        path_tmp = f"{path}.tmp"
+        shutil.rmtree(path_tmp, ignore_errors=True)
+        os.makedirs(path_tmp)
+        pq.write_table(table, os.path.join(path_tmp, "part-0.parquet"))
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(path_tmp, path)
+
+        logger.info(f"""wrote {len(df_part)} rows to {path}""")
+
+
+def list_columns(root_dir: str) -> List[str]:
+    """columns of a training set written with `write_training_set`, read
+    from the parquet footers only
+
+    Parameters
+    ----------
+    root_dir : str
+        root directory of the dataset
+
+    Returns
+    -------
+    List[str]
+        column names (without the partition column)
+    """
+    l_files = _list_files(root_dir)
+    if len(l_files) == 0:
+        return []
+    return list(pq.read_schema(l_files[0]).names)
+
+
+def list_partitions(
+    root_dir: str, partition_col: str = PARTITION_COL
+) -> List[date]:
+    """cut-off dates written to a training set, ascending"""
+    l_partitions = sorted(
+        {
+            os.path.basename(os.path.dirname(path)).split("=", 1)[1]
+            for path in _list_files(root_dir, partition_col)
+        }
+    )
+    return [pd.Timestamp(value).date() for value in l_partitions]
+
+
+def count_rows(root_dir: str, cut_off_dates: list = None) -> int:
+    """number of rows of a training set, from the parquet footers only"""
+    return sum(
+        pq.ParquetFile(path).metadata.num_rows
+        for path in _list_files(root_dir, cut_off_dates=cut_off_dates)
+    )
+
+
+def iter_training_set(
+    root_dir: str,
+    columns: list = None,
+    cut_off_dates: list = None,
+    batch_size: int = 100_000,
+    sample_frac: float = None,
+    sparse: bool = True,
+    partition_col: str = PARTITION_COL
+) -> Iterator[pd.DataFrame]:
+    """Iterate over a training set written with `write_training_set` in
+    batches of at most batch_size rows, partition by partition. Only the
+    requested columns are read (memory-mapped), the stacked set is never
+    materialised. With sample_frac, a fixed share of the accounts is
+    kept: the sample is drawn by a hash of konto_lauf_id, so the same
+    accounts are kept in every cut-off date and every run.
+
+    Parameters
+    ----------
+    root_dir : str
+        root directory of the dataset
+    columns : list
+        columns to read (defaults to None, all columns)
+    cut_off_dates : list
+        partitions to read (defaults to None, all partitions)
+    batch_size : int
+        maximum number of rows per batch (defaults to 100'000)
+    sample_frac : float
+        share of the accounts to keep (defaults to None, all rows)
+    sparse : bool
+        restore the sparse columns (defaults to True)
+    partition_col : str
+        column the dataset is partitioned by (defaults to "dt_cut_off")
+
+    Yields
+    ------
+    pd.DataFrame
+        batch of the training set, with partition_col as datetime column
+    """
+    for path in _list_files(root_dir, partition_col, cut_off_dates):
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        schema = parquet_file.schema_arrow
+        meta = json.loads((schema.metadata or dict()).get(META_KEY, b"{}"))
+        l_sparse = meta.get("sparse", []) if sparse else []
+        value = os.path.basename(os.path.dirname(path)).split("=", 1)[1]
+
+        l_cols = None
+        if columns is not None:
+            l_cols = [col for col in columns if col in schema.names]
+            if sample_frac is not None and SAMPLE_KEY not in l_cols:
+                l_cols.append(SAMPLE_KEY)
+
+        for batch in parquet_file.iter_batches(batch_size, columns=l_cols):
+            # the arrow buffers are released column by column
+            df = pa.Table.from_batches([batch]).to_pandas(
+                split_blocks=True, self_destruct=True
+            )
+            del batch
+            if sample_frac is not None:
+                df = df.loc[_is_sampled(df[SAMPLE_KEY], sample_frac)]
+                df = df.reset_index(drop=True)
+            for col in set(l_sparse) & set(df.columns):
+                df[col] = pd.arrays.SparseArray(
+                    df[col].to_numpy(), fill_value=0.0
+                )
+            df[partition_col] = pd.Timestamp(value)
+            if columns is not None:
+                df = df[[col for col in columns if col in df.columns]]
+            yield df
+
+
+def read_training_set(
+    root_dir: str,
+    columns: list = None,
+    cut_off_dates: list = None,
+    sample_frac: float = None,
+    sparse: bool = True,
+    partition_col: str = PARTITION_COL
+) -> pd.DataFrame:
+    """Read a training set written with `write_training_set` into memory,
+    see `iter_training_set`. Only the requested columns, partitions and
+    sampled accounts are materialised.
+
+    Parameters
+    ----------
+    root_dir : str
+        root directory of the dataset
+    columns : list
+        columns to read (defaults to None, all columns)
+    cut_off_dates : list
+        partitions to read (defaults to None, all partitions)
+    sample_frac : float
+        share of the accounts to keep (defaults to None, all rows)
+    sparse : bool
+        restore the sparse columns (defaults to True)
+    partition_col : str
+        column the dataset is partitioned by (defaults to "dt_cut_off")
+
+    Returns
+    -------
+    pd.DataFrame
+        training set, with partition_col as datetime column
+    """
+    l_df = list(
+        iter_training_set(
+            root_dir,
+            columns,
+            cut_off_dates,
+            batch_size=1_000_000,
+            sample_frac=sample_frac,
+            sparse=sparse,
+            partition_col=partition_col,
+        )
+    )
+    if len(l_df) == 0:
+        return pd.DataFrame(columns=columns)
+
+    return pd.concat(l_df, ignore_index=True)
+
+
+# HELPER FUNCTION(S)
+
+
+def _is_sampled(konto_lauf_ids: pd.Series, sample_frac: float) -> np.ndarray:
+    """deterministic sample of the accounts, see `iter_training_set`"""
+    n_buckets = 10_000
+    return utils_shards.shard_of(konto_lauf_ids, n_buckets) < (
+        sample_frac * n_buckets
+    )
+
+
+def _partition_value(value) -> str:
+    """directory name part of a partition value, dates as YYYY-MM-DD"""
+    if isinstance(value, (date, pd.Timestamp, np.datetime64)):
+        return f"{pd.Timestamp(value):%Y-%m-%d}"
+    return str(value)
+
+
+def _list_files(
+    root_dir: str,
+    partition_col: str = PARTITION_COL,
+    cut_off_dates: list = None
+) -> List[str]:
+    """parquet files of the (selected) partitions, sorted by partition"""
+    if not os.path.isdir(root_dir):
+        return []
+
+    prefix = f"{partition_col}="
+    l_partitions = sorted(
+        d for d in os.listdir(root_dir)
+        if d.startswith(prefix) and not d.endswith(".tmp")
+    )
+    if cut_off_dates is not None:
+        selected = {prefix + _partition_value(d) for d in cut_off_dates}
+        l_partitions = [d for d in l_partitions if d in selected]
+
+    return [
+        os.path.join(root_dir, d, f)
+        for d in l_partitions
+        for f in sorted(os.listdir(os.path.join(root_dir, d)))
+        if f.endswith(".parquet")
+    ]
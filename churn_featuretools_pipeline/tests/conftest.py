@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "benchmarks"))
+
+import synthetic  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def tables() -> dict:
+    """small synthetic versions of the jemas tables"""
+    return synthetic.generate_tables(300, n_months=24, seed=1)
+
+
+@pytest.fixture(scope="session")
+def engine(tables, tmp_path_factory):
+    """sqlite engine standing in for jemas, on the synthetic tables"""
+    path = tmp_path_factory.mktemp("jemas") / "jemas.sqlite"
+    return synthetic.create_sqlite_engine(str(path), tables)
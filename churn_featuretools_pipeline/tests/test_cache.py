@@ -0,0 +1,100 @@
+import os
+
+import pandas as pd
+
+from churn21.data import cache as utils_cache
+from churn21.data import load as utils_ld
+
+QUERY_SALES = "select * from jemas_base.dbo.Sales_Fact"
+QUERY_POP = """
+    select konto_lauf_id, konto_id, jamo
+    from jemas_temp.thm.churn21_population
+"""
+
+
+def test_miss_then_hit(engine, tmp_path):
+    cache_dir = str(tmp_path)
+    key = utils_cache.make_cache_key(
+        QUERY_POP, None, utils_ld.SCHEMA_POPULATION
+    )
+    assert not utils_cache.has_entry(cache_dir, key)
+
+    df_miss = utils_ld._read_sql_downcast(
+        QUERY_POP, engine, utils_ld.SCHEMA_POPULATION, cache_dir=cache_dir
+    )
+    assert utils_cache.has_entry(cache_dir, key)
+
+    # a hit never touches the database
+    df_hit = utils_ld._read_sql_downcast(
+        QUERY_POP, None, utils_ld.SCHEMA_POPULATION, cache_dir=cache_dir
+    )
+    pd.testing.assert_frame_equal(df_hit, df_miss)
+    assert len(df_hit) == len(pd.read_sql(QUERY_POP, engine))
+
+
+def test_empty_extract_keeps_columns(engine, tmp_path):
+    query = f"{QUERY_SALES} where 1 = 0"
+    for _ in range(2):
+        df = utils_ld._read_sql_downcast(
+            query, engine, cache_dir=str(tmp_path)
+        )
+        assert len(df) == 0
+        assert "kauf_datum" in df.columns and "betrag" in df.columns
+
+
+def test_key_changes_with_params_and_schema():
+    key = utils_cache.make_cache_key(QUERY_POP, {"dt_cut_off": "2020-12-31"})
+    assert key == utils_cache.make_cache_key(
+        " ".join(QUERY_POP.split()), {"dt_cut_off": "2020-12-31"}
+    )
+    assert key != utils_cache.make_cache_key(
+        QUERY_POP, {"dt_cut_off": "2021-01-31"}
+    )
+    assert key != utils_cache.make_cache_key(
+        QUERY_POP, {"dt_cut_off": "2020-12-31"}, {"jamo": "integer"}
+    )
+    assert key != utils_cache.make_cache_key(
+        QUERY_POP.replace("jamo", "jamo, konto_lauf_id"),
+        {"dt_cut_off": "2020-12-31"}
+    )
+
+
+def test_invalidate_by_pattern(engine, tmp_path):
+    cache_dir = str(tmp_path)
+    utils_ld._read_sql_downcast(QUERY_POP, engine, cache_dir=cache_dir)
+    utils_ld._read_sql_downcast(QUERY_SALES, engine, cache_dir=cache_dir)
+    key_pop = utils_cache.make_cache_key(QUERY_POP)
+    key_sales = utils_cache.make_cache_key(QUERY_SALES)
+    # directory of an extract being written by another process
+    path_tmp = os.path.join(cache_dir, f"{key_pop}.1.abc.tmp")
+    os.makedirs(path_tmp)
+
+    n = utils_cache.invalidate_cache(cache_dir, ["jemas_temp.thm.churn21_*"])
+    assert n == 1
+    assert not utils_cache.has_entry(cache_dir, key_pop)
+    assert utils_cache.has_entry(cache_dir, key_sales)
+    assert os.path.isdir(path_tmp)
+
+    assert utils_cache.invalidate_cache(cache_dir) == 1
+    assert not utils_cache.has_entry(cache_dir, key_sales)
+    assert os.path.isdir(path_tmp)
+
+
+def test_concurrent_writers_do_not_interfere(tmp_path):
+    cache_dir = str(tmp_path)
+    key = utils_cache.make_cache_key(QUERY_POP)
+    df = pd.DataFrame({"konto_lauf_id": [1, 2], "jamo": [202001, 202002]})
+
+    def chunks_with_second_writer():
+        # a second writer completes the same key while the first one writes
+        utils_cache.write_entry(cache_dir, key, [df], QUERY_POP)
+        yield df
+
+    utils_cache.write_entry(
+        cache_dir, key, chunks_with_second_writer(), QUERY_POP
+    )
+    assert utils_cache.has_entry(cache_dir, key)
+    pd.testing.assert_frame_equal(
+        utils_cache.read_entry(cache_dir, key)[0], df
+    )
+    assert os.listdir(cache_dir) == [key]
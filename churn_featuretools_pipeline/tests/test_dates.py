@@ -0,0 +1,53 @@
+from datetime import date, timedelta
+
+import pandas as pd
+
+from churn21.data import dates as utils_dt
+from churn21.data import fact_features as utils_ff
+
+
+def test_month_end_windows_are_calendar_months():
+    df_dates = utils_dt.cut_off_table(
+        date(2019, 1, 1), date(2021, 12, 31), 13, 3, "M"
+    )
+    for dict_dates in utils_dt.to_list_of_dicts(df_dates):
+        dt_cut_off = dict_dates["dt_cut_off"]
+        dt_first = dict_dates["dt_obs_first_considered"]
+        dt_label_last = dict_dates["dt_label_last_considered"]
+        assert dt_first.day == 1
+        assert (dt_label_last + timedelta(days=1)).day == 1
+        months_obs = pd.period_range(dt_first, dt_cut_off, freq="M")
+        months_label = pd.period_range(
+            dt_cut_off + timedelta(days=1), dt_label_last, freq="M"
+        )
+        assert (len(months_obs), len(months_label)) == (13, 3)
+
+
+def test_weekly_and_daily_windows_are_day_exact():
+    for freq in ["W", "D"]:
+        df_dates = utils_dt.cut_off_table(
+            date(2020, 1, 1), date(2020, 3, 31), 13, 3, freq
+        )
+        for dict_dates in utils_dt.to_list_of_dicts(df_dates):
+            dt_cut_off = dict_dates["dt_cut_off"]
+            dt_label_first = pd.Timestamp(dt_cut_off + timedelta(days=1))
+            assert dict_dates["dt_obs_first_considered"] == (
+                dt_label_first - pd.DateOffset(months=13)
+            ).date()
+            assert dict_dates["dt_label_last_considered"] == (
+                dt_label_first + pd.DateOffset(months=3)
+                - pd.Timedelta(days=1)
+            ).date()
+
+            # feature periods: the first month and 12 months, contiguous
+            d_bounds = utils_ff.get_window_bounds(
+                dt_cut_off, dict_dates["dt_obs_first_considered"]
+            )
+            start_12m, end_12m = d_bounds["12m"]
+            assert d_bounds["first"][0] == (
+                dict_dates["dt_obs_first_considered"]
+            )
+            assert d_bounds["first"][1] + timedelta(days=1) == start_12m
+            assert end_12m == d_bounds["last"][1] == dt_cut_off
+            assert (end_12m - start_12m).days in [364, 365]
+            assert 27 <= (end_12m - d_bounds["last"][0]).days <= 30
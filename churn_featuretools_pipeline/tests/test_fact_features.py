@@ -0,0 +1,115 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# parity with the featuretools engine needs the real package
+pytest.importorskip("featuretools", minversion="0.13")
+
+from churn21.data import dates as utils_dt  # noqa: E402
+from churn21.data import fact_features as utils_ff  # noqa: E402
+from churn21.data import load as utils_ld  # noqa: E402
+
+CUT_OFF_DATE = date(2020, 6, 30)
+
+
+def assert_same_features(fm_ft: pd.DataFrame, fm_native: pd.DataFrame):
+    """same columns and values (categoricals compared as objects)"""
+    assert sorted(fm_ft.columns) == sorted(fm_native.columns)
+    fm_native = fm_native.reindex(index=fm_ft.index, columns=fm_ft.columns)
+    for col in fm_ft.columns:
+        if fm_ft[col].dtype.kind in "biuf":
+            np.testing.assert_allclose(
+                fm_ft[col].to_numpy(dtype=float),
+                fm_native[col].to_numpy(dtype=float),
+                rtol=1e-5, atol=1e-6, err_msg=col
+            )
+        else:
+            pd.testing.assert_series_equal(
+                fm_ft[col].astype(object), fm_native[col].astype(object),
+                check_names=False, obj=col
+            )
+
+
+@pytest.fixture(scope="module")
+def facts(engine) -> dict:
+    dict_dates = utils_dt.handle_dates(CUT_OFF_DATE, 13, 3)
+    first_date = dict_dates["dt_obs_first_considered"]
+    pop = utils_ld.filter_population(
+        utils_ld.load_population(engine), CUT_OFF_DATE
+    )
+    dict_facts = dict({"pop": pop, "first_date": first_date})
+    for name, loader in [
+        ("sales", utils_ff.load_sales_fact), ("fees", utils_ff.load_fees_fact)
+    ]:
+        fact = utils_ff.slice_fact_df_to_window(
+            loader(CUT_OFF_DATE, first_date, engine), CUT_OFF_DATE, first_date
+        )
+        dict_facts[name] = utils_ff.fit_fact_df_to_population(fact, pop)
+
+    return dict_facts
+
+
+def test_window_feature_matrices_match_featuretools(facts):
+    args = (
+        facts["pop"], facts["sales"], facts["fees"], CUT_OFF_DATE,
+        facts["first_date"], 1
+    )
+    l_fm_ft = utils_ff.create_window_feature_matrices(
+        *args, use_featuretools=True
+    )
+    l_fm_native = utils_ff.create_window_feature_matrices(
+        *args, use_featuretools=False
+    )
+    for fm_ft, fm_native in zip(l_fm_ft, l_fm_native):
+        assert_same_features(fm_ft, fm_native)
+
+    # WHERE variants, skew and trend are covered by the synthetic facts
+    fm_12m = l_fm_native[2]
+    for col in [
+        "SUM(sales_fact.betrag WHERE transaktionsart_id_korr = 0)",
+        "COUNT(fees_fact WHERE bewegungstyp = mahnung)",
+        "SKEW(sales_fact.betrag)",
+        "TREND(sales_fact.betrag, kauf_datum)",
+    ]:
+        assert fm_12m[col].notna().sum() > 0, col
+
+
+def test_mode_ties_match_featuretools():
+    pop = pd.DataFrame({"konto_lauf_id": [1, 2, 3]})
+    kauf_datum = pd.to_datetime(
+        ["2020-03-02", "2020-03-05", "2020-04-07", "2020-05-11"]
+    )
+    sales = pd.DataFrame(
+        {
+            "konto_lauf_id": [1, 1, 2, 2],
+            "betrag": np.array([10.0, 20.0, 5.0, 7.5], dtype="float32"),
+            "kauf_datum": kauf_datum,
+            "transaction_type_id": np.array([3, 1, 2, 2], dtype="int8"),
+            "mcg_id": np.array([7, 4, 4, 7], dtype="int8"),
+            "transaktionsart_id_korr": np.array([0, 1, 0, 0], dtype="int8"),
+            "rwn": np.arange(4),
+        }
+    )
+    # ties in order of appearance other than the category order
+    fees = pd.DataFrame(
+        {
+            "konto_lauf_id": [1, 1, 1, 2],
+            "betrag": np.array([1.0, 2.0, 3.0, 4.0], dtype="float32"),
+            "kauf_datum": kauf_datum,
+            "bewegungstyp": pd.Categorical(
+                ["zins", "mahnung", "divers", "fremdw"]
+            ),
+            "rwn": np.arange(4),
+        }
+    )
+    fm_ft = utils_ff.create_feature_matrix(
+        pop, sales, fees, CUT_OFF_DATE, True, 1, use_featuretools=True
+    )
+    fm_native = utils_ff.create_feature_matrix(
+        pop, sales, fees, CUT_OFF_DATE, True, 1, use_featuretools=False
+    )
+    assert_same_features(fm_ft, fm_native)
+    assert fm_native.loc[1, "MODE(fees_fact.bewegungstyp)"] == "divers"
+    assert fm_native.loc[1, "MODE(sales_fact.transaction_type_id)"] == 1
@@ -0,0 +1,216 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from churn21.data import fact_aggregations as utils_agg
+from churn21.data import fact_features as utils_ff
+from churn21.data import fact_state as utils_state
+from churn21.data import load as utils_ld
+
+FIRST_DATE = date(2019, 6, 1)
+L_CUT_OFF_DATES = [date(2020, 5, 31), date(2020, 6, 30)]
+
+
+def assert_same_features(fm_native: pd.DataFrame, fm_state: pd.DataFrame):
+    """same columns and values (categoricals compared as objects)"""
+    assert list(fm_native.columns) == list(fm_state.columns)
+    fm_state = fm_state.reindex(fm_native.index)
+    for col in fm_native.columns:
+        if fm_native[col].dtype.kind in "biuf":
+            np.testing.assert_allclose(
+                fm_native[col].to_numpy(dtype=float),
+                fm_state[col].to_numpy(dtype=float),
+                rtol=1e-6, atol=1e-6, err_msg=col
+            )
+        else:
+            pd.testing.assert_series_equal(
+                fm_native[col].astype(object), fm_state[col].astype(object),
+                check_names=False, obj=col
+            )
+
+
+def window_features_from_state(
+    pop: pd.DataFrame, d_state: dict, cut_off_date: date
+) -> list:
+    """fm_first, fm_last, fm_12m as in `load_fact_feature_matrices`"""
+    d_months = utils_state.get_window_months(cut_off_date, FIRST_DATE)
+    return [
+        utils_state.calculate_feature_matrix_from_state(
+            pop, d_state, cut_off_date, d_months[window], **features
+        )
+        for window, features in [
+            ("first", utils_ff.FEATURES_REDUCED),
+            ("last", utils_ff.FEATURES_REDUCED),
+            ("12m", utils_ff.FEATURES_FULL),
+        ]
+    ]
+
+
+def read_all_states(state_dir: str) -> dict:
+    """published moments per child entity, in a comparable order"""
+    d_moments = dict()
+    for child_id in utils_agg.CHILD_ENTITIES:
+        moments = utils_state.read_state(state_dir, child_id)["moments"]
+        d_moments[child_id] = moments.sort_values(
+            utils_state.KEYS + [utils_state.SEGMENT]
+        ).reset_index(drop=True)
+    return d_moments
+
+
+@pytest.fixture(scope="module")
+def state_dir(engine, tmp_path_factory) -> str:
+    """state refreshed month by month without interruption"""
+    path = str(tmp_path_factory.mktemp("state"))
+    for cut_off_date in L_CUT_OFF_DATES:
+        utils_state.refresh_fact_state(path, cut_off_date, FIRST_DATE, engine)
+    return path
+
+
+def test_interrupted_refresh_is_repeated(
+    engine, state_dir, tmp_path, monkeypatch
+):
+    path = str(tmp_path)
+    utils_state.refresh_fact_state(
+        path, L_CUT_OFF_DATES[0], FIRST_DATE, engine
+    )
+    state_before = read_all_states(path)
+
+    # crash after the first child entity is written
+    write_state = utils_state.write_state
+
+    def write_state_crashing(state_dir, child_id, state, version):
+        if child_id == "fees_fact":
+            raise RuntimeError("crash")
+        write_state(state_dir, child_id, state, version)
+
+    monkeypatch.setattr(utils_state, "write_state", write_state_crashing)
+    with pytest.raises(RuntimeError):
+        utils_state.refresh_fact_state(
+            path, L_CUT_OFF_DATES[1], FIRST_DATE, engine
+        )
+    for child_id, moments in read_all_states(path).items():
+        pd.testing.assert_frame_equal(moments, state_before[child_id])
+
+    monkeypatch.setattr(utils_state, "write_state", write_state)
+    utils_state.refresh_fact_state(
+        path, L_CUT_OFF_DATES[1], FIRST_DATE, engine
+    )
+    d_expected = read_all_states(state_dir)
+    for child_id, moments in read_all_states(path).items():
+        pd.testing.assert_frame_equal(moments, d_expected[child_id])
+
+
+def test_refreshed_state_matches_backfill(engine, state_dir, tmp_path):
+    """accounts entering the population keep their earlier facts"""
+    path = str(tmp_path)
+    utils_state.refresh_fact_state(
+        path, L_CUT_OFF_DATES[1], FIRST_DATE, engine
+    )
+    d_expected = read_all_states(path)
+    for child_id, moments in read_all_states(state_dir).items():
+        pd.testing.assert_frame_equal(moments, d_expected[child_id])
+
+
+def test_state_matches_native_engine(engine):
+    cut_off_date = L_CUT_OFF_DATES[1]
+    pop = utils_ld.filter_population(
+        utils_ld.load_population(engine), cut_off_date
+    )
+    d_facts = dict()
+    d_state = dict()
+    for child_id, loader in [
+        ("sales_fact", utils_ff.load_sales_fact),
+        ("fees_fact", utils_ff.load_fees_fact),
+    ]:
+        fact = utils_ff.slice_fact_df_to_window(
+            loader(cut_off_date, FIRST_DATE, engine), cut_off_date, FIRST_DATE
+        )
+        d_facts[child_id] = utils_ff.fit_fact_df_to_population(fact, pop)
+        # merged from two parts, as after a refresh
+        is_old = d_facts[child_id]["rwn"] % 2 == 0
+        d_state[child_id] = utils_state.merge_states(
+            [
+                utils_state.build_state(d_facts[child_id].loc[mask], child_id)
+                for mask in [is_old, ~is_old]
+            ]
+        )
+
+    l_fm_native = utils_ff.create_window_feature_matrices(
+        pop, d_facts["sales_fact"], d_facts["fees_fact"], cut_off_date,
+        FIRST_DATE, 1
+    )
+    l_fm_state = window_features_from_state(pop, d_state, cut_off_date)
+    for fm_native, fm_state in zip(l_fm_native, l_fm_state):
+        assert_same_features(fm_native, fm_state)
+
+    # features of the month transform (dropped in the FEATURES_* configs)
+    d_features = dict(utils_ff.FEATURES_FULL, drop_exact=[])
+    start, end = utils_ff.get_window_bounds(cut_off_date, FIRST_DATE)["12m"]
+    l_facts = [
+        fact.loc[fact["kauf_datum"].between(
+            pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(days=1),
+            inclusive="left"
+        )]
+        for fact in [d_facts["sales_fact"], d_facts["fees_fact"]]
+    ]
+    fm_native = utils_agg.calculate_feature_matrix(
+        pop, *l_facts, cut_off_date, **d_features
+    )
+    fm_state = utils_state.calculate_feature_matrix_from_state(
+        pop, d_state, cut_off_date,
+        utils_state.get_window_months(cut_off_date, FIRST_DATE)["12m"],
+        **d_features
+    )
+    assert "MODE(sales_fact.MONTH(kauf_datum))" in fm_native.columns
+    assert_same_features(fm_native, fm_state)
+
+
+def test_moments_keep_precision():
+    """std, skew and trend of large amounts with small variation"""
+    cut_off_date = L_CUT_OFF_DATES[1]
+    rng = np.random.default_rng(1)
+    n = 40
+    pop = pd.DataFrame({"konto_lauf_id": [1, 2]})
+    kauf_datum = pd.Timestamp("2019-07-01") + pd.to_timedelta(
+        np.sort(rng.integers(0, 360, n)), unit="D"
+    )
+    sales = pd.DataFrame(
+        {
+            "konto_lauf_id": np.repeat([1, 2], n // 2),
+            "betrag": 1e8 + rng.exponential(1.0, n),
+            "kauf_datum": kauf_datum,
+            "transaction_type_id": np.ones(n, dtype="int8"),
+            "mcg_id": np.ones(n, dtype="int8"),
+            "transaktionsart_id_korr": np.zeros(n, dtype="int8"),
+            "rwn": np.arange(n),
+        }
+    )
+    fees = sales[["konto_lauf_id", "betrag", "kauf_datum", "rwn"]].assign(
+        bewegungstyp=pd.Categorical(["zins"] * n)
+    )
+    d_facts = dict({"sales_fact": sales, "fees_fact": fees})
+    d_state = dict(
+        {
+            child_id: utils_state.merge_states(
+                [
+                    utils_state.build_state(part, child_id)
+                    for part in [fact.iloc[i::3] for i in range(3)]
+                ]
+            )
+            for child_id, fact in d_facts.items()
+        }
+    )
+
+    fm_native = utils_ff.create_window_feature_matrices(
+        pop, sales, fees, cut_off_date, FIRST_DATE, 1
+    )[2]
+    fm_state = window_features_from_state(pop, d_state, cut_off_date)[2]
+    for col in [
+        "STD(sales_fact.betrag)",
+        "SKEW(sales_fact.betrag)",
+        "TREND(sales_fact.betrag, kauf_datum)",
+    ]:
+        assert fm_native[col].notna().all(), col
+    assert_same_features(fm_native, fm_state)
@@ -0,0 +1,86 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from churn21.data import feature_store as utils_fs
+
+BLOCKS = ["pop", "ft"]
+DT_OLD, DT_NEW = date(2020, 5, 31), date(2020, 6, 30)
+
+
+def test_features_of_partitions_with_different_schemas(tmp_path):
+    store_dir = str(tmp_path)
+    # old: "saldo" only in ft; new: "saldo" in pop as well (so suffixed
+    # in ft), "n_trx" dropped and "segment" added
+    utils_fs.write_partition(
+        store_dir,
+        DT_OLD,
+        dict(
+            {
+                "pop": pd.DataFrame(
+                    {"konto_lauf_id": [1, 2], "alter": [30, 40]}
+                ),
+                "ft": pd.DataFrame(
+                    {
+                        "konto_lauf_id": [1, 2],
+                        "saldo": [1.0, 2.0],
+                        "n_trx": [5, 6],
+                    }
+                ),
+            }
+        ),
+    )
+    utils_fs.write_partition(
+        store_dir,
+        DT_NEW,
+        dict(
+            {
+                "pop": pd.DataFrame(
+                    {
+                        "konto_lauf_id": [1, 3],
+                        "alter": [31, 50],
+                        "saldo": [10.0, 30.0],
+                    }
+                ),
+                "ft": pd.DataFrame(
+                    {
+                        "konto_lauf_id": [1, 3],
+                        "saldo": [11.0, 33.0],
+                        "segment": pd.Categorical(["a", "b"]),
+                    }
+                ),
+            }
+        ),
+    )
+
+    df = utils_fs.get_features(
+        store_dir, [1, 2, 3], [DT_NEW, DT_OLD, DT_NEW], blocks=BLOCKS
+    )
+    assert list(df.columns) == [
+        "konto_lauf_id", "dt_cut_off", "dt_cut_off_store",
+        "alter", "saldo", "saldo_ft", "segment", "n_trx",
+    ]
+    expected = pd.DataFrame(
+        {
+            "alter": [31, 40, 50],
+            "saldo": [10.0, np.nan, 30.0],
+            "saldo_ft": [11.0, 2.0, 33.0],
+            "segment": ["a", np.nan, "b"],
+            "n_trx": [np.nan, 6, np.nan],
+        }
+    )
+    for col in expected.columns:
+        pd.testing.assert_series_equal(
+            df[col].astype(expected[col].dtype), expected[col],
+            check_names=False, obj=col
+        )
+
+    # requested columns missing in a partition are left empty
+    df = utils_fs.get_features(
+        store_dir, [1, 2], [DT_NEW, DT_OLD], blocks=BLOCKS,
+        columns=["saldo", "n_trx"]
+    )
+    assert list(df.columns[3:]) == ["saldo", "n_trx"]
+    assert df["saldo"].isna().tolist() == [False, True]
+    assert df["n_trx"].isna().tolist() == [True, False]
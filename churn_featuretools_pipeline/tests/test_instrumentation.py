@@ -0,0 +1,37 @@
+import time
+
+import numpy as np
+import pytest
+
+from churn21.data import instrumentation as utils_instr
+
+MB = 2**20
+
+
+@pytest.fixture(autouse=True)
+def records():
+    utils_instr.reset()
+    yield
+    utils_instr.reset()
+
+
+def test_peak_and_delta_per_stage():
+    if utils_instr._rss() is None:
+        pytest.skip("RSS not available on this platform")
+
+    with utils_instr.stage("outer") as record_outer:
+        with utils_instr.stage("allocate") as record_allocate:
+            arr = np.ones(256 * MB // 8)
+            time.sleep(3 * utils_instr.SAMPLE_INTERVAL_S)
+            del arr
+        with utils_instr.stage("idle") as record_idle:
+            time.sleep(3 * utils_instr.SAMPLE_INTERVAL_S)
+
+    assert record_allocate["delta_rss_mb"] > 200
+    assert record_outer["delta_rss_mb"] > 200
+    # the peak of the process before the stage does not count
+    assert record_idle["delta_rss_mb"] < 50
+    assert record_idle["peak_rss_mb"] < record_allocate["peak_rss_mb"] - 200
+
+    df_summary = utils_instr.summarize()
+    assert df_summary.loc["allocate", "delta_rss_mb"] > 200
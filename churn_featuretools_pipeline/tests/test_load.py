@@ -0,0 +1,46 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from churn21.data import load as utils_ld
+
+L_CUT_OFF_DATES = [date(2019, 12, 31), date(2020, 6, 30)]
+
+
+def test_most_recent_information_of_unsorted_table(engine):
+    df = utils_ld.load_jamo_based_info(engine, "churn21_general_information")
+    df_shuffled = df.sample(frac=1, random_state=1)
+    assert not df_shuffled["letzter_tag"].is_monotonic_increasing
+
+    l_expected = list(utils_ld.iter_most_recent_information(
+        df, L_CUT_OFF_DATES
+    ))
+    l_shuffled = list(utils_ld.iter_most_recent_information(
+        df_shuffled, L_CUT_OFF_DATES
+    ))
+    for cut_off_date, expected, shuffled in zip(
+        L_CUT_OFF_DATES, l_expected, l_shuffled
+    ):
+        pd.testing.assert_frame_equal(shuffled, expected)
+        pd.testing.assert_frame_equal(
+            utils_ld._most_recent_information(df_shuffled, cut_off_date),
+            expected
+        )
+
+
+def test_float32_dtypes_checked_in_chunks(monkeypatch):
+    monkeypatch.setattr(utils_ld, "ROWS_PER_FLOAT_CHECK", 7)
+    values = np.arange(50) * 0.5
+    df = pd.DataFrame(
+        {
+            "exact": values,
+            "with_nan": np.r_[np.nan, values[1:]],
+            # not representable in float32, in the last chunk only
+            "large": np.r_[values[:-1], 1e10 + 0.1],
+            "integer": np.arange(50),
+        }
+    )
+    assert utils_ld._float32_dtypes(df, list(df.columns)) == dict(
+        {"exact": np.float32, "with_nan": np.float32}
+    )
@@ -5,8 +5,9 @@ import pandas as pd
 from nltk.stem import WordNetLemmatizer
 from nltk.tokenize import word_tokenize
 
-from train_classifier import tokenize_text
-from train_classifier import MessageSelector, CategoricalsSelector
+from train_classifier import tokenize_text, analyze_tokens
+from train_classifier import MessageSelector, CategoricalsSelector, \
+    MessageTokenizer, LinearMultiLabelClassifier
 
 from flask import Flask
 from flask import render_template, request, jsonify
@@ -20,7 +21,8 @@ app = Flask(__name__)
 engine = create_engine('sqlite:///DisasterResponse.db')
 df = pd.read_sql_table('messages', engine)
 
-# load model
+# load model (pipeline or consolidated LinearMultiLabelClassifier, which
+# computes all labels of a query with one matrix product)
 model = joblib.load("models/app_classifier.pkl")
 
 
@@ -93,9 +95,12 @@ def index():
 def go():
     # save user input in query
     query = request.args.get('query', '') 
+    genre = request.args.get('genre', 'direct')
 
-    # use model to predict classification for query
-    classification_labels = model.predict([query])[0]
+    # use model to predict classification for query, the models read the 
+    # message and genre columns of a df like the training data
+    X_query = pd.DataFrame({'message': [query], 'genre': [genre]})
+    classification_labels = model.predict(X_query)[0]
     classification_results = dict(zip(df.columns[4:], classification_labels))
 
     # This will render the go.html  
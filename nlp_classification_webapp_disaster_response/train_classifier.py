@@ -1,32 +1,39 @@
 import sys
+import os
+import copy
+import zlib
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from sqlalchemy import create_engine
 
 from sklearn.model_selection import StratifiedShuffleSplit, GridSearchCV, \
-    train_test_split, StratifiedKFold, cross_validate
-from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+    train_test_split, StratifiedKFold, cross_validate, ParameterGrid, \
+    check_cv
+from sklearn.feature_extraction.text import CountVectorizer, \
+    TfidfTransformer, HashingVectorizer
 from sklearn.pipeline import Pipeline, FeatureUnion
 from sklearn.metrics import make_scorer, classification_report, f1_score
 from sklearn.externals import joblib
-from sklearn.base import BaseEstimator, TransformerMixin
-from sklearn.preprocessing import OneHotEncoder
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.preprocessing import OneHotEncoder, normalize
 
 from sklearn.multioutput import MultiOutputClassifier
 from sklearn.linear_model import SGDClassifier
 
 import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import nltk
 nltk.download(['punkt', 'wordnet', 'stopwords', 'averaged_perceptron_tagger', \
     'maxent_ne_chunker', 'words'])
 from nltk.corpus import stopwords
-from nltk import pos_tag, ne_chunk
+from nltk import pos_tag, pos_tag_sents, ne_chunk
 from nltk.tokenize import word_tokenize
 from nltk.stem.wordnet import WordNetLemmatizer
 
 # pipeline caching
-from tempfile import mkdtemp
-from shutil import rmtree
+from tempfile import TemporaryDirectory
 from sklearn.utils import Memory
 
 # define two custom transformers for the pipeline
@@ -84,9 +91,9 @@ def load_split_data(database_filepath):
         set_.drop('total', axis=1, inplace=True)
     
     # split into features and labels
-    X_train = train[['message', 'genre']]
+    X_train = train[['id', 'message', 'genre']]
     Y_train = train.iloc[:, 4:39].values
-    X_test = test[['message', 'genre']]
+    X_test = test[['id', 'message', 'genre']]
     Y_test = test.iloc[:, 4:39].values  
     
     # create list of strings with target label names
@@ -95,6 +102,97 @@ def load_split_data(database_filepath):
     return X_train, Y_train, X_test, Y_test, label_names
 
 
+class Tokenizer(object):
+    """Text tokenizer: normalizes, tokenizes and lemmatizes messages, 
+    removes stop words and adds part-of-speech tags. The NLTK resources 
+    are loaded once per instance (and process), stop words are looked up 
+    in a frozenset and lemmas are kept in a LRU cache. Pickles without 
+    its resources, they are reloaded on unpickling.
+    
+    ARGUMENTS:
+        lemma_cache_size: int, max number of cached lemmas, default 2**16
+    """
+
+    # bump whenever the output changes, invalidates the token cache
+    version = 1
+
+    def __init__(self, lemma_cache_size=2**16):
+        self.lemma_cache_size = lemma_cache_size
+        self._load_resources()
+
+    def _load_resources(self):
+        self._stop_words = frozenset(stopwords.words('english'))
+        self._lemmatize = lru_cache(maxsize=self.lemma_cache_size)(
+            WordNetLemmatizer().lemmatize)
+
+    def __getstate__(self):
+        return {'lemma_cache_size': self.lemma_cache_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._load_resources()
+
+    def lemmatize_text(self, text):
+        """Process text data without part-of-speech tagging.
+        
+        ARGUMENTS:
+            text: str to be processed
+        RETURNS:
+            tokens: list of lemmatized tokens
+        """
+        # normalize case and remove punctuation
+        message = re.sub(r"[^a-zA-Z0-9]", " ", text.lower())
+        # tokenize text, lemmatize, strip and remove stop words
+        return [self._lemmatize(word.strip()) 
+            for word in word_tokenize(message) 
+            if word not in self._stop_words]
+
+    def __call__(self, text):
+        """Process text data, see `tokenize_text`."""
+        return pos_tag(self.lemmatize_text(text))
+
+    def tokenize_batch(self, texts, n_jobs=1, chunksize=1000):
+        """Process many texts at once: the part-of-speech tags of all 
+        texts are added in one call to the tagger. With n_jobs > 1, 
+        chunks of texts are processed in a pool of worker processes, each 
+        with the tokenizer of its process (see `_tokenize_chunk`).
+        
+        ARGUMENTS:
+            texts: iterable of str to be processed
+            n_jobs: int, number of worker processes, default is 1 
+                (-1 for one per CPU)
+            chunksize: int, number of texts per chunk sent to a worker
+        RETURNS:
+            tokens: list of processed texts (same order as texts), 
+                equal to [tokenize_text(text) for text in texts]
+        """
+        texts = list(texts)
+        if n_jobs == 1 or len(texts) <= chunksize:
+            return pos_tag_sents([self.lemmatize_text(text) 
+                for text in texts])
+        
+        chunks = [texts[i:i + chunksize] 
+            for i in range(0, len(texts), chunksize)]
+        max_workers = None if n_jobs == -1 else n_jobs
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            l_tokens = executor.map(_tokenize_chunk, chunks)
+            return [tokens for chunk in l_tokens for tokens in chunk]
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer():
+    """Return the tokenizer shared within the process (created on first
+    use)."""
+    return Tokenizer()
+
+
+def _tokenize_chunk(texts):
+    """Process a chunk of texts in a worker process with the tokenizer 
+    of the worker: its resources are loaded and its lemma cache is 
+    filled once for all chunks the worker processes."""
+    return get_tokenizer().tokenize_batch(texts)
+
+
 def tokenize_text(text):
     """Process text data.
     
@@ -103,53 +201,104 @@ def tokenize_text(text):
     RETURNS:
         tokens: processed text
     """
-    lemmatizer = WordNetLemmatizer()
-    stop_words = stopwords.words('english')
+    return get_tokenizer()(text)
+
+
+def tokenize_messages(ids, messages, cache_dir, tokenizer=None, n_jobs=1):
+    """Process messages, the tokens of messages processed before are read 
+    from a cache on disk. The cache is keyed by message id and a checksum
+    of the message (per tokenizer version), new tokens are added to it.
+    
+    ARGUMENTS:
+        ids: iterable of message ids
+        messages: iterable of str to be processed
+        cache_dir: string, directory of the token cache
+        tokenizer: Tokenizer, default is the shared one (`get_tokenizer`)
+        n_jobs: int, number of worker processes for new messages, 
+            default is 1
+    RETURNS:
+        tokens: list of processed messages (same order as messages)
+    """
+    tokenizer = tokenizer or get_tokenizer()
+    messages = list(messages)
+    keys = [(id_, zlib.crc32(message.encode())) 
+        for id_, message in zip(ids, messages)]
+
+    path = os.path.join(cache_dir, 'tokens_v{}.pkl'.format(tokenizer.version))
+    cache = joblib.load(path) if os.path.isfile(path) else {}
     
-    # normalize case and remove punctuation
-    message = re.sub(r"[^a-zA-Z0-9]", " ", text.lower())
-    # tokenize text
-    tokens = word_tokenize(message)
-    # lemmatize, stip and remove stop words
-    tokens = [lemmatizer.lemmatize(word.strip()) \
-        for word in tokens if word not in stop_words]
-    # add part-of-speech tags
-    tokens = pos_tag(tokens)
+    missing = [i for i, key in enumerate(keys) if key not in cache]
+    if missing:
+        tokens = tokenizer.tokenize_batch(
+            [messages[i] for i in missing], n_jobs=n_jobs)
+        cache.update(zip([keys[i] for i in missing], tokens))
+        # write to a temporary file first, readers never see a partial one
+        os.makedirs(cache_dir, exist_ok=True)
+        path_tmp = '{}.{}.tmp'.format(path, os.getpid())
+        joblib.dump(cache, path_tmp)
+        os.replace(path_tmp, path)
     
+    return [cache[key] for key in keys]
+
+
+class MessageTokenizer(BaseEstimator, TransformerMixin):
+    """Custom transformer to tokenize the text column. With a cache_dir
+    the tokens are read from / added to the token cache (see 
+    `tokenize_messages`), so every message is only processed once.
+    """
+
+    def __init__(self, column='message', id_column='id', cache_dir=None,
+            n_jobs=1):
+        self.column = column
+        self.id_column = id_column
+        self.cache_dir = cache_dir
+        self.n_jobs = n_jobs
+
+    def fit(self, X_train, y_train=None):
+        return self
+
+    def transform(self, X_train):
+        if self.cache_dir is None or self.id_column not in X_train:
+            return get_tokenizer().tokenize_batch(
+                X_train[self.column], n_jobs=self.n_jobs)
+        return tokenize_messages(X_train[self.id_column], 
+            X_train[self.column], self.cache_dir, n_jobs=self.n_jobs)
+
+
+def analyze_tokens(tokens):
+    """Analyzer for the vectorizer, the messages are tokenized already."""
     return tokens
 
 
-def build_model(cv=StratifiedKFold(3)):
-    """Build a full nlp classification pipeline with GridSearchCV
-       for best parameters.
+PARAMETERS = {
+    'features__text__vect__max_df': [0.8, 0.9],
+    }
+
+
+def build_pipeline(memory=None, token_cache_dir=None):
+    """Build the full nlp classification pipeline (not fitted).
     
     ARGUMENTS:
-        X_train: training features (df or array)
-        y_train: training labels (df or array)
-        cv: type of CV, default is StratifiedKFold(3)
+        memory: Memory to cache the pipeline transformers, default None
+        token_cache_dir: string, directory of the token cache, default 
+            is None (no caching, see `MessageTokenizer`)
         
     RETURNS:
-        cv: grid search object that can be fitted to the data to 
-        transform it and find the best parameters.
+        full_pipe: pipeline with steps 'features' and 'clf'
     """
     
-    
-   # define classifier and scoring function  
+    # define classifier
     clf = SGDClassifier(loss='log', fit_intercept=False, 
         class_weight='balanced', max_iter=5, tol=None, 
         random_state=1, n_jobs=-1)
-    scorer = make_scorer(f1_score, average='weighted')
-    
-    # create temporary folder to store pipeline transformers (cache)
-    cachedir = mkdtemp()
-    memory = Memory(location=cachedir, verbose=1)
     
     full_pipe = Pipeline([
     ('features', FeatureUnion([
 
         ('text', Pipeline([
-            ('text_select', MessageSelector('message')),
-            ('vect', CountVectorizer(tokenizer=tokenize_text)),
+            ('tokenize', MessageTokenizer('message', 
+                cache_dir=token_cache_dir)),
+            ('vect', CountVectorizer(analyzer=analyze_tokens)),
             ('tfidf', TfidfTransformer()),
         ])),
 
@@ -163,21 +312,327 @@ def build_model(cv=StratifiedKFold(3)):
         
     memory=memory)
     
+    return full_pipe
+
+
+def build_model(cv=StratifiedKFold(3), cachedir=None, token_cache_dir=None):
+    """Build a full nlp classification pipeline with GridSearchCV
+       for best parameters.
+    
+    ARGUMENTS:
+        X_train: training features (df or array)
+        y_train: training labels (df or array)
+        cv: type of CV, default is StratifiedKFold(3)
+        cachedir: string, directory to cache the pipeline transformers 
+            in, default is None (no caching). It is not removed.
+        token_cache_dir: string, directory of the token cache, default 
+            is None (no caching, see `MessageTokenizer`)
+        
+    RETURNS:
+        cv: grid search object that can be fitted to the data to 
+        transform it and find the best parameters.
+    """
+    
+    # define scoring function  
+    scorer = make_scorer(f1_score, average='weighted')
     
-    parameters = {
-        'features__text__vect__max_df': [0.8, 0.9],
-        }
+    # cache pipeline transformers
+    memory = Memory(location=cachedir, verbose=1)
+    full_pipe = build_pipeline(memory, token_cache_dir)
     
     # create grid search object
-    cv = GridSearchCV(full_pipe, param_grid=parameters, 
+    cv = GridSearchCV(full_pipe, param_grid=PARAMETERS, 
             scoring=scorer, cv=cv, error_score='raise', 
             n_jobs=1, verbose=1)
             
     return cv
 
-    # delete the temporary cache before exiting
-    rmtree(cachedir)
+
+# parallel training
+
+def _fit_label(clf, features_filepath, y):
+    """Fit clf to one label on the memory-mapped feature matrix (worker 
+    function)."""
+    features = joblib.load(features_filepath, mmap_mode='r')
+    return clf.fit(features, y)
+
+
+def _fit_predict_label(clf, features_filepath, y_train):
+    """Fit clf to one label on the memory-mapped training features of a 
+    fold and return its predictions for the validation rows (worker 
+    function, the fitted clf is not sent back)."""
+    features = joblib.load(features_filepath, mmap_mode='r')
+    clf.fit(features['train'], y_train)
+    return clf.predict(features['test'])
+
+
+def grid_search_parallel(X_train, Y_train, parameters=PARAMETERS, cv=3, 
+        token_cache_dir=None, n_jobs=-1):
+    """Grid search over the pipeline of `build_pipeline`, with the fits 
+    of all labels, folds and parameter candidates run in parallel in a 
+    pool of worker processes. The features are fitted once per candidate 
+    and fold on the training rows of the fold only (vocabulary and idf 
+    never see the validation rows) and shared with the label tasks as 
+    memory-mapped file. The best candidate is refitted on the whole 
+    training set, again with the labels in parallel.
+    
+    ARGUMENTS:
+        X_train: training features (df)
+        Y_train: training labels (array)
+        parameters: dict, parameter grid for the pipeline
+        cv: int or cross-validation generator, default is 3
+        token_cache_dir: string, directory of the token cache
+        n_jobs: int, number of worker processes, default -1 (all CPUs)
+        
+    RETURNS:
+        model: fitted pipeline with the best parameters
+        cv_results: dataframe with the score per candidate
+    """
+    folds = list(check_cv(cv, Y_train, classifier=True).split(
+        X_train, Y_train))
+    l_pipes = [build_pipeline(token_cache_dir=token_cache_dir).set_params(
+        **params) for params in ParameterGrid(parameters)]
+    n_labels = Y_train.shape[1]
     
+    with TemporaryDirectory() as tmpdir:
+        # vectorize once per candidate and fold, fitted on its train rows
+        paths = {}
+        for i, pipe in enumerate(l_pipes):
+            for fold, (train_index, test_index) in enumerate(folds):
+                features = clone(pipe.named_steps['features'])
+                path = os.path.join(tmpdir, 
+                    'features_{}_{}.pkl'.format(i, fold))
+                joblib.dump({
+                    'train': sp.csr_matrix(features.fit_transform(
+                        X_train.iloc[train_index])),
+                    'test': sp.csr_matrix(features.transform(
+                        X_train.iloc[test_index])),
+                    }, path)
+                paths[(i, fold)] = path
+        
+        tasks = [(i, fold, j) for i in range(len(l_pipes)) 
+            for fold in range(len(folds)) for j in range(n_labels)]
+        results = joblib.Parallel(n_jobs=n_jobs, verbose=1)(
+            joblib.delayed(_fit_predict_label)(
+                clone(l_pipes[i].named_steps['clf'].estimator), 
+                paths[(i, fold)], Y_train[folds[fold][0], j])
+            for i, fold, j in tasks)
+        Y_preds = dict(zip(tasks, results))
+        
+        # score every candidate as GridSearchCV with the weighted f1
+        scores = np.zeros((len(l_pipes), len(folds)))
+        for i in range(len(l_pipes)):
+            for fold, (_, test_index) in enumerate(folds):
+                Y_pred = np.column_stack(
+                    [Y_preds[(i, fold, j)] for j in range(n_labels)])
+                scores[i, fold] = f1_score(Y_train[test_index], Y_pred, 
+                    average='weighted')
+        best = int(np.argmax(scores.mean(axis=1)))
+        
+        # refit the best candidate on all rows, the labels in parallel
+        model = l_pipes[best]
+        path = os.path.join(tmpdir, 'features.pkl')
+        joblib.dump(sp.csr_matrix(
+            model.named_steps['features'].fit_transform(X_train)), path)
+        multi_clf = model.named_steps['clf']
+        multi_clf.estimators_ = joblib.Parallel(n_jobs=n_jobs, verbose=1)(
+            joblib.delayed(_fit_label)(clone(multi_clf.estimator), 
+                path, Y_train[:, j])
+            for j in range(n_labels))
+        multi_clf.set_params(n_jobs=n_jobs)
+        
+    cv_results = pd.DataFrame({
+        'params': list(ParameterGrid(parameters)),
+        'mean_test_score': scores.mean(axis=1),
+        'std_test_score': scores.std(axis=1),
+        })
+    
+    return model, cv_results
+    
+
+# streaming (out-of-core) training
+
+# messages with an id divisible by HOLDOUT_MODULO are never trained on 
+# in streaming mode, they are the test set
+HOLDOUT_MODULO = 5
+GENRES = ['direct', 'news', 'social']
+
+
+def iter_message_chunks(database_filepath, chunksize=10000):
+    """Read the 'messages' table in chunks, never loading it entirely.
+    
+    ARGUMENTS:
+        database_filepath: string
+        chunksize: int, number of messages per chunk
+    RETURNS:
+        chunks: iterator of dataframes
+    """
+    engine = create_engine('sqlite:///' + database_filepath)
+    return pd.read_sql_query('SELECT * FROM messages', engine, 
+        chunksize=chunksize)
+
+
+def is_holdout(ids):
+    """Return a boolean array, True for messages in the streaming test set.
+    """
+    return np.asarray(ids) % HOLDOUT_MODULO == 0
+
+
+def join_tagged_tokens(tokens):
+    """Analyzer for the hashing vectorizer: (word, tag) tuples as strings.
+    """
+    return ['{}/{}'.format(word, tag) for word, tag in tokens]
+
+
+class IncrementalTfidfTransformer(BaseEstimator, TransformerMixin):
+    """Tf-idf weighting (smooth idf, l2 norm, as TfidfTransformer) with 
+    document frequencies that are updated chunk by chunk in partial_fit.
+    
+    ARGUMENTS:
+        n_features: int, number of features of the count matrices
+    """
+
+    def __init__(self, n_features=2**20):
+        self.n_features = n_features
+
+    def partial_fit(self, X, y=None):
+        if not hasattr(self, 'df_'):
+            self.df_ = np.zeros(self.n_features, dtype=np.int64)
+            self.n_docs_ = 0
+        X = sp.csr_matrix(X)
+        X.sum_duplicates()
+        self.df_ += np.bincount(X.nonzero()[1], minlength=self.n_features)
+        self.n_docs_ += X.shape[0]
+        return self
+
+    def fit(self, X, y=None):
+        for attr in ('df_', 'n_docs_'):
+            self.__dict__.pop(attr, None)
+        return self.partial_fit(X)
+
+    def transform(self, X):
+        idf = np.log((1 + self.n_docs_) / (1 + self.df_)) + 1
+        X = sp.csr_matrix(X, dtype=np.float64) * sp.diags(idf)
+        return normalize(X, norm='l2', copy=False)
+
+
+class StreamingClassifier(BaseEstimator):
+    """Out-of-core multi-label classifier for messages: hashed token 
+    counts (no vocabulary), incremental tf-idf, one-hot encoded genre and 
+    one SGD classifier per category, all updated with partial_fit. The 
+    classes of every category are weighted inversely proportional to 
+    their frequency so far (class_weight='balanced' is not supported by 
+    partial_fit).
+    
+    ARGUMENTS:
+        n_features: int, number of hashed token features, default 2**18
+        genres: list of genres to encode, others are ignored
+        alpha: float, regularization of the SGD classifiers
+        n_jobs: int, number of worker processes for tokenizing
+        random_state: int
+    """
+
+    def __init__(self, n_features=2**18, genres=GENRES, alpha=0.0001, 
+            n_jobs=1, random_state=1):
+        self.n_features = n_features
+        self.genres = genres
+        self.alpha = alpha
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+
+    def _init_fit(self, n_labels):
+        self.tfidf_ = IncrementalTfidfTransformer(self.n_features)
+        self.ohe_ = OneHotEncoder(categories=[list(self.genres)], 
+            handle_unknown='ignore').fit(
+            pd.DataFrame({'genre': list(self.genres)}))
+        self.estimators_ = [SGDClassifier(loss='log', fit_intercept=False, 
+            alpha=self.alpha, random_state=self.random_state) 
+            for _ in range(n_labels)]
+        self.class_counts_ = np.zeros((n_labels, 2), dtype=np.int64)
+
+    def _counts(self, X):
+        tokens = get_tokenizer().tokenize_batch(X['message'], 
+            n_jobs=self.n_jobs)
+        vect = HashingVectorizer(analyzer=join_tagged_tokens, 
+            n_features=self.n_features, alternate_sign=False, norm=None)
+        return vect.transform(tokens)
+
+    def _features(self, X, counts):
+        return sp.hstack([self.tfidf_.transform(counts), 
+            self.ohe_.transform(X[['genre']])]).tocsr()
+
+    def partial_fit(self, X, Y):
+        """Update the model with a chunk of messages.
+        
+        ARGUMENTS:
+            X: dataframe with columns 'message' and 'genre'
+            Y: array of binary labels, one column per category
+        RETURNS:
+            self
+        """
+        Y = np.asarray(Y).astype(np.int64)
+        if not hasattr(self, 'estimators_'):
+            self._init_fit(Y.shape[1])
+        
+        counts = self._counts(X)
+        self.tfidf_.partial_fit(counts)
+        features = self._features(X, counts)
+        
+        self.class_counts_ += np.stack([(Y == 0).sum(axis=0), 
+            (Y == 1).sum(axis=0)], axis=1)
+        for j, clf in enumerate(self.estimators_):
+            weights = self.class_counts_[j].sum() / (
+                2. * np.maximum(self.class_counts_[j], 1))
+            clf.partial_fit(features, Y[:, j], classes=np.array([0, 1]), 
+                sample_weight=weights[Y[:, j]])
+        return self
+
+    def predict(self, X):
+        features = self._features(X, self._counts(X))
+        return np.column_stack(
+            [clf.predict(features) for clf in self.estimators_])
+
+
+def train_streaming(database_filepath, model_filepath, update=False, 
+        chunksize=10000):
+    """Train a StreamingClassifier on the messages in the database, chunk 
+    by chunk, evaluate it on the holdout messages (see `is_holdout`) and 
+    save it. With update=True, the model saved in model_filepath is 
+    updated with the messages in the database (e.g. only new ones) 
+    instead of training a new one.
+    
+    ARGUMENTS:
+        database_filepath: string
+        model_filepath: string
+        update: bool, default is False
+        chunksize: int, number of messages per chunk
+    """
+    if update:
+        print('Loading model...\n    MODEL: {}'.format(model_filepath))
+        model = joblib.load(model_filepath)
+    else:
+        model = StreamingClassifier(n_jobs=-1)
+    
+    print('Training model...\n    DATABASE: {}'.format(database_filepath))
+    for chunk in iter_message_chunks(database_filepath, chunksize):
+        chunk = chunk.loc[~is_holdout(chunk['id'])]
+        if len(chunk) > 0:
+            model.partial_fit(chunk, chunk.iloc[:, 4:39].values)
+    
+    print('Evaluating model...')
+    l_test, l_pred = [], []
+    for chunk in iter_message_chunks(database_filepath, chunksize):
+        chunk = chunk.loc[is_holdout(chunk['id'])]
+        if len(chunk) > 0:
+            l_test.append(chunk.iloc[:, 4:39].values)
+            l_pred.append(model.predict(chunk))
+            label_names = chunk.columns[4:39]
+    if l_test:
+        print_report(np.vstack(l_test), np.vstack(l_pred), label_names)
+    
+    print('Saving model...\n    MODEL: {}'.format(model_filepath))
+    save_model(model, model_filepath)
+
 
 def evaluate_model(model, X_test, Y_test, label_names):
     """Calculate and display evaluation metrics (classification report) 
@@ -194,6 +649,17 @@ def evaluate_model(model, X_test, Y_test, label_names):
     """
     
     Y_pred = model.predict(X_test)
+    print_report(Y_test, Y_pred, label_names)
+
+
+def print_report(Y_test, Y_pred, label_names):
+    """Display the multilabel classification report, see `evaluate_model`.
+    
+    ARGUMENTS:
+    Y_test: Array containing actual labels in test set.
+    Y_pred: Array containing predicted labels in test set.
+    label_names: Names of the labels.
+    """
     
     # Calculate classification report
     metrics = classification_report(
@@ -210,35 +676,161 @@ def evaluate_model(model, X_test, Y_test, label_names):
     print(metrics_df)
 
 
-def save_model(model, model_filepath):
+# consolidated linear model
+
+class LinearMultiLabelClassifier(object):
+    """Multi-label linear classifier with the coefficients of all labels 
+    in one (n_features x n_labels) float32 matrix: the labels of a batch 
+    of messages are computed with a single sparse-dense matrix product 
+    instead of one product per label. See `consolidate_model`.
+    
+    ARGUMENTS:
+        features: fitted transformer computing the features
+        coef: array (n_features, n_labels)
+        intercept: array (n_labels,)
+        classes: array (n_labels, 2), classes of the labels for negative 
+            and positive scores
+    """
+
+    def __init__(self, features, coef, intercept, classes):
+        self.features = features
+        self.coef_ = np.ascontiguousarray(coef, dtype=np.float32)
+        self.intercept_ = np.asarray(intercept, dtype=np.float32)
+        self.classes_ = np.asarray(classes)
+
+    def decision_function(self, X):
+        """Return the scores (n_samples, n_labels) for the input of the 
+        features transformer (e.g. a df or a list of messages)."""
+        features = sp.csr_matrix(self.features.transform(X), 
+            dtype=np.float32)
+        return features.dot(self.coef_) + self.intercept_
+
+    def predict(self, X):
+        """Return the labels (n_samples, n_labels), see 
+        `decision_function`."""
+        is_positive = (self.decision_function(X) > 0).astype(int)
+        return np.take_along_axis(self.classes_.T, is_positive, axis=0)
+
+
+def consolidate_model(model):
+    """Consolidate a fitted pipeline with a MultiOutputClassifier of 
+    binary linear classifiers (e.g. SGD) as last step into a compact 
+    LinearMultiLabelClassifier. The terms dropped by the vectorizers 
+    (`stop_words_`, only needed for introspection) are not kept. Scores 
+    are computed in float32, labels of messages with a score close to 0 
+    may differ from the pipeline.
+    
+    ARGUMENTS:
+        model: fitted pipeline or grid search object
+    RETURNS:
+        model: LinearMultiLabelClassifier
+    """
+    model = getattr(model, 'best_estimator_', model)
+    estimators = model.steps[-1][1].estimators_
+    if not all(hasattr(clf, 'coef_') and clf.coef_.shape[0] == 1 
+            for clf in estimators):
+        raise ValueError('Only binary linear classifiers can be '
+            'consolidated')
+    
+    features = copy.deepcopy(Pipeline(model.steps[:-1]))
+    for step in features.get_params(deep=True).values():
+        if isinstance(step, CountVectorizer) and hasattr(step, 'stop_words_'):
+            del step.stop_words_
+    
+    return LinearMultiLabelClassifier(features, 
+        coef=np.hstack([clf.coef_.T for clf in estimators]), 
+        intercept=np.hstack([np.broadcast_to(clf.intercept_, 1) 
+            for clf in estimators]), 
+        classes=np.vstack([clf.classes_ for clf in estimators]))
+
+
+def save_model(model, model_filepath, consolidate=False):
     """Save fitted model.
     
     ARGUMENTS:
         model: variable name for model
         model_filepath: sring
+        consolidate: bool, save the model as compact 
+            LinearMultiLabelClassifier (see `consolidate_model`), 
+            default is False
     """
     
+    if consolidate:
+        model = consolidate_model(model)
     joblib.dump(model, model_filepath)
 
 
+def check_consolidated_model(model, X_test):
+    """Raise a ValueError if the labels of the consolidated model (see 
+    `consolidate_model`) differ from the labels of the fitted pipeline. 
+    Labels of messages with a score close to 0 (float32 rounding) are 
+    allowed to differ.
+    
+    ARGUMENTS:
+        model: fitted pipeline or grid search object
+        X_test: df with the columns of the training data
+    """
+    consolidated = consolidate_model(model)
+    Y_pred = model.predict(X_test)
+    is_different = consolidated.predict(X_test) != Y_pred
+    if is_different.any():
+        scores = consolidated.decision_function(X_test)
+        if np.abs(scores[is_different]).max() > 1e-4:
+            raise ValueError('Labels of the consolidated model differ '
+                'from the labels of the pipeline for {} messages'.format(
+                    is_different.any(axis=1).sum()))
+
+
 def main():
-    if len(sys.argv) == 3:
-        database_filepath, model_filepath = sys.argv[1:]
+    mode = sys.argv[3] if len(sys.argv) == 4 else None
+    if mode in ('--streaming', '--update'):
+        database_filepath, model_filepath, mode = sys.argv[1:]
+        train_streaming(database_filepath, model_filepath, 
+            update=mode == '--update')
+        print('Trained model saved!')
+
+    elif len(sys.argv) == 3 or mode == '--parallel':
+        database_filepath, model_filepath = sys.argv[1:3]
         print('Loading data...\n    DATABASE: {}'.format(database_filepath))
         X_train, Y_train, X_test, Y_test, label_names = \
             load_split_data(database_filepath)
 
-        print('Building model...')
-        model = build_model(cv=3)
-        
-        print('Training model...')
-        model.fit(X_train, Y_train)
+        # tokenize every message once, the folds read the token cache
+        token_cache_dir = os.path.join(
+            os.path.dirname(os.path.abspath(database_filepath)), 
+            'token_cache')
+        print('Tokenizing messages...\n    CACHE: {}'.format(token_cache_dir))
+        X_all = pd.concat([X_train, X_test])
+        tokenize_messages(X_all['id'], X_all['message'], token_cache_dir, 
+            n_jobs=-1)
+
+        if mode == '--parallel':
+            print('Training model (parallel)...')
+            model, cv_results = grid_search_parallel(X_train, Y_train, 
+                token_cache_dir=token_cache_dir)
+            print(cv_results)
+            estimator = model
+
+        else:
+            # the pipeline cache is removed after training
+            with TemporaryDirectory() as cachedir:
+                print('Building model...')
+                model = build_model(cv=3, cachedir=cachedir, 
+                    token_cache_dir=token_cache_dir)
+                
+                print('Training model...')
+                model.fit(X_train, Y_train)
+            estimator = model.best_estimator_
         
         print('Evaluating model...')
         evaluate_model(model, X_test, Y_test, label_names)
 
+        # the saved model tokenizes without the local token cache
+        estimator.set_params(features__text__tokenize__cache_dir=None)
+        print('Checking consolidated model...')
+        check_consolidated_model(model, X_test)
         print('Saving model...\n    MODEL: {}'.format(model_filepath))
-        save_model(model, model_filepath)
+        save_model(model, model_filepath, consolidate=True)
 
         print('Trained model saved!')
 
@@ -247,7 +839,11 @@ def main():
               'as 1st argument and filepath of pickle file to '\
               'save the model to as 2nd argument. \n\nExample: python '\
               'train_classifier.py ../data/DisasterResponse.db '\
-              'classifier.pkl')
+              'classifier.pkl\n\nAdd --parallel as 3rd argument to fit '\
+              'the labels and folds in parallel (one vectorization per '\
+              'candidate), --streaming to train '\
+              'out-of-core on chunks of messages, or --update to update a '\
+              'streaming model with the messages in the database.')
 
 
 if __name__ == '__main__':